@@ -0,0 +1,197 @@
+"""
+Evaluation of code in the background (for evalAsync actions), so that e.g. generating stimuli or
+loading large files doesn't freeze the GUI.
+
+Code runs against a snapshot of the locals it refers to (and, as for eval actions, of the globals it
+refers to, e.g. modules such as os and time), and only the declared outputs are merged back into the
+experiment's locals, on the GUI thread, once it finishes. In a thread, the snapshot
+holds the same objects as the experiment's locals, so these shouldn't be modified by other cells
+while the code runs; in a process (for CPU-bound pure Python code, which would otherwise hold the
+GIL), inputs and outputs are pickled, so must be picklable, and modules are imported again by name.
+"""
+import ast
+import collections
+import concurrent.futures
+import importlib
+import logging
+import multiprocessing
+import time
+import types
+import typing as tp
+
+import attr
+from qtpy import QtCore
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.Misc import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+def getReferencedNames(code: str) -> tp.Set[str]:
+    """
+    Names that code may read, e.g. to determine which locals it needs.
+    """
+    return {node.id for node in ast.walk(ast.parse(code, mode='exec'))
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+
+
+def _evaluate(code: str,
+              inputs: tp.Dict[str, tp.Any],
+              outputs: tp.Sequence[str],
+              modules: tp.Optional[tp.Dict[str, str]] = None) -> tp.Dict[str, tp.Any]:
+    # module-level so that it can be run in a process pool, where modules (name -> module name) are imported again
+    namespace = dict()
+    if modules is not None:
+        for name, moduleName in modules.items():
+            namespace[name] = importlib.import_module(moduleName)
+    namespace.update(inputs)
+    exec(compile(code, '<evalAsync>', 'exec'), namespace)
+    missing = [name for name in outputs if name not in namespace]
+    if len(missing) > 0:
+        raise NameError('Outputs not assigned: %s' % (', '.join(missing),))
+    return {name: namespace[name] for name in outputs}
+
+
+class AsyncEvalState:
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class AsyncEvaluation:
+    name: str
+    code: str
+    outputs: tp.List[str]
+    inProcess: bool
+    state: str = AsyncEvalState.RUNNING
+    startTime: float = attr.ib(factory=time.monotonic)
+    endTime: tp.Optional[float] = None
+    error: tp.Optional[BaseException] = None
+    future: tp.Optional[concurrent.futures.Future] = attr.ib(default=None, repr=False)
+
+    @property
+    def isFinished(self) -> bool:
+        return self.state in AsyncEvalState.FINISHED
+
+    @property
+    def duration(self) -> float:
+        return (time.monotonic() if self.endTime is None else self.endTime) - self.startTime
+
+    def __str__(self):
+        s = '%s %s after %.2f s' % (self.name, self.state, self.duration)
+        if self.error is not None:
+            s += ': %s: %s' % (type(self.error).__name__, self.error)
+        return s
+
+
+class _AsyncEvalSignals(QtCore.QObject):
+    sigFinished = QtCore.Signal(object)  # emits AsyncEvaluation, after outputs were merged into locals
+
+    _sigDone = QtCore.Signal(object, object)  # emits (AsyncEvaluation, Future), from worker thread
+
+
+@attr.s(auto_attribs=True, eq=False)
+class AsyncEvaluator(metaclass=Singleton):
+    signals: _AsyncEvalSignals = attr.ib(init=False, factory=_AsyncEvalSignals)
+    _evaluations: tp.OrderedDict[str, AsyncEvaluation] = attr.ib(init=False, factory=collections.OrderedDict)
+    _locals: tp.Dict[str, tp.Dict[str, tp.Any]] = attr.ib(init=False, factory=dict)  # keyed by evaluation name
+    _threadPool: tp.Optional[concurrent.futures.ThreadPoolExecutor] = attr.ib(init=False, default=None)
+    _processPool: tp.Optional[concurrent.futures.ProcessPoolExecutor] = attr.ib(init=False, default=None)
+    wasSessionRestored: bool = attr.ib(init=False, default=False)  # set once resumed from a journal, whose evaluations are unknown here
+
+    def __attrs_post_init__(self):
+        self.signals._sigDone.connect(self._onDone)  # queued, since emitted from worker threads
+
+    @property
+    def evaluations(self) -> tp.List[AsyncEvaluation]:
+        return list(self._evaluations.values())
+
+    def get(self, name: str) -> AsyncEvaluation:
+        try:
+            return self._evaluations[name]
+        except KeyError:
+            raise KeyError('No evalAsync named %s' % (name,))
+
+    def submit(self,
+               name: str,
+               code: str,
+               outputs: tp.Sequence[str],
+               locals: tp.Dict[str, tp.Any],
+               inProcess: bool = False,
+               globals: tp.Optional[tp.Dict[str, tp.Any]] = None) -> AsyncEvaluation:
+        """
+        Start evaluating code against the locals (or, if not in locals, globals) it refers to. Once
+        finished, outputs are assigned in locals (which should be the experiment's locals, not a copy).
+        """
+        if name in self._evaluations and not self._evaluations[name].isFinished:
+            raise ValueError('evalAsync %s is still running' % (name,))
+        compile(code, '<evalAsync>', 'exec')  # raise any syntax error now rather than later
+        referencedNames = getReferencedNames(code)
+        inputs = {key: globals[key] for key in referencedNames if globals is not None and key in globals}
+        inputs.update({key: locals[key] for key in referencedNames if key in locals})
+        modules = None
+        if inProcess:
+            modules = {key: val.__name__ for key, val in inputs.items() if isinstance(val, types.ModuleType)}
+            for key in modules:
+                del inputs[key]
+
+        evaluation = AsyncEvaluation(name=name, code=code, outputs=list(outputs), inProcess=inProcess)
+        self._evaluations.pop(name, None)
+        self._evaluations[name] = evaluation
+        self._locals[name] = locals
+        evaluation.future = self._getPool(inProcess).submit(_evaluate, code, inputs, evaluation.outputs, modules)
+        evaluation.future.add_done_callback(lambda future, evaluation=evaluation: self.signals._sigDone.emit(evaluation, future))
+        logger.info('Started evalAsync %s in %s with inputs %s' % (
+            name, 'process' if inProcess else 'thread',
+            ', '.join(sorted(key for key, val in inputs.items() if not isinstance(val, types.ModuleType))) or '(none)'))
+        return evaluation
+
+    def shutdown(self):
+        for pool in (self._threadPool, self._processPool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._threadPool = None
+        self._processPool = None
+
+    def onConfigurationChanged(self, keys: tp.Set[str]):
+        if 'AsyncEvalMaxWorkers' in keys:
+            # evaluations already submitted still finish in the previous pools
+            for pool in (self._threadPool, self._processPool):
+                if pool is not None:
+                    pool.shutdown(wait=False)
+            self._threadPool = None
+            self._processPool = None
+
+    def _getPool(self, inProcess: bool) -> concurrent.futures.Executor:
+        numWorkers = globalConfiguration.AsyncEvalMaxWorkers
+        if inProcess:
+            if self._processPool is None:
+                # spawn rather than fork a process that has Qt and other threads running
+                self._processPool = concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers,
+                                                                           mp_context=multiprocessing.get_context('spawn'))
+            return self._processPool
+        else:
+            if self._threadPool is None:
+                self._threadPool = concurrent.futures.ThreadPoolExecutor(max_workers=numWorkers, thread_name_prefix='EvalAsync')
+            return self._threadPool
+
+    def _onDone(self, evaluation: AsyncEvaluation, future: concurrent.futures.Future):
+        evaluation.endTime = time.monotonic()
+        locals = self._locals.pop(evaluation.name, None) if self._evaluations.get(evaluation.name) is evaluation else None
+        if future.cancelled():
+            evaluation.state = AsyncEvalState.CANCELLED
+        elif future.exception() is not None:
+            evaluation.state = AsyncEvalState.FAILED
+            evaluation.error = future.exception()
+        else:
+            if locals is not None:
+                locals.update(future.result())
+            evaluation.state = AsyncEvalState.SUCCEEDED
+        logger.log(logging.ERROR if evaluation.state == AsyncEvalState.FAILED else logging.INFO,
+                   'evalAsync %s' % (evaluation,))
+        self.signals.sigFinished.emit(evaluation)
@@ -0,0 +1,206 @@
+import typing as tp
+import attr
+import ast
+import logging
+import os
+import time
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.ExperimentActions import ExperimentAction
+from ExperimentAutomator.Misc import Singleton
+from .AudioClip import AudioClip, AudioClipCache
+from .AudioBackends import AudioBackend, CueRecord, NullAudioBackend, WavFileAudioBackend, QtAudioBackend
+
+logger = logging.getLogger(__name__)
+
+_audioExtensions = ('.wav', '.wave')
+
+
+@attr.s(auto_attribs=True)
+class AudioPlayer(metaclass=Singleton):
+    """
+    Singleton owning the decoded audio cache and the output backends, as set by configuration
+    value AudioBackend ('qt', 'null', or 'wavFile', which writes to AudioWavFileBackendPath).
+
+    Speech plays through a separate backend instance from audio cues, so that neither cuts off
+    the other and stopping cues does not silence speech. (With 'wavFile', speech is written
+    next to AudioWavFileBackendPath with a '_speech' suffix.)
+    """
+    _backend: tp.Optional[AudioBackend] = attr.ib(init=False, default=None)
+    _speechBackend: tp.Optional[AudioBackend] = attr.ib(init=False, default=None)
+    _cache: tp.Optional[AudioClipCache] = attr.ib(init=False, default=None)
+
+    def _getCache(self) -> AudioClipCache:
+        if self._cache is None:
+            self._cache = AudioClipCache(maxBytes=int(globalConfiguration.AudioCacheMB * 2**20))
+        return self._cache
+
+    def _createBackend(self, wavFileSuffix: str = '') -> AudioBackend:
+        backendName = globalConfiguration.AudioBackend
+        if backendName == 'qt':
+            backend = QtAudioBackend()
+        elif backendName == 'null':
+            backend = NullAudioBackend()
+        elif backendName == 'wavFile':
+            root, ext = os.path.splitext(globalConfiguration.AudioWavFileBackendPath)
+            backend = WavFileAudioBackend(outputPath=root + wavFileSuffix + ext)
+        else:
+            raise ValueError('Unsupported audio backend: %s' % (backendName,))
+        backend.sigCueStarted.connect(self._onCueStarted)
+        return backend
+
+    def _getBackend(self) -> AudioBackend:
+        if self._backend is None:
+            self._backend = self._createBackend()
+        return self._backend
+
+    def _getSpeechBackend(self) -> AudioBackend:
+        if self._speechBackend is None:
+            self._speechBackend = self._createBackend(wavFileSuffix='_speech')
+        return self._speechBackend
+
+    @property
+    def backend(self) -> AudioBackend:
+        return self._getBackend()
+
+    @property
+    def speechBackend(self) -> AudioBackend:
+        return self._getSpeechBackend()
+
+    def preload(self, paths: tp.Iterable[str]) -> tp.List[AudioClip]:
+        clips = self._getCache().preload(paths)
+        backend = self._getBackend()
+        for clip in clips:
+            backend.prepare(clip)
+        return clips
+
+    def play(self, path: str) -> CueRecord:
+        requestTimeNs = time.perf_counter_ns()
+        clip = self._getCache().get(path)
+        return self._getBackend().play(clip, requestTimeNs=requestTimeNs)
+
+    def playSpeech(self, path: str) -> CueRecord:
+        requestTimeNs = time.perf_counter_ns()
+        clip = self._getCache().get(path)
+        return self._getSpeechBackend().play(clip, requestTimeNs=requestTimeNs)
+
+    def stop(self):
+        if self._backend is not None:
+            self._backend.stop()
+
+    def stopSpeech(self):
+        if self._speechBackend is not None:
+            self._speechBackend.stop()
+
+    @property
+    def cueLog(self) -> tp.List[CueRecord]:
+        return [] if self._backend is None else self._backend.cueLog
+
+    def onConfigurationChanged(self, keys: tp.Set[str]):
+        if self._cache is not None and 'AudioCacheMB' in keys:
+            self._cache.setMaxBytes(int(globalConfiguration.AudioCacheMB * 2**20))
+        if (self._backend is not None or self._speechBackend is not None) \
+                and len(keys & {'AudioBackend', 'AudioWavFileBackendPath'}) > 0:
+            logger.warning('Audio backend settings changed, but only take effect after restarting')
+
+    def _onCueStarted(self, record: CueRecord):
+        logger.info('Audio %s started %.1f ms after request' % (record.description, record.latency * 1e3))
+
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+        if self._speechBackend is not None:
+            self._speechBackend.close()
+            self._speechBackend = None
+        if self._cache is not None:
+            self._cache.clear()
+
+
+def _literalAudioPath(argStr: str) -> tp.Optional[str]:
+    """
+    Returns the audio path a table cell refers to if it can be determined without evaluating any
+    variables, else None.
+    """
+    try:
+        path = ast.literal_eval(argStr)
+    except (ValueError, SyntaxError):
+        path = argStr  # e.g. an unquoted path, which _evalStr falls back to
+    if not isinstance(path, str) or os.path.splitext(path)[1].lower() not in _audioExtensions:
+        return None
+    return path
+
+
+@attr.s(auto_attribs=True)
+class AudioAction(ExperimentAction):
+    """
+    Play short audio cues from WAV files decoded in advance, e.g.:
+        play <path>  (continues to next action immediately)
+        playAndWait <path>
+        preload <path or list of paths>
+        stop
+    """
+    key: tp.ClassVar[str] = 'audio'
+    cmd: str = ''
+
+    _record: tp.Optional[CueRecord] = attr.ib(init=False, default=None)
+
+    def _start(self):
+        player = AudioPlayer()
+        cmdAndArgs = self.cmd.split(' ', maxsplit=1)
+        cmd = cmdAndArgs[0]
+        args = cmdAndArgs[1:]
+
+        if cmd in ('play', 'playAndWait'):
+            assert len(args) == 1
+            path = self._evalStr(args[0])
+            self._record = player.play(path)
+            if cmd == 'playAndWait':
+                player.backend.sigCueFinished.connect(self._onCueFinished)
+                return
+        elif cmd == 'preload':
+            assert len(args) == 1
+            paths = self._evalStr(args[0])
+            if isinstance(paths, str):
+                paths = [paths]
+            player.preload(paths)
+            logger.info('Preloaded %d audio files' % (len(paths),))
+        elif cmd == 'stop':
+            assert len(args) == 0
+            player.stop()
+        else:
+            raise NotImplementedError()
+
+        self._onStop()
+
+    def _onCueFinished(self, record: CueRecord):
+        if record is not self._record:
+            return
+        AudioPlayer().backend.sigCueFinished.disconnect(self._onCueFinished)
+        self._onStop()
+
+    def stop(self):
+        if self._record is not None and self._record.endTimeNs is None:
+            logger.debug('Audio stopped early')
+            AudioPlayer().stop()  # triggers _onCueFinished
+        elif not self.didStop:
+            self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(cmd=s, **kwargs)
+
+    @classmethod
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        # decode all constant cues now, rather than when first played
+        paths = []
+        for argStr in argStrs:
+            cmdAndArgs = argStr.split(' ', maxsplit=1)
+            if cmdAndArgs[0] not in ('play', 'playAndWait') or len(cmdAndArgs) < 2:
+                continue
+            path = _literalAudioPath(cmdAndArgs[1])
+            if path is not None and path not in paths:
+                paths.append(path)
+        if len(paths) > 0:
+            AudioPlayer().preload(paths)
+            logger.info('Preloaded %d audio cues' % (len(paths),))
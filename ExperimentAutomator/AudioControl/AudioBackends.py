@@ -0,0 +1,254 @@
+"""
+Output backends for AudioPlayer. Each plays one cue at a time; starting a cue stops any cue
+still playing.
+
+- QtAudioBackend: plays through the default (or a named) output device using QtMultimedia.
+- NullAudioBackend: plays nothing, but reports cues as starting immediately and finishing after
+  their duration, for exercising timing and buffering logic without a sound card.
+- WavFileAudioBackend: like NullAudioBackend, but also writes everything "played" to a WAV file,
+  with each cue placed at the time it was requested, for checking cue timing offline.
+"""
+import logging
+import time
+import typing as tp
+import wave
+
+import attr
+from qtpy import QtCore
+
+from .AudioClip import AudioClip
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class CueRecord:
+    description: str
+    duration: float  # in s
+    requestTimeNs: int  # time.perf_counter_ns() when play was requested
+    onsetTimeNs: tp.Optional[int] = None  # time.perf_counter_ns() when output of the cue started
+    endTimeNs: tp.Optional[int] = None
+    wasInterrupted: bool = False
+
+    @property
+    def latency(self) -> tp.Optional[float]:
+        if self.onsetTimeNs is None:
+            return None
+        return (self.onsetTimeNs - self.requestTimeNs) / 1e9
+
+
+class AudioBackend(QtCore.QObject):
+    sigCueStarted = QtCore.Signal(object)  # emits CueRecord once onset is known
+    sigCueFinished = QtCore.Signal(object)  # emits CueRecord
+
+    def __init__(self, parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self.cueLog: tp.List[CueRecord] = []
+        self._current: tp.Optional[CueRecord] = None
+
+    @property
+    def isPlaying(self) -> bool:
+        return self._current is not None
+
+    def prepare(self, clip: AudioClip):
+        """
+        Do any setup needed to play clips of this format, so that it isn't done when first playing
+        one. Default does nothing.
+        """
+        pass
+
+    def play(self, clip: AudioClip, requestTimeNs: tp.Optional[int] = None) -> CueRecord:
+        record = CueRecord(description=clip.description, duration=clip.duration,
+                           requestTimeNs=time.perf_counter_ns() if requestTimeNs is None else requestTimeNs)
+        if self._current is not None:
+            self._stopCurrent(wasInterrupted=True)
+        self._current = record
+        self.cueLog.append(record)
+        self._play(clip, record)
+        return record
+
+    def stop(self):
+        if self._current is not None:
+            self._stopCurrent(wasInterrupted=True)
+
+    def close(self):
+        self.stop()
+
+    def _play(self, clip: AudioClip, record: CueRecord):
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def _stopOutput(self):
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def _onStarted(self, record: CueRecord):
+        record.onsetTimeNs = time.perf_counter_ns()
+        self.sigCueStarted.emit(record)
+
+    def _stopCurrent(self, wasInterrupted: bool):
+        record, self._current = self._current, None
+        self._stopOutput()
+        record.endTimeNs = time.perf_counter_ns()
+        record.wasInterrupted = wasInterrupted
+        self.sigCueFinished.emit(record)
+
+
+class NullAudioBackend(AudioBackend):
+    def __init__(self, parent: tp.Optional[QtCore.QObject] = None):
+        AudioBackend.__init__(self, parent=parent)
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self._timer.timeout.connect(lambda: self._stopCurrent(wasInterrupted=False))
+
+    def _play(self, clip: AudioClip, record: CueRecord):
+        self._onStarted(record)
+        self._timer.start(round(clip.duration * 1e3))
+
+    def _stopOutput(self):
+        self._timer.stop()
+
+
+class WavFileAudioBackend(NullAudioBackend):
+    def __init__(self, outputPath: str, parent: tp.Optional[QtCore.QObject] = None):
+        NullAudioBackend.__init__(self, parent=parent)
+        self._outputPath = outputPath
+        self._file: tp.Optional[wave.Wave_write] = None
+        self._format: tp.Optional[tp.Tuple[int, int, int]] = None
+        self._startTimeNs: tp.Optional[int] = None
+        self._numFramesWritten = 0
+        self._pendingFrames = b''  # remainder of current cue, written once the next cue's position is known
+
+    def _play(self, clip: AudioClip, record: CueRecord):
+        if self._file is None:
+            self._file = wave.open(self._outputPath, 'wb')
+            self._file.setframerate(clip.sampleRate)
+            self._file.setnchannels(clip.numChannels)
+            self._file.setsampwidth(clip.sampleWidth)
+            self._format = clip.format
+            self._startTimeNs = record.requestTimeNs
+            logger.info('Writing audio cues to %s' % (self._outputPath,))
+        elif clip.format != self._format:
+            raise ValueError('Format of %s %s does not match format of earlier cues %s' % (
+                clip.description, clip.format, self._format))
+
+        # pad with silence up to the time this cue was requested
+        bytesPerFrame = clip.bytesPerFrame
+        iOnsetFrame = round((record.requestTimeNs - self._startTimeNs) / 1e9 * clip.sampleRate)
+        self._writeFrames(max(0, iOnsetFrame - self._numFramesWritten) * bytesPerFrame)
+        self._pendingFrames = clip.frames
+        NullAudioBackend._play(self, clip, record)
+
+    def _stopCurrent(self, wasInterrupted: bool):
+        record = self._current
+        NullAudioBackend._stopCurrent(self, wasInterrupted=wasInterrupted)
+        if wasInterrupted:
+            # keep only what would have been output before the cue was stopped
+            numFrames = round((record.endTimeNs - record.onsetTimeNs) / 1e9 * self._format[0])
+            self._pendingFrames = self._pendingFrames[:numFrames * self._format[1] * self._format[2]]
+        self._flushPending()
+
+    def _writeFrames(self, numSilentBytes: int):
+        self._flushPending()
+        if numSilentBytes > 0:
+            silence = (b'\x80' if self._format[2] == 1 else b'\x00') * numSilentBytes
+            self._file.writeframesraw(silence)
+            self._numFramesWritten += numSilentBytes // (self._format[1] * self._format[2])
+
+    def _flushPending(self):
+        if len(self._pendingFrames) > 0:
+            self._file.writeframesraw(self._pendingFrames)
+            self._numFramesWritten += len(self._pendingFrames) // (self._format[1] * self._format[2])
+            self._pendingFrames = b''
+
+    def close(self):
+        NullAudioBackend.close(self)
+        if self._file is not None:
+            self._flushPending()
+            self._file.close()  # updates header with final length
+            self._file = None
+
+
+class QtAudioBackend(AudioBackend):
+    """
+    Onset is taken as the time the audio sink starts pulling the cue's data, and so does not
+    include any buffering in the driver or device.
+
+    An audio sink is kept open for each format played, so only the first cue of each format (or
+    a call to prepare()) pays for opening the device.
+    """
+
+    def __init__(self, deviceDescription: tp.Optional[str] = None, parent: tp.Optional[QtCore.QObject] = None):
+        AudioBackend.__init__(self, parent=parent)
+        from qtpy import QtMultimedia  # imported here since it needs system audio libraries
+        self._QtMultimedia = QtMultimedia
+        self._device = self._findDevice(deviceDescription)
+        self._sinks: tp.Dict[tp.Tuple[int, int, int], tp.Any] = dict()
+        self._currentSink = None
+        self._buffer: tp.Optional[QtCore.QBuffer] = None
+
+    def _findDevice(self, deviceDescription: tp.Optional[str]):
+        QtMultimedia = self._QtMultimedia
+        if deviceDescription is None:
+            return QtMultimedia.QMediaDevices.defaultAudioOutput()
+        devices = QtMultimedia.QMediaDevices.audioOutputs()
+        for device in devices:
+            if device.description() == deviceDescription:
+                return device
+        raise KeyError('No audio output \'%s\' (available: %s)' % (
+            deviceDescription, ', '.join(device.description() for device in devices)))
+
+    def prepare(self, clip: AudioClip):
+        self._getSink(clip)
+
+    def _getSink(self, clip: AudioClip):
+        if clip.format in self._sinks:
+            return self._sinks[clip.format]
+        QtMultimedia = self._QtMultimedia
+        audioFormat = QtMultimedia.QAudioFormat()
+        audioFormat.setSampleRate(clip.sampleRate)
+        audioFormat.setChannelCount(clip.numChannels)
+        audioFormat.setSampleFormat({1: QtMultimedia.QAudioFormat.UInt8,
+                                     2: QtMultimedia.QAudioFormat.Int16,
+                                     4: QtMultimedia.QAudioFormat.Int32}[clip.sampleWidth])
+        if not self._device.isFormatSupported(audioFormat):
+            raise ValueError('Audio output %s does not support format of %s %s' % (
+                self._device.description(), clip.description, clip.format))
+        sink = QtMultimedia.QAudioSink(self._device, audioFormat, self)
+        sink.stateChanged.connect(lambda state, sink=sink: self._onStateChanged(sink, state))
+        self._sinks[clip.format] = sink
+        return sink
+
+    def _play(self, clip: AudioClip, record: CueRecord):
+        sink = self._getSink(clip)
+        self._buffer = QtCore.QBuffer(self)
+        self._buffer.setData(QtCore.QByteArray(clip.frames))
+        self._buffer.open(QtCore.QIODevice.ReadOnly)
+        self._currentSink = sink
+        sink.start(self._buffer)
+
+    def _onStateChanged(self, sink, state):
+        if sink is not self._currentSink or self._current is None:
+            return
+        QAudio = self._QtMultimedia.QAudio
+        if state == QAudio.ActiveState and self._current.onsetTimeNs is None:
+            self._onStarted(self._current)
+        elif state == QAudio.IdleState:
+            # all data has been handed to the device
+            self._stopCurrent(wasInterrupted=False)
+        elif state == QAudio.StoppedState and sink.error() != QAudio.NoError:
+            logger.error('Audio output error %s while playing %s' % (sink.error(), self._current.description))
+            self._stopCurrent(wasInterrupted=True)
+
+    def _stopOutput(self):
+        sink, self._currentSink = self._currentSink, None
+        if sink is not None:
+            sink.stop()
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+    def close(self):
+        AudioBackend.close(self)
+        for sink in self._sinks.values():
+            sink.stop()
+        self._sinks.clear()
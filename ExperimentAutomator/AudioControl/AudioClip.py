@@ -0,0 +1,128 @@
+import collections
+import logging
+import os
+import threading
+import time
+import typing as tp
+import wave
+
+import attr
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class AudioClip:
+    """
+    Decoded PCM audio, ready to be handed to an output device.
+    """
+    description: str
+    frames: bytes  # interleaved samples, little-endian
+    sampleRate: int
+    numChannels: int
+    sampleWidth: int  # in bytes; 1 is unsigned, 2 and 4 are signed
+
+    @property
+    def bytesPerFrame(self) -> int:
+        return self.numChannels * self.sampleWidth
+
+    @property
+    def numFrames(self) -> int:
+        return len(self.frames) // self.bytesPerFrame
+
+    @property
+    def duration(self) -> float:
+        return self.numFrames / self.sampleRate
+
+    @property
+    def format(self) -> tp.Tuple[int, int, int]:
+        return self.sampleRate, self.numChannels, self.sampleWidth
+
+
+def decodeWav(path: str) -> AudioClip:
+    with wave.open(path, 'rb') as f:
+        if f.getcomptype() != 'NONE':
+            raise ValueError('Unsupported compressed WAV file %s' % (path,))
+        sampleRate, numChannels, sampleWidth = f.getframerate(), f.getnchannels(), f.getsampwidth()
+        frames = f.readframes(f.getnframes())
+
+    if sampleWidth == 3:
+        # output devices generally don't support packed 24-bit samples, so pad to 32-bit
+        samples = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((samples.shape[0], 4), dtype=np.uint8)
+        padded[:, 1:] = samples
+        frames = padded.tobytes()
+        sampleWidth = 4
+
+    return AudioClip(description=os.path.basename(path), frames=frames, sampleRate=sampleRate,
+                     numChannels=numChannels, sampleWidth=sampleWidth)
+
+
+class AudioClipCache:
+    """
+    LRU cache of decoded audio clips, shared by all audio actions. Size is bounded by total
+    decoded size. Safe to use from any thread.
+    """
+
+    def __init__(self, maxBytes: int):
+        self._maxBytes = maxBytes
+        self._numBytes = 0
+        self._clips: tp.OrderedDict[str, AudioClip] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normPath(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def __contains__(self, path: str) -> bool:
+        return self._normPath(path) in self._clips
+
+    @property
+    def numBytes(self) -> int:
+        return self._numBytes
+
+    def setMaxBytes(self, maxBytes: int):
+        with self._lock:
+            self._maxBytes = maxBytes
+            self._evict()
+
+    def preload(self, paths: tp.Iterable[str]) -> tp.List[AudioClip]:
+        return [self.get(path, isPreload=True) for path in paths]
+
+    def get(self, path: str, isPreload: bool = False) -> AudioClip:
+        """
+        Returns clip for path, decoding it first if not already cached.
+        """
+        key = self._normPath(path)
+        with self._lock:
+            if key in self._clips:
+                self._clips.move_to_end(key)
+                return self._clips[key]
+
+        startTime = time.perf_counter()
+        clip = decodeWav(key)
+        if isPreload:
+            logger.debug('Decoded %s (%.2f s of audio) in %.1f ms' % (
+                clip.description, clip.duration, (time.perf_counter() - startTime) * 1e3))
+        else:
+            logger.info('Audio %s was not preloaded, took %.1f ms to decode' % (
+                clip.description, (time.perf_counter() - startTime) * 1e3))
+
+        with self._lock:
+            if key not in self._clips:
+                self._clips[key] = clip
+                self._numBytes += len(clip.frames)
+                self._evict()
+            return self._clips[key]
+
+    def _evict(self):
+        # call with lock held; always keeps the most recently used clip
+        while self._numBytes > self._maxBytes and len(self._clips) > 1:
+            _, evicted = self._clips.popitem(last=False)
+            self._numBytes -= len(evicted.frames)
+
+    def clear(self):
+        with self._lock:
+            self._clips.clear()
+            self._numBytes = 0
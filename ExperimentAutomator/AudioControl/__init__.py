@@ -0,0 +1,3 @@
+from .AudioClip import AudioClip, AudioClipCache, decodeWav
+from .AudioBackends import AudioBackend, CueRecord, NullAudioBackend, WavFileAudioBackend, QtAudioBackend
+from .AudioAction import AudioPlayer, AudioAction
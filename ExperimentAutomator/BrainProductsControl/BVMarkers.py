@@ -0,0 +1,106 @@
+import logging
+import os
+import re
+import typing as tp
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+# e.g. 'Mk2=Comment,stim onset,12345,1,0'
+_vmrkMarkerRegex = re.compile(r'^Mk(\d+)=([^,]*),([^,]*),(\d+),')
+
+
+@attr.s(auto_attribs=True, eq=False)
+class MarkerRecord:
+    """
+    A marker submitted to BV Recorder, with timing of its delivery.
+    """
+    description: str
+    markerType: tp.Optional[str]
+    issueTimeNs: int  # time.perf_counter_ns() when submitted
+    isExpectedInVmrk: bool = True  # False if submitted while not recording
+    ackTimeNs: tp.Optional[int] = None  # time.perf_counter_ns() when SetMarker returned
+    error: tp.Optional[Exception] = None
+    vmrkPosition: tp.Optional[int] = None  # in samples, once found in the .vmrk file
+
+    @property
+    def isAcknowledged(self) -> bool:
+        return self.ackTimeNs is not None
+
+    @property
+    def isVerified(self) -> bool:
+        return self.vmrkPosition is not None
+
+    @property
+    def latency(self) -> tp.Optional[float]:
+        """
+        Time in s from submission until SetMarker returned.
+        """
+        if self.ackTimeNs is None:
+            return None
+        return (self.ackTimeNs - self.issueTimeNs) / 1e9
+
+
+@attr.s(auto_attribs=True, eq=False)
+class VmrkFollower:
+    """
+    Incrementally reads a .vmrk file as Recorder appends to it, matching new markers against
+    submitted ones (in order of submission) to verify that they were actually recorded.
+    """
+    path: str
+
+    _offset: int = attr.ib(init=False, default=0)
+    _partialLine: str = attr.ib(init=False, default='')
+    _unverified: tp.List[MarkerRecord] = attr.ib(init=False, factory=list)
+
+    def expect(self, record: MarkerRecord):
+        self._unverified.append(record)
+
+    @property
+    def numUnverified(self) -> int:
+        return len(self._unverified)
+
+    def update(self) -> int:
+        """
+        Read anything newly written. Returns number of submitted markers newly verified.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        if len(data) == 0:
+            return 0
+        self._offset += len(data)
+
+        lines = (self._partialLine + data.decode('utf-8', errors='replace')).split('\n')
+        self._partialLine = lines.pop()  # may be incomplete
+        numVerified = 0
+        for line in lines:
+            match = _vmrkMarkerRegex.match(line.strip())
+            if match is None:
+                continue
+            markerType = match.group(2)
+            description = match.group(3).replace(r'\1', ',')  # commas in descriptions are escaped
+            for iR, record in enumerate(self._unverified):
+                if record.description == description and (record.markerType is None or record.markerType == markerType):
+                    record.vmrkPosition = int(match.group(4))
+                    del self._unverified[iR]
+                    numVerified += 1
+                    break
+        return numVerified
+
+
+def summarizeMarkers(records: tp.Sequence[MarkerRecord]) -> str:
+    latencies = sorted(record.latency for record in records if record.latency is not None)
+    summary = '%d markers' % (len(records),)
+    if len(latencies) > 0:
+        summary += ', latency median %.1f ms, max %.1f ms' % (latencies[len(latencies) // 2] * 1e3, latencies[-1] * 1e3)
+    numFailed = sum(record.error is not None for record in records)
+    if numFailed > 0:
+        summary += ', %d failed' % (numFailed,)
+    numUnverified = sum(record.isExpectedInVmrk and not record.isVerified for record in records)
+    if numUnverified > 0:
+        summary += ', %d not (yet) found in .vmrk' % (numUnverified,)
+    return summary
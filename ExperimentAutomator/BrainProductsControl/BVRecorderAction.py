@@ -27,7 +27,8 @@ class BVRecorderAction(NoninterruptibleAction):
         cmd = cmdAndArgs[0]
         args = cmdAndArgs[1:]
 
-        if cmd in ('stop', 'stopViewing', 'pause', 'resume', 'viewImpedance', 'viewData', 'performDCOffsetCorrection'):
+        if cmd in ('stop', 'stopViewing', 'pause', 'resume', 'viewImpedance', 'viewData', 'performDCOffsetCorrection',
+                   'flushMarkers', 'verifyMarkers'):
             assert len(args)==0
             if cmd == 'stop':
                 self._automator.stopRecording()
@@ -50,6 +51,11 @@ class BVRecorderAction(NoninterruptibleAction):
             elif cmd == 'performDCOffsetCorrection':
                 self._automator.performDCOffsetCorrection()
                 logger.info('Performed DC offset correction in BV Recorder')
+            elif cmd == 'flushMarkers':
+                self._automator.flushMarkers()
+                logger.info('Sent all queued annotations to BV Recorder')
+            elif cmd == 'verifyMarkers':
+                self._automator.verifyMarkers()
             else:
                 raise NotImplementedError()
         elif cmd in ('setFilenameAndStart', 'setFilepathAndStart', 'loadWorkspace', 'annotate'):
@@ -73,7 +79,7 @@ class BVRecorderAction(NoninterruptibleAction):
             elif cmd == 'annotate':
                 annotation = self._evalStr(args[0])
                 self._automator.annotate(annotation)
-                logger.info('Inserted annotation in recorder: %s' % annotation)
+                logger.info('Queued annotation for recorder: %s' % annotation)
             else:
                 raise NotImplementedError()
         else:
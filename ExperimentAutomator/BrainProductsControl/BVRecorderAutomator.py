@@ -3,46 +3,151 @@ import logging
 import attr
 import typing as tp
 import time
-import pywin
+import threading
+import collections
 import shutil
 
-import win32com.client
-
-from ExperimentAutomator.Misc import Singleton
+from ExperimentAutomator.Misc import Singleton, waitUntilReady
+from .ComWorker import ComWorker
+from .BVMarkers import MarkerRecord, VmrkFollower, summarizeMarkers
 
 logger = logging.getLogger(__name__)
 
 
+_programStateCodes = {
+    0: 'idle',
+    1: 'monitoring',
+    2: 'testSignal',
+    3: 'impedanceCheck',
+    4: 'recording',
+    5: 'recordingTest',
+    6: 'paused',
+    7: 'pausedAndTestSignal',
+    8: 'pausedAndImpedanceCheck'
+}
+
+_acquisitionStateCodes = {
+    0: 'stopped',
+    1: 'running',
+    2: 'warning',
+    3: 'error'
+}
+
+
+def _dispatchVisionRecorder() -> tp.Any:
+    # import here so that this module can be imported (e.g. with a fake COM object) without pywin32
+    import win32com.client
+    return win32com.client.Dispatch('VisionRecorder.Application')
+
+
 @attr.s(auto_attribs=True)
 class BVRecorderAutomator(metaclass=Singleton):
-    comObj: win32com.client.DispatchBaseClass = attr.ib(init=False, default=None)
+    """
+    Controls BrainVision Recorder through its COM interface.
+
+    All COM access happens on a dedicated worker thread. Program and acquisition state are cached,
+    refreshed every statePollInterval while idle and after every command, so reading state doesn't
+    block; use waitForState to block until a transition is confirmed.
+
+    Markers are submitted without blocking (see submitMarker), sent in order by the worker, and
+    verified against the .vmrk file Recorder writes. A marker that could not be sent is raised by
+    the next annotate, flushMarkers, verifyMarkers or stopRecording.
+    """
+    viewDataTimeout: float = 30.  # in s
+    statePollInterval: float = 0.25  # in s
+    comFactory: tp.Callable[[], tp.Any] = _dispatchVisionRecorder  # e.g. FakeVisionRecorder for testing
+
+    _worker: ComWorker = attr.ib(init=False)
+    _stateCondition: threading.Condition = attr.ib(init=False, factory=threading.Condition)
+    _programState: tp.Optional[str] = attr.ib(init=False, default=None)
+    _acquisitionState: tp.Optional[str] = attr.ib(init=False, default=None)
+    _stateUpdateTime: tp.Optional[float] = attr.ib(init=False, default=None)  # time.monotonic() of last refresh
+
+    _markerLock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+    _pendingMarkers: tp.Deque[MarkerRecord] = attr.ib(init=False, factory=collections.deque)
+    _markerLog: tp.List[MarkerRecord] = attr.ib(init=False, factory=list)  # since recording started
+    _failedMarkers: tp.List[MarkerRecord] = attr.ib(init=False, factory=list)  # not yet raised
+    _isLoggingMarkers: bool = attr.ib(init=False, default=False)  # between startRecording and stopRecording
+    _vmrkFollower: tp.Optional[VmrkFollower] = attr.ib(init=False, default=None)  # only accessed on worker thread
 
     def __attrs_post_init__(self):
-        pass
+        self._worker = ComWorker(comFactory=self.comFactory,
+                                 onIdle=self._onWorkerIdle,
+                                 idleInterval=self.statePollInterval,
+                                 name='BVRecorderCOM')
+
+    def _updateStateCache(self, comObj: tp.Any):
+        # runs on worker thread
+        programState = _programStateCodes[comObj.State]
+        acquisitionState = _acquisitionStateCodes[comObj.Acquisition.GetAcquisitionState()]
+        with self._stateCondition:
+            if (programState, acquisitionState) != (self._programState, self._acquisitionState):
+                logger.debug('BV Recorder state: %s, acquisition %s' % (programState, acquisitionState))
+            self._programState = programState
+            self._acquisitionState = acquisitionState
+            self._stateUpdateTime = time.monotonic()
+            self._stateCondition.notify_all()
 
-    def _renewComObjIfNeeded(self):
-        if self.comObj is not None:
-            # try to access a property that only works if it is valid
+    def _onWorkerIdle(self, comObj: tp.Any):
+        self._updateStateCache(comObj)
+        if self._vmrkFollower is not None:
+            self._vmrkFollower.update()
+
+    def _runCommand(self, fn: tp.Callable[..., tp.Any], *args) -> tp.Any:
+        """
+        Run fn(comObj, *args) on the worker thread, followed by a state refresh, and wait for its result.
+        """
+        def runAndUpdate(comObj, *args):
             try:
-                self.comObj.Version
-                return
-            except Exception as e:
-                raise NotImplementedError()  # TODO: catch specific exception caused by crash during COM obj operation
+                return fn(comObj, *args)
+            finally:
+                self._updateStateCache(comObj)
+        return self._worker.call(runAndUpdate, *args)
+
+    def refreshState(self):
+        self._worker.call(self._updateStateCache)
+
+    def waitForState(self,
+                     programStates: tp.Optional[tp.Iterable[str]] = None,
+                     acquisitionStates: tp.Optional[tp.Iterable[str]] = None,
+                     timeout: float = 10.):
+        """
+        Block until the cached state matches, or raise TimeoutError.
+        """
+        programStates = None if programStates is None else set(programStates)
+        acquisitionStates = None if acquisitionStates is None else set(acquisitionStates)
+
+        def isMatch() -> bool:
+            return (programStates is None or self._programState in programStates) and \
+                (acquisitionStates is None or self._acquisitionState in acquisitionStates)
+
+        if self._stateUpdateTime is None:
+            self.refreshState()
+        startTime = time.monotonic()
+        with self._stateCondition:
+            if not self._stateCondition.wait_for(isMatch, timeout=timeout):
+                raise TimeoutError('BV Recorder did not reach state %s (acquisition %s) within %.1f s; state is %s (acquisition %s)' % (
+                    programStates, acquisitionStates, timeout, self._programState, self._acquisitionState))
+        logger.info('BV Recorder reached state %s (acquisition %s) after %.0f ms' % (
+            self._programState, self._acquisitionState, (time.monotonic() - startTime) * 1e3))
 
-        logger.debug('Renewed COM obj')
-        self.comObj = win32com.client.Dispatch('VisionRecorder.Application')
+    def close(self):
+        """
+        Stop the worker thread (and with it state polling), releasing the COM object.
+        """
+        self._worker.stop()
 
     def quit(self):
-        self._renewComObjIfNeeded()
-        self.comObj.Quit()
+        self._worker.call(lambda comObj: comObj.Quit())
+        self.close()  # so that Recorder is not dispatched again by a later command or poll
 
     def resumeRecording(self):
         assert self.getProgramState() in ('paused',)
-        self.comObj.Acquisition.Continue()
+        self._runCommand(lambda comObj: comObj.Acquisition.Continue())
 
     def pauseRecording(self):
         assert self.isRecording
-        self.comObj.Acquisition.Pause()
+        self._runCommand(lambda comObj: comObj.Acquisition.Pause())
 
     def startRecording(self, toFilepath: str, moveBeforeOverwrite: bool = True):
         # TODO: test what happens if filepath already exists (does it prompt to append vs overwrite?)
@@ -50,8 +155,13 @@ class BVRecorderAutomator(metaclass=Singleton):
         if self.getProgramState() not in ('monitoring',):
             # must be in monitoring mode before starting recording
             self.viewData()
-            time.sleep(10)  # give some time for view to start, otherwise recording silently fails...
-            assert self.getProgramState() in ('monitoring',)
+            # wait for data to actually be flowing, otherwise recording silently fails...
+            # (any acquisition state other than stopped, e.g. 'warning' with some channels out of range)
+            self.waitForState(programStates=('monitoring',),
+                              acquisitionStates=set(_acquisitionStateCodes.values()) - {'stopped'},
+                              timeout=self.viewDataTimeout)
+            if self._acquisitionState != 'running':
+                logger.warning('BV Recorder acquisition state is %s' % (self._acquisitionState,))
 
         # script interface does not automatically add .eeg extension, so add it here
         toFilepath, ext = os.path.splitext(toFilepath)
@@ -81,64 +191,161 @@ class BVRecorderAutomator(metaclass=Singleton):
             else:
                 logger.warning('Overwriting previous recording at %s', toFilepath)
 
-        self.comObj.Acquisition.StartRecording(toFilepath)
+        self._runCommand(lambda comObj: comObj.Acquisition.StartRecording(toFilepath))
+        self.waitForState(programStates=('recording',))
+
+        vmrkFollower = VmrkFollower(path=os.path.splitext(toFilepath)[0] + '.vmrk')
+        with self._markerLock:
+            self._markerLog = []
+            self._isLoggingMarkers = True
+        self._worker.call(lambda comObj: setattr(self, '_vmrkFollower', vmrkFollower))
 
     def stopRecording(self):
-        self._renewComObjIfNeeded()
-        self.comObj.Acquisition.StopRecording()
+        self._waitForMarkersSent()  # failures are only raised below, once recording was stopped anyway
+        self._runCommand(lambda comObj: comObj.Acquisition.StopRecording())
+
+        def stopFollowing(comObj):
+            if self._vmrkFollower is not None:
+                self._vmrkFollower.update()
+                self._vmrkFollower = None
+        self._worker.call(stopFollowing)
+        with self._markerLock:
+            markerLog = list(self._markerLog)
+            self._isLoggingMarkers = False  # so that markers submitted outside a recording don't accumulate
+        if len(markerLog) > 0:
+            logger.info('Recording markers: %s' % (summarizeMarkers(markerLog),))
+        self._raiseIfMarkersFailed()
 
     def stopViewing(self):
-        self._renewComObjIfNeeded()
-        self.comObj.Acquisition.StopViewing()
+        self._runCommand(lambda comObj: comObj.Acquisition.StopViewing())
 
     def viewData(self):
-        self._renewComObjIfNeeded()
-        self.comObj.Acquisition.ViewData()
+        self._runCommand(lambda comObj: comObj.Acquisition.ViewData())
 
     def viewImpedance(self):
-        self._renewComObjIfNeeded()
-        self.comObj.Acquisition.ViewImpedance()
+        self._runCommand(lambda comObj: comObj.Acquisition.ViewImpedance())
 
-    def annotate(self, description: str, markerType: tp.Optional[str] = None):
-        assert self.getProgramState() in ('monitoring', 'recording', 'paused')
-        if self.getProgramState() not in ('recording',):
+    def annotate(self, description: str, markerType: tp.Optional[str] = None) -> MarkerRecord:
+        """
+        Submit a marker without waiting for it to be sent (see submitMarker). Raises if an earlier
+        marker could not be sent.
+        """
+        self._raiseIfMarkersFailed()
+        programState = self.getProgramState()
+        if programState not in ('recording',):
+            # cached state may be stale (e.g. if recording was started from Recorder itself), so only
+            # block to refresh it when it would otherwise fail or warn
+            self.refreshState()
+            programState = self.getProgramState()
+        assert programState in ('monitoring', 'recording', 'paused')
+        if programState not in ('recording',):
             logger.warning('Set an annotation (%s) but not recording' % description)
-        if markerType is not None:
-            self.comObj.Acquisition.SetMarker(description, markerType)
-        else:
-            self.comObj.Acquisition.SetMarker(description)
+        return self.submitMarker(description, markerType=markerType)
+
+    def submitMarker(self, description: str, markerType: tp.Optional[str] = None) -> MarkerRecord:
+        """
+        Queue a marker to be sent to Recorder by the worker, in order of submission, and return
+        immediately. The returned record is updated once the marker is sent and again once it is
+        found in the .vmrk file.
+        """
+        record = MarkerRecord(description=description,
+                              markerType=markerType,
+                              issueTimeNs=time.perf_counter_ns(),
+                              isExpectedInVmrk=self._programState in ('recording',))
+        with self._markerLock:
+            self._pendingMarkers.append(record)
+            if self._isLoggingMarkers:
+                self._markerLog.append(record)
+            needsFlush = len(self._pendingMarkers) == 1  # else a flush is already queued
+        if needsFlush:
+            self._worker.submit(self._sendPendingMarkers)
+        return record
+
+    def _sendPendingMarkers(self, comObj: tp.Any):
+        # runs on worker thread
+        while True:
+            with self._markerLock:
+                if len(self._pendingMarkers) == 0:
+                    break
+                record = self._pendingMarkers.popleft()
+            try:
+                if record.markerType is not None:
+                    comObj.Acquisition.SetMarker(record.description, record.markerType)
+                else:
+                    comObj.Acquisition.SetMarker(record.description)
+            except Exception as e:
+                record.error = e
+                logger.error('Failed to set marker %s: %s' % (record.description, e))
+                with self._markerLock:
+                    self._failedMarkers.append(record)
+                continue
+            record.ackTimeNs = time.perf_counter_ns()
+            if record.isExpectedInVmrk and self._vmrkFollower is not None:
+                self._vmrkFollower.expect(record)
+
+    def flushMarkers(self, timeout: tp.Optional[float] = None):
+        """
+        Block until all submitted markers have been sent. Raises if any could not be sent.
+        """
+        self._waitForMarkersSent(timeout=timeout)
+        self._raiseIfMarkersFailed()
+
+    def _waitForMarkersSent(self, timeout: tp.Optional[float] = None):
+        # worker runs commands in order, so this completes after any queued markers were sent
+        self._worker.submit(lambda comObj: None).result(timeout=timeout)
+
+    def _raiseIfMarkersFailed(self):
+        with self._markerLock:
+            failedMarkers, self._failedMarkers = self._failedMarkers, []
+        if len(failedMarkers) > 0:
+            raise RuntimeError('Failed to set %d BV Recorder marker(s): %s' % (
+                len(failedMarkers), ', '.join('%s (%s)' % (record.description, record.error) for record in failedMarkers)))
+
+    def verifyMarkers(self, timeout: float = 5.):
+        """
+        Block until all markers sent while recording have been found in the .vmrk file, or raise TimeoutError.
+        """
+        self.flushMarkers()
+
+        def isAllVerified(comObj) -> bool:
+            if self._vmrkFollower is None:
+                return True
+            self._vmrkFollower.update()
+            return self._vmrkFollower.numUnverified == 0
+
+        waitUntilReady(lambda: self._worker.call(isAllVerified), description='BV Recorder markers in .vmrk',
+                       timeout=timeout)
+        with self._markerLock:
+            markerLog = list(self._markerLog)
+        logger.info('Recording markers: %s' % (summarizeMarkers(markerLog),))
+
+    @property
+    def markerLog(self) -> tp.List[MarkerRecord]:
+        """
+        Markers submitted during the current (or, once stopped, most recent) recording.
+        """
+        with self._markerLock:
+            return list(self._markerLog)
 
     def performDCOffsetCorrection(self):
-        self._renewComObjIfNeeded()
         assert self.getProgramState() in ('monitoring', 'recording', 'paused')
-        self.comObj.Acquisition.DCCorrection()
+        self._runCommand(lambda comObj: comObj.Acquisition.DCCorrection())
 
     def getAcquisitionState(self) -> str:
-        self._renewComObjIfNeeded()
-        stateCode = self.comObj.Acquisition.GetAcquisitionState()
-        stateCodeToState = {
-            0: 'stopped',
-            1: 'running',
-            2: 'warning',
-            3: 'error'
-        }
-        return stateCodeToState[stateCode]
+        """
+        Returns cached state (see statePollInterval).
+        """
+        if self._stateUpdateTime is None:
+            self.refreshState()
+        return self._acquisitionState
 
     def getProgramState(self) -> str:
-        self._renewComObjIfNeeded()
-        stateCode = self.comObj.State
-        stateCodeToState = {
-            0: 'idle',
-            1: 'monitoring',
-            2: 'testSignal',
-            3: 'impedanceCheck',
-            4: 'recording',
-            5: 'recordingTest',
-            6: 'paused',
-            7: 'pausedAndTestSignal',
-            8: 'pausedAndImpedanceCheck'
-        }
-        return stateCodeToState[stateCode]
+        """
+        Returns cached state (see statePollInterval).
+        """
+        if self._stateUpdateTime is None:
+            self.refreshState()
+        return self._programState
 
     @property
     def isRecording(self) -> bool:
@@ -155,7 +362,7 @@ class BVRecorderAutomator(metaclass=Singleton):
         if self.getProgramState() not in ('idle',):
             self.stopViewing()
 
-        self.comObj.CurrentWorkspace.Load(filepath)
+        self._runCommand(lambda comObj: comObj.CurrentWorkspace.Load(filepath))
 
 
 if __name__ == '__main__':
@@ -163,7 +370,5 @@ if __name__ == '__main__':
                         format='%(asctime)s.%(msecs)03d %(filename)20s %(lineno)4d %(levelname)5s: %(message)s',
                         datefmt='%H:%M:%S')
     o = BVRecorderAutomator()
-    o.getProgramState()
-    print('pause')
-    o.getProgramState()
-    print('todo')
+    print('Program state: %s, acquisition state: %s' % (o.getProgramState(), o.getAcquisitionState()))
+    o.close()
@@ -0,0 +1,121 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+import typing as tp
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class ComWorker:
+    """
+    Dedicated thread owning a COM object, through which all access to that object is serialized.
+
+    COM objects created in a single-threaded apartment (STA) may only be used from the thread that
+    created them, so the object is created on the worker thread by comFactory, and callers submit
+    functions taking the object as their first argument.
+
+    When no commands are queued, onIdle (if given) is called with the object every idleInterval,
+    e.g. to refresh cached state. This only happens while an object exists: idle polling never
+    creates one (which for e.g. BV Recorder would relaunch the application), only commands do.
+    """
+    comFactory: tp.Callable[[], tp.Any]
+    onIdle: tp.Optional[tp.Callable[[tp.Any], None]] = None
+    idleInterval: float = 0.25  # in s
+    name: str = 'ComWorker'
+
+    _queue: queue.Queue = attr.ib(init=False, factory=queue.Queue)
+    _thread: tp.Optional[threading.Thread] = attr.ib(init=False, default=None)
+    _comObj: tp.Any = attr.ib(init=False, default=None)
+
+    @property
+    def isRunning(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, fn: tp.Callable[..., tp.Any], *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Queue fn(comObj, *args, **kwargs) to run on the worker thread.
+        """
+        if not self.isRunning:
+            self._start()
+        future = concurrent.futures.Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def call(self, fn: tp.Callable[..., tp.Any], *args, **kwargs) -> tp.Any:
+        """
+        Run fn(comObj, *args, **kwargs) on the worker thread and wait for its result.
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stop(self):
+        if self.isRunning:
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            import pythoncom
+        except ImportError:
+            pythoncom = None  # e.g. when using a fake COM object on another platform
+        if pythoncom is not None:
+            pythoncom.CoInitialize()  # single-threaded apartment
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.idleInterval)
+                except queue.Empty:
+                    self._runIdle()
+                    continue
+                if item is None:
+                    break
+                future, fn, args, kwargs = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = fn(self._getComObj(), *args, **kwargs)
+                except BaseException as e:
+                    self._checkComObj()
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            self._comObj = None
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+    def _runIdle(self):
+        if self.onIdle is None or self._comObj is None:
+            return
+        try:
+            self.onIdle(self._comObj)
+        except Exception as e:
+            logger.debug('Error in idle callback of %s: %s' % (self.name, e))
+            self._checkComObj()
+
+    def _getComObj(self) -> tp.Any:
+        if self._comObj is None:
+            self._comObj = self.comFactory()
+            logger.debug('Created COM object in %s' % (self.name,))
+        return self._comObj
+
+    def _checkComObj(self):
+        """
+        After an error, drop the COM object if it is no longer valid (e.g. if the server
+        application was closed), so that it is recreated for the next command.
+        """
+        if self._comObj is None:
+            return
+        try:
+            self._comObj.Version
+        except Exception:
+            logger.info('COM object in %s is no longer valid, will be recreated' % (self.name,))
+            self._comObj = None
@@ -0,0 +1,160 @@
+"""
+Stand-in for BrainVision Recorder's COM automation object ('VisionRecorder.Application'), for
+exercising BVRecorderAutomator without Recorder or COM (e.g. on a development machine or in
+automated checks):
+
+    automator = BVRecorderAutomator(comFactory=FakeVisionRecorder)
+
+Implements the subset of the automation interface used by BVRecorderAutomator and simulates its
+state transitions. Recording writes empty .eeg and .vhdr files and a .vmrk file with any markers,
+but no data.
+"""
+import logging
+import os
+import threading
+import time
+import typing as tp
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+# state codes as used by Recorder's automation interface
+_IDLE, _MONITORING, _IMPEDANCE_CHECK, _RECORDING, _PAUSED = 0, 1, 3, 4, 6
+_ACQ_STOPPED, _ACQ_RUNNING = 0, 1
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _FakeAcquisition:
+    _recorder: 'FakeVisionRecorder'
+
+    def ViewData(self):
+        self._recorder._startViewing(_MONITORING)
+
+    def ViewImpedance(self):
+        self._recorder._startViewing(_IMPEDANCE_CHECK)
+
+    def StopViewing(self):
+        with self._recorder._lock:
+            self._recorder._state = _IDLE
+            self._recorder._acquisitionStartTime = None
+            self._recorder.recordingPath = None
+
+    def StartRecording(self, filepath: str):
+        with self._recorder._lock:
+            if self._recorder._state != _MONITORING or not self._recorder._isAcquiring():
+                # like Recorder, fails silently if not yet monitoring
+                logger.warning('Fake Recorder ignoring StartRecording while not monitoring')
+                return
+            self._recorder._state = _RECORDING
+            self._recorder.recordingPath = filepath
+            self._recorder.markers.clear()
+            self._recorder._startFiles(filepath)
+
+    def StopRecording(self):
+        with self._recorder._lock:
+            if self._recorder._state in (_RECORDING, _PAUSED):
+                self._recorder._state = _MONITORING
+                self._recorder.recordingPath = None
+
+    def Pause(self):
+        with self._recorder._lock:
+            if self._recorder._state == _RECORDING:
+                self._recorder._state = _PAUSED
+
+    def Continue(self):
+        with self._recorder._lock:
+            if self._recorder._state == _PAUSED:
+                self._recorder._state = _RECORDING
+
+    def DCCorrection(self):
+        pass
+
+    def SetMarker(self, description: str, markerType: str = 'Comment'):
+        with self._recorder._lock:
+            self._recorder.markers.append((markerType, description))
+            if self._recorder._state == _RECORDING:
+                self._recorder._appendVmrkMarker(markerType, description)
+
+    def GetAcquisitionState(self) -> int:
+        with self._recorder._lock:
+            return _ACQ_RUNNING if self._recorder._isAcquiring() else _ACQ_STOPPED
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _FakeWorkspace:
+    _recorder: 'FakeVisionRecorder'
+
+    def Load(self, filepath: str):
+        self._recorder.workspacePath = filepath
+
+
+@attr.s(auto_attribs=True, eq=False)
+class FakeVisionRecorder:
+    viewDataDelay: float = 0.5  # in s, time from ViewData until acquisition is running
+    comCallDelay: float = 0.  # in s, added to every state query, to simulate COM round trips
+    samplingRate: float = 1000.  # in Hz, for marker positions in .vmrk
+
+    Version: str = attr.ib(init=False, default='1.25.0000 (fake)')
+    Acquisition: _FakeAcquisition = attr.ib(init=False)
+    CurrentWorkspace: _FakeWorkspace = attr.ib(init=False)
+
+    recordingPath: tp.Optional[str] = attr.ib(init=False, default=None)
+    workspacePath: tp.Optional[str] = attr.ib(init=False, default=None)
+    markers: tp.List[tp.Tuple[str, str]] = attr.ib(init=False, factory=list)  # (type, description) since recording started
+    numStateQueries: int = attr.ib(init=False, default=0)
+
+    _state: int = attr.ib(init=False, default=_IDLE)
+    _acquisitionStartTime: tp.Optional[float] = attr.ib(init=False, default=None)
+    _recordingStartTime: tp.Optional[float] = attr.ib(init=False, default=None)
+    _numVmrkMarkers: int = attr.ib(init=False, default=0)
+    _lock: threading.RLock = attr.ib(init=False, factory=threading.RLock)
+
+    def __attrs_post_init__(self):
+        self.Acquisition = _FakeAcquisition(self)
+        self.CurrentWorkspace = _FakeWorkspace(self)
+
+    @property
+    def State(self) -> int:
+        if self.comCallDelay > 0:
+            time.sleep(self.comCallDelay)
+        with self._lock:
+            self.numStateQueries += 1
+            return self._state
+
+    def Quit(self):
+        self.Acquisition.StopViewing()
+
+    def _startViewing(self, state: int):
+        with self._lock:
+            if self._state in (_RECORDING, _PAUSED):
+                raise RuntimeError('Cannot change view while recording')
+            self._state = state
+            self._acquisitionStartTime = time.monotonic() + self.viewDataDelay
+
+    def _startFiles(self, eegPath: str):
+        basePath = os.path.splitext(eegPath)[0]
+        os.makedirs(os.path.dirname(os.path.abspath(basePath)), exist_ok=True)
+        for ext in ('.eeg', '.vhdr'):
+            open(basePath + ext, 'wb').close()
+        self._recordingStartTime = time.monotonic()
+        self._numVmrkMarkers = 1
+        with open(basePath + '.vmrk', 'w', encoding='utf-8', newline='\r\n') as f:
+            f.write('Brain Vision Data Exchange Marker File, Version 1.0\n\n')
+            f.write('[Common Infos]\nCodepage=UTF-8\nDataFile=%s\n\n' % (os.path.basename(eegPath),))
+            f.write('[Marker Infos]\n')
+            f.write('; Each entry: Mk<Marker number>=<Type>,<Description>,<Position in data points>,\n')
+            f.write('; <Size in data points>, <Channel number (0 = marker is related to all channels)>\n')
+            f.write('; Fields are delimited by commas, some fields might be omitted (empty).\n')
+            f.write('; Commas in type or description text are coded as "\\1".\n')
+            f.write('Mk1=New Segment,,1,1,0,%s000000\n' % (time.strftime('%Y%m%d%H%M%S'),))
+
+    def _appendVmrkMarker(self, markerType: str, description: str):
+        self._numVmrkMarkers += 1
+        position = int((time.monotonic() - self._recordingStartTime) * self.samplingRate) + 1
+        with open(os.path.splitext(self.recordingPath)[0] + '.vmrk', 'a', encoding='utf-8', newline='\r\n') as f:
+            f.write('Mk%d=%s,%s,%d,1,0\n' % (
+                self._numVmrkMarkers, markerType.replace(',', r'\1'), description.replace(',', r'\1'), position))
+
+    def _isAcquiring(self) -> bool:
+        return self._acquisitionStartTime is not None and time.monotonic() >= self._acquisitionStartTime
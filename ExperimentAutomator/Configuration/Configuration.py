@@ -7,10 +7,12 @@ import os
 import socket
 import importlib
 import attr
+import functools
 import logging
 import typing as tp
 import re
 import json
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +20,84 @@ homeDir = str(Path.home())
 thisDir, _ = os.path.split(os.path.realpath(__file__))
 hostname = socket.gethostname()
 
+_interpolationRegex = re.compile(r'<(\w+)>')
+
+# parsed contents of each configuration file, keyed by path, along with the file's modification
+# time when it was parsed; shared between Configuration instances, so must not be mutated
+_parsedJsonCache: tp.Dict[str, tp.Tuple[float, tp.Dict[str, tp.Any]]] = dict()
+
+
+def _loadJson(pathToJson: str, doForce: bool = False) -> tp.Dict[str, tp.Any]:
+    mtime = os.path.getmtime(pathToJson)
+    cacheKey = _normalizePath(pathToJson)
+    cached = _parsedJsonCache.get(cacheKey, None)
+    if cached is not None and cached[0] == mtime and not doForce:
+        return cached[1]
+    with open(pathToJson, 'r') as f:
+        d = json.load(f)
+    _parsedJsonCache[cacheKey] = (mtime, d)
+    return d
+
+
+def _normalizePath(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+@functools.lru_cache(maxsize=None)
+def _parseTemplate(val: str) -> tp.Tuple[str, ...]:
+    """
+    Split a value into alternating literal text and names of interpolated keys,
+    e.g. '<a>/b/<c>' -> ('', 'a', '/b/', 'c', '').
+    """
+    return tuple(_interpolationRegex.split(val))
+
 
 @attr.s(auto_attribs=True)
 class Configuration:
     _dicts: tp.List[tp.Dict[str, str]] = attr.ib(factory=list)
     _dictSourcePaths: tp.List[str] = attr.ib(factory=list)
 
+    # resolved (expanded and interpolated) values, keyed by (item, skipNumLevels); cleared whenever layers change
+    _resolvedCache: tp.Dict[tp.Tuple[str, int], tp.Any] = attr.ib(init=False, factory=dict, repr=False, eq=False)
+    _resolving: tp.List[tp.Tuple[str, int]] = attr.ib(init=False, factory=list, repr=False, eq=False)
+    # keys whose resolved values interpolate each key, for invalidating only what a reload affects
+    _dependents: tp.Dict[str, tp.Set[str]] = attr.ib(init=False, factory=dict, repr=False, eq=False)
+    # held while resolving or changing layers, since values are also read from worker threads
+    _lock: threading.RLock = attr.ib(init=False, factory=threading.RLock, repr=False, eq=False)
+
+    onLayersChanged: tp.Optional[tp.Callable[[], None]] = attr.ib(init=False, default=None, repr=False, eq=False)
+    """
+    Called after a configuration layer is added or removed (but not when one is reloaded).
+    """
+
     def getAttr(self, item, skipNumLevels: int = 0):
+        cacheKey = (item, skipNumLevels)
+        try:
+            return self._resolvedCache[cacheKey]
+        except KeyError:
+            pass
+
+        with self._lock:
+            try:
+                return self._resolvedCache[cacheKey]  # e.g. resolved by another thread while waiting for the lock
+            except KeyError:
+                pass
+
+            if cacheKey in self._resolving:
+                cycle = self._resolving[self._resolving.index(cacheKey):] + [cacheKey]
+                raise ValueError('Circular reference in configuration: %s' % (
+                    ' -> '.join('<%s>' % key for key, _ in cycle),))
+
+            self._resolving.append(cacheKey)
+            try:
+                val = self._resolve(item, skipNumLevels)
+            finally:
+                self._resolving.pop()
+
+            self._resolvedCache[cacheKey] = val
+            return val
+
+    def _resolve(self, item, skipNumLevels: int):
         for iD, d in enumerate(self._dicts):
             if iD < skipNumLevels:
                 continue
@@ -48,18 +121,18 @@ class Configuration:
                     else:
                         pass
 
-                    regex = re.compile(r'<(\w+)>')
-                    match = regex.search(val)
-                    while match is not None:
-                        subItem = match.group(1)
-                        toReplace = '<%s>' % subItem
-                        if subItem == item:
-                            subVal = self.getAttr(subItem, skipNumLevels=iD+1)
-                        else:
-                            subVal = getattr(self, subItem)
-                        val = val.replace(toReplace, subVal)
-                        match = regex.search(val)
-
+                    parts = _parseTemplate(val)
+                    if len(parts) > 1:
+                        resolvedParts = list(parts)
+                        for iP in range(1, len(parts), 2):
+                            subItem = parts[iP]
+                            self._dependents.setdefault(subItem, set()).add(item)
+                            if subItem == item:
+                                # self-reference refers to value from lower-priority configurations
+                                resolvedParts[iP] = self.getAttr(subItem, skipNumLevels=iD+1)
+                            else:
+                                resolvedParts[iP] = self.getAttr(subItem)
+                        val = ''.join(resolvedParts)
 
                 return val
         raise KeyError('No configuration value for key %s' % item)
@@ -67,22 +140,84 @@ class Configuration:
     def __getattr__(self, item):
         return self.getAttr(item)
 
+    @property
+    def sourcePaths(self) -> tp.List[str]:
+        """
+        Paths of all file-based configuration layers, highest priority first.
+        """
+        return [path for path in self._dictSourcePaths if path is not None]
+
+    def _clearResolvedCache(self):
+        with self._lock:
+            self._resolvedCache.clear()
+            self._dependents.clear()
+
+    def _insertLayer(self, d: tp.Dict[str, tp.Any], sourcePath: tp.Optional[str]):
+        with self._lock:
+            self._dicts.insert(0, d)
+            self._dictSourcePaths.insert(0, sourcePath)
+            self._clearResolvedCache()
+        if self.onLayersChanged is not None:
+            self.onLayersChanged()
+
     def clear(self):
-        self._dicts = list()
-        self._dictSourcePaths = list()
+        with self._lock:
+            self._dicts = list()
+            self._dictSourcePaths = list()
+            self._clearResolvedCache()
+        if self.onLayersChanged is not None:
+            self.onLayersChanged()
+
+    def reloadConfiguration(self, pathToJson: str) -> tp.Set[str]:
+        """
+        Re-read configuration layers from their (changed) file, keeping their priority.
+
+        Only cached values that depend on keys changed in that layer, directly or through
+        interpolated <key> references, are invalidated. Returns the set of affected keys.
+        """
+        normPath = _normalizePath(pathToJson)
+        newD = _loadJson(pathToJson, doForce=True)
+        with self._lock:
+            iDs = [iD for iD, sourcePath in enumerate(self._dictSourcePaths)
+                   if sourcePath is not None and _normalizePath(sourcePath) == normPath]
+            if len(iDs) == 0:
+                raise KeyError('No configuration layer loaded from %s' % (pathToJson,))
+
+            changedKeys = set()
+            for iD in iDs:  # the same file may have been added more than once
+                oldD = self._dicts[iD]
+                for key in set(oldD.keys()) | set(newD.keys()):
+                    if key not in oldD or key not in newD or oldD[key] != newD[key]:
+                        changedKeys.add(key)
+                self._dicts[iD] = newD
+
+            affectedKeys = set()
+            toVisit = list(changedKeys)
+            while len(toVisit) > 0:
+                key = toVisit.pop()
+                if key in affectedKeys:
+                    continue
+                affectedKeys.add(key)
+                toVisit.extend(self._dependents.pop(key, ()))
+
+            for cacheKey in list(self._resolvedCache.keys()):
+                if cacheKey[0] in affectedKeys:
+                    del self._resolvedCache[cacheKey]
+
+        return affectedKeys
 
     def addConfiguration(self, pathToJson: str):
-        with open(pathToJson,'r') as f:
-            d = json.load(f)
-        self._dicts.insert(0, d)
-        self._dictSourcePaths.insert(0, pathToJson)
+        """
+        Add a file as the highest priority layer. Adding a file that is already loaded stacks
+        another layer, e.g. to override intermediate layers again.
+        """
+        self._insertLayer(_loadJson(pathToJson), pathToJson)
 
     def addDefaultConfiguration(self):
         self.addConfiguration(os.path.join(thisDir, 'DefaultConfiguration.json'))
-        self._dicts.insert(0, dict(
+        self._insertLayer(dict(
             hostname=hostname,
-        ))
-        self._dictSourcePaths.insert(0, None)
+        ), None)
 
     def addMachineConfiguration(self):
         configPath = os.path.join(thisDir,'MachineConfiguration-%s.json' % hostname)
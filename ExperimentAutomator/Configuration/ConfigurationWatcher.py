@@ -0,0 +1,78 @@
+import logging
+import os
+import typing as tp
+
+from qtpy import QtCore
+
+from .Configuration import Configuration
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigurationWatcher(QtCore.QObject):
+    """
+    Watches the files behind each layer of a Configuration, and reloads just the changed layer
+    when one is edited, so that e.g. a wrong path in a machine configuration can be fixed
+    mid-session without restarting.
+    """
+    _debounceIntervalMs: int = 200  # editors may write a file in several steps
+
+    sigConfigurationChanged = QtCore.Signal(object)  # emits set of changed keys, including keys that interpolate them
+
+    _sigLayersChanged = QtCore.Signal()  # may be emitted from any thread
+
+    def __init__(self, configuration: Configuration, parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self._conf = configuration
+
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self._onFileChanged)
+
+        self._pendingPaths: tp.Set[str] = set()
+        self._debounceTimer = QtCore.QTimer(self)
+        self._debounceTimer.setSingleShot(True)
+        self._debounceTimer.setInterval(self._debounceIntervalMs)
+        self._debounceTimer.timeout.connect(self._reloadPending)
+
+        # layers may be added from any thread, but the file watcher may only be used from this one
+        self._sigLayersChanged.connect(self._syncWatchedPaths, QtCore.Qt.QueuedConnection)
+        self._conf.onLayersChanged = self._sigLayersChanged.emit
+        self._syncWatchedPaths()
+
+    def _syncWatchedPaths(self):
+        wantedPaths = set(os.path.abspath(path) for path in self._conf.sourcePaths if os.path.exists(path))
+        watchedPaths = set(self._watcher.files())
+        toRemove = watchedPaths - wantedPaths
+        toAdd = wantedPaths - watchedPaths
+        if len(toRemove) > 0:
+            self._watcher.removePaths(list(toRemove))
+        if len(toAdd) > 0:
+            logger.debug('Watching configuration files %s' % (sorted(toAdd),))
+            self._watcher.addPaths(list(toAdd))
+
+    def _onFileChanged(self, path: str):
+        self._pendingPaths.add(path)
+        self._debounceTimer.start()
+
+    def _reloadPending(self):
+        changedKeys = set()
+        for path in self._pendingPaths:
+            if not os.path.exists(path):
+                # some editors save by deleting and replacing the file; if so, it will be
+                # picked up again below once it reappears
+                logger.debug('Configuration file %s temporarily missing' % (path,))
+                continue
+            try:
+                changedKeys |= self._conf.reloadConfiguration(path)
+            except Exception as e:
+                logger.error('Unable to reload configuration from %s, keeping previous values: %s' % (path, e))
+            else:
+                logger.info('Reloaded configuration from %s' % (path,))
+        self._pendingPaths.clear()
+
+        # a file replaced on save is dropped from the watch list, so re-add it
+        self._syncWatchedPaths()
+
+        if len(changedKeys) > 0:
+            logger.info('Configuration values changed: %s' % (', '.join(sorted(changedKeys)),))
+            self.sigConfigurationChanged.emit(changedKeys)
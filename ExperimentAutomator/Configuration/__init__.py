@@ -1 +1,2 @@
-from .Configuration import globalConfiguration, Configuration
\ No newline at end of file
+from .Configuration import globalConfiguration, Configuration
+from .ConfigurationWatcher import ConfigurationWatcher
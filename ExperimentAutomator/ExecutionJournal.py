@@ -0,0 +1,314 @@
+"""
+Append-only journal of executed actions, so that a session interrupted by a crash or reboot can be
+resumed at the same position and with the same variables.
+
+The journal is a sequence of length-prefixed pickled records. Each executed action appends a record
+with its location, the location the experiment advanced to, the locals that changed since the
+previous record, and (when changed) the files loaded as configuration layers. Records are handed to the OS as they are written (so they survive a crash of the
+GUI), but are only fsync'ed to disk at safe points: when the experiment stops, when the journal is
+closed, and at most every `syncInterval` seconds while running.
+
+Changes are detected by hashing pickled values. To keep this cheap for large values (at least
+`identityCheckMinBytes` when pickled, or not journalable), these are only pickled again once
+replaced by a different object or changed in length or shape, so in-place changes that keep their
+shape (e.g. assigning into an existing array) are not journaled.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import struct
+import time
+import typing as tp
+
+import attr
+
+from ExperimentAutomator.Misc import getUserDataDir
+
+logger = logging.getLogger(__name__)
+
+Location = tp.Tuple[int, int]
+
+_frameHeader = struct.Struct('<I')
+
+# values of these types are compared directly rather than by pickled contents
+_PRIMITIVE_TYPES = (bool, int, float, complex, str, bytes, type(None))
+
+
+@attr.s(auto_attribs=True)
+class JournalState:
+    """
+    Experiment state reconstructed from a journal.
+    """
+    tablePath: tp.Optional[str] = None
+    tableHash: tp.Optional[str] = None
+    nextLocation: tp.Optional[Location] = None
+    executedLocations: tp.List[Location] = attr.ib(factory=list)  # in order of first execution
+    locals: tp.Dict[str, tp.Any] = attr.ib(factory=dict)
+    configPaths: tp.Optional[tp.List[str]] = None  # configuration layer files, highest priority first
+    numRecords: int = 0
+
+
+@attr.s(auto_attribs=True, eq=False)
+class ExecutionJournal:
+    path: str
+    tablePath: tp.Optional[str] = None
+    tableHash: tp.Optional[str] = None
+    syncInterval: float = 5.0  # in s
+    maxValueBytes: int = 64 * 2**20  # larger (pickled) values are not journaled
+    ignoredKeys: tp.FrozenSet[str] = frozenset(('conf',))  # e.g. the global configuration, whose layers are journaled as configPaths
+    identityCheckMinBytes: int = 2**20  # larger (pickled) values are only compared by identity and shape
+
+    _file: tp.Optional[tp.BinaryIO] = attr.ib(init=False, default=None)
+    _lastSyncTime: float = attr.ib(init=False, default=0.)
+    _journaledTokens: tp.Dict[str, tp.Any] = attr.ib(init=False, factory=dict)
+    _journaledConfigPaths: tp.Optional[tp.List[str]] = attr.ib(init=False, default=None)
+    _skippedKeys: tp.Set[str] = attr.ib(init=False, factory=set)  # keys already warned about as not journalable
+    _identityChecked: tp.Dict[str, '_ValueIdentity'] = attr.ib(init=False, factory=dict)  # large or unjournalable values
+
+    @classmethod
+    def defaultPathForTable(cls, tablePath: str) -> str:
+        absPath = os.path.abspath(tablePath)
+        name, _ = os.path.splitext(os.path.basename(absPath))
+        pathHash = hashlib.sha1(absPath.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(getUserDataDir(), 'Journals', '%s-%s.journal' % (name, pathHash))
+
+    @staticmethod
+    def hashTableFile(tablePath: str) -> str:
+        with open(tablePath, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @property
+    def isOpen(self) -> bool:
+        return self._file is not None
+
+    def open(self, doAppend: bool = False, initialLocals: tp.Optional[tp.Dict[str, tp.Any]] = None):
+        """
+        Open the journal for writing. If not appending, any previous journal at the same path is
+        kept by renaming it with its modification time.
+
+        initialLocals (e.g. restored from this journal when resuming) are treated as already
+        journaled, so they are not all rewritten by the next record.
+        """
+        assert self._file is None
+        dirPath, _ = os.path.split(self.path)
+        os.makedirs(dirPath, exist_ok=True)
+
+        if not doAppend and os.path.exists(self.path):
+            base, ext = os.path.splitext(self.path)
+            prevPath = base + time.strftime('-%Y%m%d-%H%M%S', time.localtime(os.path.getmtime(self.path))) + ext
+            logger.info('Moving previous journal to %s' % (prevPath,))
+            os.replace(self.path, prevPath)
+
+        self._file = open(self.path, 'ab')
+        self._journaledTokens = dict()
+        self._journaledConfigPaths = None
+        self._skippedKeys = set()
+        self._identityChecked = dict()
+        if initialLocals is not None:
+            for key, val in initialLocals.items():
+                token = self._tokenFor(key, val)
+                if token is not None:
+                    self._journaledTokens[key] = token[0]
+
+        self._writeRecord(dict(
+            type='resume' if doAppend else 'header',
+            tablePath=self.tablePath,
+            tableHash=self.tableHash,
+            time=time.time(),
+        ))
+        self.sync()
+        logger.info('%s execution journal at %s' % ('Resuming' if doAppend else 'Writing', self.path))
+
+    def close(self):
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def recordAction(self,
+                     location: Location,
+                     nextLocation: Location,
+                     locals: tp.Dict[str, tp.Any],
+                     configPaths: tp.Optional[tp.Sequence[str]] = None):
+        """
+        configPaths, if given, are the files loaded as configuration layers (highest priority
+        first), e.g. so that layers added by eval cells can be restored on resume.
+        """
+        if self._file is None:
+            return
+        changed, removed = self._getChangedLocals(locals)
+        record = dict(
+            type='action',
+            location=location,
+            nextLocation=nextLocation,
+            time=time.time(),
+            changed=changed,
+            removed=removed,
+        )
+        if configPaths is not None and list(configPaths) != self._journaledConfigPaths:
+            self._journaledConfigPaths = list(configPaths)
+            record['configPaths'] = self._journaledConfigPaths
+        self._writeRecord(record)
+        if time.monotonic() - self._lastSyncTime > self.syncInterval:
+            self.sync()
+
+    def sync(self):
+        """
+        Force everything written so far to disk. Relatively slow, so only called at safe points.
+        """
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._lastSyncTime = time.monotonic()
+
+    def _writeRecord(self, record: tp.Dict[str, tp.Any]):
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(_frameHeader.pack(len(data)) + data)
+        self._file.flush()  # hand off to the OS (cheap), so a crash of this process doesn't lose the record
+
+    def _tokenFor(self, key: str, val: tp.Any) -> tp.Optional[tp.Tuple[tp.Any, tp.Optional[bytes]]]:
+        """
+        Returns (token, pickledValue), where token changes whenever the value changes, or None if
+        the value can't be journaled. pickledValue is None for primitives, which are stored as-is.
+        """
+        if key in self.ignoredKeys:
+            return None
+        self._identityChecked.pop(key, None)
+        if type(val) in _PRIMITIVE_TYPES:
+            return (type(val), val), None
+        numBytes = getattr(val, 'nbytes', None)  # e.g. numpy arrays, to avoid pickling what would be discarded
+        if isinstance(numBytes, int) and numBytes > self.maxValueBytes:
+            self._skip(key, val, 'too large (%d bytes); it will not be restored on resume' % (numBytes,), logging.WARNING)
+            return None
+        try:
+            data = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self._skip(key, val, 'cannot pickle %s (%s)' % (type(val).__name__, e), logging.DEBUG)
+            return None
+        if len(data) > self.maxValueBytes:
+            self._skip(key, val, 'too large (%d bytes); it will not be restored on resume' % (len(data),), logging.WARNING)
+            return None
+        token = hashlib.blake2b(data, digest_size=16).digest()
+        if len(data) >= self.identityCheckMinBytes:
+            self._identityChecked[key] = _ValueIdentity.of(val)
+        return token, data
+
+    def _skip(self, key: str, val: tp.Any, reason: str, level: int):
+        self._identityChecked[key] = _ValueIdentity.of(val)
+        if key not in self._skippedKeys:
+            logger.log(level, 'Not journaling variable %s: %s' % (key, reason))
+            self._skippedKeys.add(key)
+
+    def _getChangedLocals(self, locals: tp.Dict[str, tp.Any]) -> tp.Tuple[tp.Dict[str, tp.Any], tp.List[str]]:
+        changed = dict()
+        for key, val in list(locals.items()):
+            identity = self._identityChecked.get(key, None)
+            if identity is not None and identity.matches(val):
+                continue  # unchanged since last journaled, or still not journalable
+            token = self._tokenFor(key, val)
+            if token is None:
+                continue
+            token, data = token
+            if self._journaledTokens.get(key, None) == token:
+                continue
+            self._journaledTokens[key] = token
+            changed[key] = val if data is None else _PickledValue(data)
+
+        removed = [key for key in self._journaledTokens if key not in locals]
+        for key in removed:
+            del self._journaledTokens[key]
+        for key in [key for key in self._identityChecked if key not in locals]:
+            del self._identityChecked[key]
+
+        return changed, removed
+
+    @classmethod
+    def readState(cls, path: str) -> JournalState:
+        state = JournalState()
+        executed = dict()  # used as an ordered set
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(_frameHeader.size)
+                if len(header) < _frameHeader.size:
+                    break
+                size, = _frameHeader.unpack(header)
+                data = f.read(size)
+                if len(data) < size:
+                    logger.warning('Ignoring truncated final record in journal %s' % (path,))
+                    break
+                try:
+                    record = pickle.loads(data)
+                except Exception as e:
+                    logger.warning('Stopped reading journal %s at unreadable record: %s' % (path, e))
+                    break
+
+                state.numRecords += 1
+                if record['type'] in ('header', 'resume'):
+                    state.tablePath = record['tablePath']
+                    state.tableHash = record['tableHash']
+                elif record['type'] == 'action':
+                    executed[record['location']] = None
+                    state.nextLocation = record['nextLocation']
+                    for key, val in record['changed'].items():
+                        if isinstance(val, _PickledValue):
+                            try:
+                                val = val.load()
+                            except Exception as e:
+                                logger.warning('Unable to restore variable %s from journal: %s' % (key, e))
+                                state.locals.pop(key, None)
+                                continue
+                        state.locals[key] = val
+                    for key in record['removed']:
+                        state.locals.pop(key, None)
+                    if 'configPaths' in record:
+                        state.configPaths = record['configPaths']
+                else:
+                    raise NotImplementedError('Unexpected journal record type: %s' % (record['type'],))
+
+        state.executedLocations = list(executed.keys())
+        return state
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _PickledValue:
+    """
+    Holds an already-pickled value, so that values pickled for change detection aren't pickled
+    again when written, and so that one unloadable value doesn't prevent reading the whole record.
+    """
+    data: bytes
+
+    def load(self) -> tp.Any:
+        return pickle.loads(self.data)
+
+
+def _shapeOf(val: tp.Any) -> tp.Any:
+    shape = getattr(val, 'shape', None)
+    if shape is not None:
+        try:
+            return tuple(shape)
+        except TypeError:
+            pass
+    try:
+        return len(val)
+    except Exception:
+        return None
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _ValueIdentity:
+    """
+    Cheap stand-in for comparing a large value's contents: the value itself (compared by identity,
+    and held so that its id can't be reused) and its length or shape.
+    """
+    value: tp.Any
+    shape: tp.Any
+
+    @classmethod
+    def of(cls, val: tp.Any) -> '_ValueIdentity':
+        return cls(value=val, shape=_shapeOf(val))
+
+    def matches(self, val: tp.Any) -> bool:
+        return val is self.value and _shapeOf(val) == self.shape
@@ -10,10 +10,16 @@ logger = logging.getLogger(__name__)
 
 from ExperimentAutomator.ExperimentActions import ExperimentAction, Locals, ActionTypes, ControlFlowAction
 from ExperimentAutomator.VLCControl import VLCControlAction
-from ExperimentAutomator.LSLControl import LabRecorderAction
+from ExperimentAutomator.LSLControl import LabRecorderAction, LSLMarkerAction, WaitForStreamsAction
 from ExperimentAutomator.BrainProductsControl import BVRecorderAction
 from ExperimentAutomator.PsychopyControl import ZMQPicturePresenterAction
+from ExperimentAutomator.StimulusPresentation import PresentAction
+from ExperimentAutomator.AudioControl import AudioAction
+from ExperimentAutomator.SpeechControl import SpeakAction
 from ExperimentAutomator.Misc import exceptionToStr
+from ExperimentAutomator.AsyncEval import AsyncEvaluator
+from ExperimentAutomator.JobManager import JobManager
+from ExperimentAutomator.ExecutionJournal import ExecutionJournal, JournalState
 
 from ExperimentAutomator.Configuration import globalConfiguration
 
@@ -51,6 +57,8 @@ class Experiment(QtCore.QObject):
 
     _parentWin: tp.Optional[QtWidgets.QWidget] = None
 
+    _journal: tp.Optional[ExecutionJournal] = None
+
     sigCurrentActionAboutToChange: QtCore.Signal = QtCore.Signal()
     sigCurrentActionChanged: QtCore.Signal = QtCore.Signal()
     sigStartedRunning = QtCore.Signal()
@@ -68,6 +76,7 @@ class Experiment(QtCore.QObject):
         self._parseControlFlowBlocks()
 
         self._parentWin = parentWin
+        self._journal = None
 
         self._currentCol = -1
         self._currentRow = 0
@@ -85,13 +94,44 @@ class Experiment(QtCore.QObject):
             for actionType in ActionTypes + [
                 VLCControlAction,
                 LabRecorderAction,
+                LSLMarkerAction,
+                WaitForStreamsAction,
                 BVRecorderAction,
                 ZMQPicturePresenterAction,
+                PresentAction,
+                AudioAction,
+                SpeakAction,
             ]:
                 self.registeredActionTypes[actionType.key] = actionType
 
+        self._prepareActionTypes()
+
         self._incrementAction()
 
+    def _prepareActionTypes(self):
+        argStrsByKey: tp.Dict[str, tp.List[str]] = dict()
+        for iC, columnLabel in enumerate(self.tbl.columns):
+            key = self._columnLabelToKey(columnLabel)
+            if key not in self.registeredActionTypes:
+                continue
+            argStrs = argStrsByKey.setdefault(key, [])
+            for iR in range(len(self.tbl.index)):
+                argStr = self.tbl.iat[iR, iC]
+                if not isinstance(argStr, str):
+                    argStr = str(argStr)
+                if len(argStr) > 0 and argStr[0] == '#':
+                    # include disabled actions, since they may be enabled later
+                    argStr = argStr[1:].lstrip()
+                if len(argStr) > 0:
+                    argStrs.append(argStr)
+
+        for key, argStrs in argStrsByKey.items():
+            try:
+                self.registeredActionTypes[key].prepareForTable(argStrs)
+            except Exception as e:
+                # preparation is only an optimization, so shouldn't prevent loading the table
+                logger.warning('Error while preparing %s actions: %s' % (key, exceptionToStr(e)))
+
     def _parseRepeatBlocks(self):
         tbl = self.tbl
 
@@ -323,6 +363,66 @@ class Experiment(QtCore.QObject):
         if (self.currentRow, self.currentCol) in locations:
             self._incrementAction()
 
+    def setJournal(self, journal: tp.Optional[ExecutionJournal]):
+        """
+        Record each executed action (and resulting changes to locals) in the given journal.
+        """
+        if self._journal is not None:
+            self.sigStoppedRunning.disconnect(self._journal.sync)
+        self._journal = journal
+        if journal is not None:
+            # stopping (pausing, error, end of experiment) is a safe point to force the journal to disk
+            self.sigStoppedRunning.connect(journal.sync)
+
+    def restoreFromJournal(self, state: JournalState):
+        """
+        Restore configuration layers, locals, and position from a journal of a previous
+        (interrupted) session.
+        """
+        if self._isRunning:
+            self.stop()
+        if state.configPaths is not None:
+            self._restoreConfigurationLayers(state.configPaths)
+        logger.info('Restoring %d variables and position after %d executed actions from journal' % (
+            len(state.locals), len(state.executedLocations)))
+        self.locals.update(state.locals)
+        # so that waiting for evaluations or jobs from before resuming doesn't fail
+        AsyncEvaluator().wasSessionRestored = True
+        JobManager().wasSessionRestored = True
+        if state.nextLocation is None:
+            logger.info('No actions were executed in journaled session, not changing position')
+            return
+        if 0 <= state.nextLocation[0] < len(self.tbl.index):
+            logger.info('Resuming at row %d, column %d' % state.nextLocation)
+        else:
+            logger.info('Journaled session had reached end of experiment')
+        self.jumpTo(location=state.nextLocation)
+
+    @staticmethod
+    def _restoreConfigurationLayers(configPaths: tp.List[str]):
+        """
+        Add configuration layers (e.g. added by skipped eval cells) that were loaded in the journaled
+        session, beyond those already loaded now (e.g. default and machine configuration).
+        """
+        def normPath(path: str) -> str:
+            return os.path.normcase(os.path.abspath(path))
+
+        # lowest priority first
+        journaledPaths = list(reversed(configPaths))
+        currentPaths = list(reversed(globalConfiguration.sourcePaths))
+        numShared = 0
+        while numShared < min(len(journaledPaths), len(currentPaths)) and \
+                normPath(journaledPaths[numShared]) == normPath(currentPaths[numShared]):
+            numShared += 1
+        if numShared < len(currentPaths):
+            logger.warning('Configuration layers differ from journaled session; adding journaled layers on top')
+        for path in journaledPaths[numShared:]:
+            if not os.path.exists(path):
+                logger.warning('Unable to restore configuration layer %s: file not found' % (path,))
+                continue
+            logger.info('Restoring configuration layer %s' % (path,))
+            globalConfiguration.addConfiguration(path)
+
     @property
     def isRunning(self) -> bool:
         return self._isRunning
@@ -426,6 +526,8 @@ class Experiment(QtCore.QObject):
         action.sigStopping.disconnect(self._onActionStopped)
         action.onExceptionWhileRunning = None
 
+        executedLocation = (self._currentRow, self._currentCol)
+
         if self._isRunning:
             didJump = False
             if isinstance(action, ControlFlowAction):
@@ -440,6 +542,7 @@ class Experiment(QtCore.QObject):
 
             if not didJump:
                 self._incrementAction()
+            self._recordInJournal(executedLocation)
             if self.currentAction is not None:
                 QtCore.QTimer.singleShot(0, lambda action=self.currentAction:
                     self._startCurrentAction(action))
@@ -448,6 +551,20 @@ class Experiment(QtCore.QObject):
                 logger.info('Reached end of experiment')
                 self._isRunning = False
                 self.sigStoppedRunning.emit()
+        else:
+            self._recordInJournal(executedLocation)
+
+    def _recordInJournal(self, executedLocation: tp.Tuple[int, int]):
+        if self._journal is None:
+            return
+        try:
+            self._journal.recordAction(location=executedLocation,
+                                       nextLocation=(self._currentRow, self._currentCol),
+                                       locals=self.locals,
+                                       configPaths=globalConfiguration.sourcePaths)
+        except Exception as e:
+            # never let journaling problems interrupt the experiment itself
+            logger.error('Unable to write to execution journal: %s' % (exceptionToStr(e),))
 
     @staticmethod
     def _columnLabelToKey(columnLabel) -> str:
@@ -482,6 +599,12 @@ class Experiment(QtCore.QObject):
 
         self._currentAction = self.registeredActionTypes[key].fromString(argStr, parentWin=self._parentWin)
 
+        try:
+            self._currentAction.prepareToStart(self.locals)
+        except Exception as e:
+            # preparation is only an optimization, so shouldn't prevent the action from running
+            logger.warning('Error while preparing %s: %s' % (self._currentAction, exceptionToStr(e)))
+
     def _incrementAction(self, decrement=False, doAllowSkip=True, initialRowCol=None):
         self.sigCurrentActionAboutToChange.emit()
         self._currentAction = None
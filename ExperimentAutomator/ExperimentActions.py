@@ -1,22 +1,25 @@
-from command_runner import command_runner, command_runner_threaded
-from concurrent.futures import Future
-import queue
 from qtpy import QtCore, QtGui, QtWidgets
 import typing as tp
 import attr
 import json
 import logging
 import time
-import pyttsx3
 import subprocess
 import os
 import shutil
 import sys
 import pyperclip
+import re
 import traceback
 
+from ExperimentAutomator.ScriptProcess import ScriptProcess, ScriptResult
+from ExperimentAutomator.PythonWorkerPool import PythonWorkerPool, PythonScriptRun, splitPythonCommandLine
+from ExperimentAutomator.JobManager import JobManager, Job, JobState
+from ExperimentAutomator.ProcessSupervisor import ProcessSupervisor
+from ExperimentAutomator.AsyncEval import AsyncEvaluator, AsyncEvaluation, AsyncEvalState
+from ExperimentAutomator.VariableChannel import VariableChannelServer
+
 logger = logging.getLogger(__name__)
-logging.getLogger('command_runner').setLevel(logging.INFO)
 
 Locals = tp.Dict[str, tp.Any]
 
@@ -64,6 +67,22 @@ class ExperimentAction(QtCore.QObject):
         self._didStop = True
         logger.debug('Finished action %s' % self)
 
+    def _handleExceptionWhileRunning(self, e: Exception):
+        """
+        Handle an exception raised after _start returned (e.g. when a process finished), as
+        directed by onExceptionWhileRunning.
+        """
+        if self.onExceptionWhileRunning is None:
+            raise e
+        howToProceed = self.onExceptionWhileRunning(self, e)
+        if howToProceed == 'raise':
+            raise e
+        elif howToProceed in ('stop', 'continue'):
+            # action is finished either way, so register stop
+            self._onStop()
+        else:
+            raise NotImplementedError
+
     def _evalStr(self, s) -> str:
         try:
             out = eval(s, globals(), self.locals)
@@ -94,6 +113,23 @@ class ExperimentAction(QtCore.QObject):
     def fromString(cls, s: str, **kwargs):
         raise NotImplementedError("Should be implemented by subclass")
 
+    @classmethod
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        """
+        Called once when an experiment table is loaded, with the contents of every (including
+        disabled) cell of this action type, e.g. to start slow setup ahead of the first action.
+        Cells may contain expressions that can only be evaluated later. Default does nothing.
+        """
+        pass
+
+    def prepareToStart(self, locals: Locals):
+        """
+        Called when this action becomes the next action to run, with the experiment's locals at
+        that time, e.g. to start slow setup before the action is actually started. Default does
+        nothing.
+        """
+        pass
+
 
 @attr.s(auto_attribs=True)
 class NoninterruptibleAction(ExperimentAction):
@@ -135,6 +171,99 @@ class EvalAction(NoninterruptibleAction):
         return cls(evalStr=s, **kwargs)
 
 
+_evalAsyncRegex = re.compile(r'^\s*(?:(thread|process)\s+)?(\w+)\s*->\s*([\w\s,]*?)\s*:(.*)$', re.DOTALL)
+
+
+@attr.s(auto_attribs=True)
+class EvalAsyncAction(NoninterruptibleAction):
+    """
+    Start evaluating code in the background and continue immediately, e.g.:
+        <name> -> <output1>, <output2>: <code>
+    Outputs are assigned in locals when the code finishes; use `await <name>` to wait for that.
+    Code runs in a thread, unless preceded by `process` (see AsyncEval). As for eval, names not in
+    locals are looked up in this module's globals (e.g. os, time, shutil).
+    """
+    key: tp.ClassVar[str] = 'evalAsync'
+    evalStr: str = ''
+
+    def _start(self):
+        match = _evalAsyncRegex.match(self.evalStr)
+        if match is None:
+            raise ValueError('Expected \'[thread|process] <name> -> <outputs>: <code>\', got %r' % (self.evalStr,))
+        mode, name, outputsStr, code = match.groups()
+        outputs = [output.strip() for output in outputsStr.split(',') if len(output.strip()) > 0]
+        AsyncEvaluator().submit(name=name, code=code.strip(), outputs=outputs, locals=self.locals,
+                                inProcess=mode == 'process', globals=globals())
+        self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(evalStr=s, **kwargs)
+
+
+@attr.s(auto_attribs=True)
+class AwaitAction(ExperimentAction):
+    """
+    Wait for an evalAsync (or, if no name given, all running ones) to finish, and its outputs to be
+    assigned. If any of them failed, raises its error. As with job names, the name is used as given
+    rather than evaluated. After resuming from a journal, an unknown name is assumed to have
+    finished before the session was interrupted (with its outputs restored from the journal).
+    """
+    key: tp.ClassVar[str] = 'await'
+    name: str = ''
+
+    _evaluations: tp.List[AsyncEvaluation] = attr.ib(init=False, factory=list)
+    _waitingFor: tp.List[AsyncEvaluation] = attr.ib(init=False, factory=list)
+
+    def _start(self):
+        evaluator = AsyncEvaluator()
+        if len(self.name) > 0:
+            try:
+                self._evaluations = [evaluator.get(self.name)]
+            except KeyError:
+                if not evaluator.wasSessionRestored:
+                    raise
+                logger.warning('No evalAsync named %s since resuming from journal, assuming it already finished' % (self.name,))
+                self._evaluations = []
+        else:
+            self._evaluations = [evaluation for evaluation in evaluator.evaluations if not evaluation.isFinished]
+        self._waitingFor = [evaluation for evaluation in self._evaluations if not evaluation.isFinished]
+        if len(self._waitingFor) == 0:
+            self._onEvaluationsFinished()
+            return
+        logger.info('Waiting for evalAsync %s' % (', '.join(evaluation.name for evaluation in self._waitingFor),))
+        evaluator.signals.sigFinished.connect(self._onEvaluationFinished)
+
+    def _onEvaluationFinished(self, evaluation: AsyncEvaluation):
+        if evaluation not in self._waitingFor:
+            return
+        self._waitingFor.remove(evaluation)
+        if len(self._waitingFor) == 0:
+            AsyncEvaluator().signals.sigFinished.disconnect(self._onEvaluationFinished)
+            self._onEvaluationsFinished()
+
+    def _onEvaluationsFinished(self):
+        failed = [evaluation for evaluation in self._evaluations if evaluation.state != AsyncEvalState.SUCCEEDED]
+        if len(failed) == 0:
+            self._onStop()
+        elif len(failed) == 1 and failed[0].error is not None:
+            self._handleExceptionWhileRunning(failed[0].error)
+        else:
+            self._handleExceptionWhileRunning(RuntimeError('evalAsync failed: %s' % ('; '.join(str(evaluation) for evaluation in failed),)))
+
+    def stop(self):
+        # stop waiting, but leave evaluations running
+        if len(self._waitingFor) > 0:
+            AsyncEvaluator().signals.sigFinished.disconnect(self._onEvaluationFinished)
+            self._waitingFor = []
+        if not self.didStop:
+            self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(name=s.strip(), **kwargs)
+
+
 class ControlFlowConditionResult(Exception):
     value: bool
 
@@ -201,44 +330,6 @@ class LogAction(NoninterruptibleAction):
         return cls(logStr=s, **kwargs)
 
 
-@attr.s(auto_attribs=True)
-class SpeakAction(ExperimentAction):
-    key: tp.ClassVar[str] = 'speak'
-    speakStr: str = ''
-
-    _engine: tp.Optional[pyttsx3.Engine] = attr.ib(default=None)
-    _callbackToken: dict = attr.ib(init=False, default=None)
-
-    def __attrs_post_init__(self):
-        super().__attrs_post_init__()
-        if self._engine is None:
-            self._engine = pyttsx3.init()
-
-    def _start(self):
-        speakStr = self._evalStr(self.speakStr)
-        self._engine.say(speakStr)
-        logger.info('Speaking \'%s\'' % speakStr)
-        self._callbackToken = self._engine.connect('finished-utterance', self._onFinishedSpeaking)
-        self._engine.startLoop()
-
-    def stop(self):
-        logger.debug('Speech terminated early')
-        if self._engine._inLoop:  # note: using undocumented private variable...
-            self._engine.stop()
-        else:
-            self._onStop()
-
-    def _onFinishedSpeaking(self, name: str, completed: bool):
-        logger.debug('Finished speaking')
-        self._engine.disconnect(self._callbackToken)
-        self._engine.endLoop()
-        self._onStop()
-
-    @classmethod
-    def fromString(cls, s: str, **kwargs):
-        return cls(speakStr=s, **kwargs)
-
-
 @attr.s(auto_attribs=True)
 class MessageBoxAction(ExperimentAction):
     key: tp.ClassVar[str] = 'messageBox'
@@ -367,153 +458,93 @@ class RunScriptAction(ExperimentAction):
     scriptPathAndArgs: str = ''
 
     _runningScript: str = ''
-    _proc: tp.Optional[subprocess.Popen] = attr.ib(init=False, default=None)
-    _procFuture: tp.Optional[Future] = attr.ib(init=False, default=None)
-    _procStdoutQueue: queue.Queue = attr.ib(init=False, factory=queue.Queue)
-    _procStderrQueue: queue.Queue = attr.ib(init=False, factory=queue.Queue)
-    _timer: tp.Optional[QtCore.QTimer] = attr.ib(default=None, init=False)
+    _process: tp.Optional[tp.Union[ScriptProcess, PythonScriptRun]] = attr.ib(init=False, default=None)
+    _isStopping: bool = attr.ib(init=False, default=False)
 
     def _start(self):
-        assert self._proc is None
+        assert self._process is None
         self._runningScript = self._evalStr(self.scriptPathAndArgs)
 
-        if True:
-            # run in separate command window
-            if '.bat' in self._runningScript and False:
-                # hack for weird windows start quote escaping when running a bat file...
-                cmd = 'start /w cmd /c %s' % self._runningScript
-            else:
-                if False:
-                    cmd = 'start /w "" ' + self._runningScript
-                else:
-                    cmd = self._runningScript
-
-            def setProc(proc):
-                logger.debug(f'Setting proc to {proc}')
-                self._proc = proc
-
-            self._procFuture = command_runner_threaded(cmd,
-                                                       stdout=self._procStdoutQueue,
-                                                       stderr=self._procStderrQueue,
-                                                       method='poller',
-                                                       process_callback=setProc,
-                                                       shell=True
-                                                       )
-
-        self._timer = QtCore.QTimer()
-        self._timer.timeout.connect(self._poll)
-        self._timer.setInterval(100)
+        self._process = self._createProcess(self._runningScript)
+        self._process.sigFinished.connect(self._onProcessFinished)
+        self._process.start()
 
         logger.info('Process started, waiting for it to finish: %s' % (self._runningScript,))
-        self._timer.start()
 
-    def _onProcessReturned(self, ret):
-        assert ret is not None
+    def _onProcessFinished(self, result: ScriptResult):
+        self._process = None
+        self._runningScript = ''
 
-        self._pollProcOutput()
+        if self._isStopping:
+            self._isStopping = False
+            logger.info('Process terminated early: %s' % (result,))
+            self._onStop()
+            return
 
-        # TODO: print return code, generate error if return code indicates error
-        if ret != 0:
-            raise RuntimeError('Process returned error: %s' % (ret,))
+        if result.returnCode != 0:
+            self._handleExceptionWhileRunning(RuntimeError('Process %s' % (result,)))
         else:
-            logger.info('Process returned: %s' % (ret,))
-        self._timer.stop()
-        self._onStop()
-
-    def _setProc(self, proc: subprocess.Popen):
-        assert self._proc is None
-        self._proc = proc
-
-    def _pollProcOutput(self):
-        while True:
-            try:
-                stdout_line = self._procStdoutQueue.get(block=False)
-            except queue.Empty:
-                break
-            else:
-                if stdout_line is None:
-                    break
-                else:
-                    logger.info('Subprocess output: %s' % (stdout_line.rstrip('\r\n')))
-
-        while True:
-            try:
-                stderr_line = self._procStderrQueue.get(block=False)
-            except queue.Empty:
-                break
-            else:
-                if stderr_line is None:
-                    break
-                else:
-                    logger.error('Subprocess error output: %s' % (stderr_line.rstrip('\r\n')))
-
-    def _poll(self):
-
-        assert self._procFuture is not None
-
-        self._pollProcOutput()
+            logger.info('Process %s' % (result,))
+            self._onStop()
 
-        if not self._procFuture.done():
-            # process still running
+    def stop(self):
+        if self._process is None:
+            if not self.didStop:
+                self._onStop()
             return
-        else:
-            ret, output = self._procFuture.result()
-            try:
-                self._onProcessReturned(ret)
-            except Exception as e:
-                if self.onExceptionWhileRunning is not None:
-                    howToProceed = self.onExceptionWhileRunning(self, e)
-                    if howToProceed == 'raise':
-                        raise e
-                    elif howToProceed == 'stop':
-                        self._timer.stop()
-                        self._onStop()
-                    elif howToProceed == 'continue':
-                        # process finished, register stop anyways
-                        self._timer.stop()
-                        self._onStop()
-                    else:
-                        raise NotImplementedError
-                else:
-                    raise e
+        if self._isStopping:
+            return  # already being killed
+        self._isStopping = True
+        self._process.kill(doWait=False)  # without blocking the GUI; sigFinished then triggers _onProcessFinished
 
-    def stop(self):
-        assert self._procFuture is not None
-        while self._proc is None and not self._procFuture.done():
-            # wait for command_runner to start process
-            time.sleep(0.1)
-        self._timer.stop()
-        if not self._procFuture.done():
-            assert self._proc is not None
-            if True:
-                # adapted from https://stackoverflow.com/a/32814686
-                subprocess.run('taskkill /pid %d /T /F' % self._proc.pid)
-            else:
-                # this kills process but not children of `start`
-                self._proc.terminate()
-            # TODO: maybe use command_runner `on_stop` callback instead
+    def _createProcess(self, cmd: str) -> tp.Union[ScriptProcess, PythonScriptRun]:
+        return ScriptProcess(cmd, env=VariableChannelServer().serve(self.locals))
 
-        ret, output = self._procFuture.result()  # will block until finished
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(scriptPathAndArgs=s, **kwargs)
 
-        self._pollProcOutput()
 
-        logger.info('Process terminated early: %s' % (self._runningScript,))
-        self._procFuture = None
-        self._proc = None
-        self._runningScript = ''
-        self._onStop()
+@attr.s(auto_attribs=True)
+class RunPythonAction(RunScriptAction):
+    """
+    Like runScript for `python <script> <args>`, but runs the script in a pre-started interpreter
+    from PythonWorkerPool, with commonly used modules already imported.
+    """
+    key: tp.ClassVar[str] = 'runPython'
+
+    def _createProcess(self, cmd: str) -> PythonScriptRun:
+        scriptPath, args = splitPythonCommandLine(cmd)
+        return PythonWorkerPool().createRun(scriptPath, args, env=VariableChannelServer().serve(self.locals))
 
     @classmethod
-    def fromString(cls, s: str, **kwargs):
-        return cls(scriptPathAndArgs=s, **kwargs)
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        if len(argStrs) > 0:
+            PythonWorkerPool().warmUp()
 
 
 @attr.s(auto_attribs=True)
 class RunScriptInBackgroundAction(NoninterruptibleAction):
+    """
+    Start a script in a separate window and continue immediately, e.g.:
+        <script and args>
+    or run it as a named job tracked by JobManager (see jobWait, jobStatus, jobKill), e.g.:
+        job <name> <script and args>
+    Job names are used as given rather than evaluated, here and in the other job actions.
+    """
     key: tp.ClassVar[str] = 'runScriptInBackground'
     scriptPathAndArgs: str = ''
 
     def _start(self):
+        if self.scriptPathAndArgs.startswith('job '):
+            nameAndCmd = self.scriptPathAndArgs[len('job '):].strip().split(maxsplit=1)
+            if len(nameAndCmd) < 2:
+                raise ValueError('Expected \'job <name> <script and args>\', got %r' % (self.scriptPathAndArgs,))
+            name, cmd = nameAndCmd
+            JobManager().submit(name=name, cmd=self._evalStr(cmd), env=VariableChannelServer().serve(self.locals))
+            self._onStop()
+            return
+
         self._runningScript = self._evalStr(self.scriptPathAndArgs)
 
         if '.bat' in self._runningScript:
@@ -521,10 +552,13 @@ class RunScriptInBackgroundAction(NoninterruptibleAction):
             cmd = 'start /w call %s' % self._runningScript
         else:
             cmd = 'start /w "" ' + self._runningScript
-        subprocess.Popen(cmd,
-                         shell=True,
-                         stdout=subprocess.DEVNULL,
-                         stderr=subprocess.DEVNULL)
+        proc = subprocess.Popen(cmd,
+                                shell=True,
+                                env={**os.environ, **VariableChannelServer().serve(self.locals)},
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                **ProcessSupervisor.popenKwargs())
+        ProcessSupervisor().register(proc, description=self._runningScript)
 
         logger.info('Process started in background: %s' % (self._runningScript,))
         self._onStop()
@@ -534,15 +568,116 @@ class RunScriptInBackgroundAction(NoninterruptibleAction):
         return cls(scriptPathAndArgs=s, **kwargs)
 
 
+@attr.s(auto_attribs=True)
+class JobWaitAction(ExperimentAction):
+    """
+    Wait for a background job (or, if no name given, all unfinished jobs) to finish. If any of
+    them failed, raises an error. After resuming from a journal, an unknown name is assumed to
+    have finished before the session was interrupted.
+    """
+    key: tp.ClassVar[str] = 'jobWait'
+    name: str = ''
+
+    _jobs: tp.List[Job] = attr.ib(init=False, factory=list)
+    _waitingFor: tp.List[Job] = attr.ib(init=False, factory=list)
+
+    def _start(self):
+        manager = JobManager()
+        if len(self.name) > 0:
+            try:
+                self._jobs = [manager.getJob(self.name)]
+            except KeyError:
+                if not manager.wasSessionRestored:
+                    raise
+                logger.warning('No job named %s since resuming from journal, assuming it already finished' % (self.name,))
+                self._jobs = []
+        else:
+            self._jobs = [job for job in manager.jobs if not job.isFinished]
+        self._waitingFor = [job for job in self._jobs if not job.isFinished]
+        if len(self._waitingFor) == 0:
+            self._onJobsFinished()
+            return
+        logger.info('Waiting for jobs %s' % (', '.join(job.name for job in self._waitingFor),))
+        manager.signals.sigJobChanged.connect(self._onJobChanged)
+
+    def _onJobChanged(self, job: Job):
+        if job not in self._waitingFor or not job.isFinished:
+            return
+        self._waitingFor.remove(job)
+        if len(self._waitingFor) == 0:
+            JobManager().signals.sigJobChanged.disconnect(self._onJobChanged)
+            self._onJobsFinished()
+
+    def _onJobsFinished(self):
+        failed = [job for job in self._jobs if job.state == JobState.FAILED]
+        if len(failed) > 0:
+            self._handleExceptionWhileRunning(RuntimeError('Job failed: %s' % ('; '.join(str(job) for job in failed),)))
+        else:
+            self._onStop()
+
+    def stop(self):
+        # stop waiting, but leave jobs running
+        if len(self._waitingFor) > 0:
+            JobManager().signals.sigJobChanged.disconnect(self._onJobChanged)
+            self._waitingFor = []
+        if not self.didStop:
+            self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(name=s.strip(), **kwargs)
+
+
+@attr.s(auto_attribs=True)
+class JobStatusAction(NoninterruptibleAction):
+    """
+    Log status of a background job, or of all jobs if no name given.
+    """
+    key: tp.ClassVar[str] = 'jobStatus'
+    name: str = ''
+
+    def _start(self):
+        manager = JobManager()
+        jobs = [manager.getJob(self.name)] if len(self.name) > 0 else manager.jobs
+        if len(jobs) == 0:
+            logger.info('No jobs')
+        for job in jobs:
+            logger.info('Job %s' % (job,))
+        self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(name=s.strip(), **kwargs)
+
+
+@attr.s(auto_attribs=True)
+class JobKillAction(NoninterruptibleAction):
+    key: tp.ClassVar[str] = 'jobKill'
+    name: str = ''
+
+    def _start(self):
+        JobManager().kill(self.name)
+        self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(name=s.strip(), **kwargs)
+
+
 ActionTypes = [
     EvalAction,
+    EvalAsyncAction,
+    AwaitAction,
     WaitAction,
     ControlFlowAction,
     LogAction,
-    SpeakAction,
     MessageBoxAction,
     GetInputAction,
     CopyToClipboardAction,
     RunScriptAction,
+    RunPythonAction,
     RunScriptInBackgroundAction,
+    JobWaitAction,
+    JobStatusAction,
+    JobKillAction,
 ]
\ No newline at end of file
@@ -9,8 +9,6 @@ import pandas as pd
 import logging
 import time
 import argparse
-import psutil
-import subprocess
 import dbm
 import shelve
 import traceback
@@ -18,17 +16,32 @@ import traceback
 from ExperimentAutomator.Experiment import Experiment, ExperimentTableModel
 from ExperimentAutomator.LogConsole import LogConsole
 from ExperimentAutomator.VariablesView import VariablesDockWidget
-from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.JobsView import JobsDockWidget
+from ExperimentAutomator.JobManager import JobManager
+from ExperimentAutomator.Configuration import globalConfiguration, ConfigurationWatcher
+from ExperimentAutomator.ExecutionJournal import ExecutionJournal
+from ExperimentAutomator.VLCControl import VLCInstancePool
+from ExperimentAutomator.LSLControl import LSLMarkerOutlet
+from ExperimentAutomator.BrainProductsControl import BVRecorderAutomator
+from ExperimentAutomator.StimulusPresentation import StimulusPresenter
+from ExperimentAutomator.AudioControl import AudioPlayer
+from ExperimentAutomator.SpeechControl import Speaker
+from ExperimentAutomator.PythonWorkerPool import PythonWorkerPool
+from ExperimentAutomator.ProcessSupervisor import ProcessSupervisor
+from ExperimentAutomator.AsyncEval import AsyncEvaluator
+from ExperimentAutomator.VariableChannel import VariableChannelServer
+from ExperimentAutomator.Misc import getUserDataDir
 from ExperimentAutomator._version import __version__
 
 logger = logging.getLogger(__name__)
 
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, tablePath: str):
+    def __init__(self, tablePath: str, doResume: bool = False):
         super().__init__()
 
         self.exp = Experiment.fromFile(tablePath, parentWin=self)
+        self._openJournal(tablePath=tablePath, doResume=doResume)
         self.exp.sigStartedRunning.connect(self._onStartedRunning)
         self.exp.sigStoppedRunning.connect(self._onStoppedRunning)
         self.exp.sigCurrentActionChanged.connect(self._scrollToCurrentAction)
@@ -129,10 +142,40 @@ class MainWindow(QtWidgets.QMainWindow):
         self.variablesAction.setIcon(qta.icon('mdi6.variable'))
         self.mainToolbar.insertAction(self.evalAction, self.variablesAction)
 
+        self.jobsDock = JobsDockWidget(parent=self)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.jobsDock)
+        self.jobsDock.hide()
+        self.jobsAction = self.jobsDock.toggleViewAction()
+        self.jobsAction.setIcon(qta.icon('mdi6.progress-clock'))
+        self.mainToolbar.insertAction(self.evalAction, self.jobsAction)
+
+        self.configurationWatcher = ConfigurationWatcher(globalConfiguration, parent=self)
+        self.configurationWatcher.sigConfigurationChanged.connect(self._onConfigurationChanged)
+
         QtCore.QTimer.singleShot(0, lambda: self.loadSettings())
 
 
 
+    def _openJournal(self, tablePath: str, doResume: bool):
+        self.journal = ExecutionJournal(path=ExecutionJournal.defaultPathForTable(tablePath),
+                                        tablePath=os.path.abspath(tablePath),
+                                        tableHash=ExecutionJournal.hashTableFile(tablePath))
+        if doResume:
+            if os.path.exists(self.journal.path):
+                logger.info('Resuming from journal %s' % (self.journal.path,))
+                state = ExecutionJournal.readState(self.journal.path)
+                if state.tableHash != self.journal.tableHash:
+                    logger.warning('Experiment table has changed since journaled session; '
+                                   'resumed position may not correspond to the same action')
+                self.exp.restoreFromJournal(state)
+                self.journal.open(doAppend=True, initialLocals=self.exp.locals)
+            else:
+                logger.warning('No journal to resume from at %s, starting from beginning' % (self.journal.path,))
+                self.journal.open()
+        else:
+            self.journal.open()
+        self.exp.setJournal(self.journal)
+
     def closeEvent(self, event:QtGui.QCloseEvent):
         self._onAboutToClose()
         event.accept()
@@ -246,28 +289,34 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.tblView.clearSelection()
 
+    def _onConfigurationChanged(self, keys: tp.Set[str]):
+        # automators that read values only when first needed update them here; others read values on each use
+        for automator in (Speaker(), AudioPlayer(), StimulusPresenter(), AsyncEvaluator()):
+            automator.onConfigurationChanged(keys)
+        self.variablesDock.refresh()
+
     def _onAboutToClose(self):
+        # give players a chance to exit cleanly before any remaining children are killed below
+        VLCInstancePool().shutdown()
+        StimulusPresenter().close()
+        Speaker().close()
+        AudioPlayer().close()
+        PythonWorkerPool().shutdown()
+        JobManager().shutdown()
+        AsyncEvaluator().shutdown()
+        VariableChannelServer().close()
+        LSLMarkerOutlet().close()
+        BVRecorderAutomator().close()
+
         logger.info('Terminating child processes before closing')
-        if False:
-            pid = os.getpid()
-            subprocess.run('taskkill /t /pid %d' % pid)
-            time.sleep(2)
-            subprocess.run('taskkill /f /t /pid %d' % pid)
-        else:
-            current_process = psutil.Process()
-            children = current_process.children(recursive=True)
-            for child in children:
-                subprocess.run('taskkill /t /pid %d' % child.pid)
-            time.sleep(0.5)
-            children = current_process.children(recursive=True)
-            for child in children:
-                subprocess.run('taskkill /f /t /pid %d' % child.pid)
+        ProcessSupervisor().terminateAll(gracePeriod=globalConfiguration.ProcessTerminateGracePeriod)
+
+        self.journal.close()
 
         self.saveSettings()
 
     def _getPersistentSettingsPath(self) -> str:
-        dir = os.getenv('LOCALAPPDATA')
-        return os.path.join(dir, 'ExperimentAutomator', 'ExperimentAutomatorUserSettings')
+        return os.path.join(getUserDataDir(), 'ExperimentAutomatorUserSettings')
 
     def loadSettings(self):
         settingsPath = self._getPersistentSettingsPath()
@@ -311,6 +360,10 @@ def main():
     parser.add_argument('--experimentTable',
                         help='Path to experiment definition (csv or xlsx)',
                         default=None)
+    parser.add_argument('--resume',
+                        help='Restore position and variables from the execution journal of the last session '
+                             'with this experiment table (e.g. after a crash)',
+                        action='store_true')
     args = parser.parse_args()
 
     app = pg.mkQApp()
@@ -322,7 +375,7 @@ def main():
         else:
             args.experimentTable,_ = QtWidgets.QFileDialog.getOpenFileName(None, 'Open experiment table','..','Tables (*.csv *.xlsx)')
 
-    mainWin = MainWindow(tablePath=args.experimentTable)
+    mainWin = MainWindow(tablePath=args.experimentTable, doResume=args.resume)
     mainWin.show()
     sys.exit(app.exec_())
 
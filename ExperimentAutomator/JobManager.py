@@ -0,0 +1,179 @@
+"""
+Named background jobs (shell commands), run at most `MaxConcurrentJobs` at a time so that e.g.
+preprocessing of earlier data doesn't compete for CPU with timing-critical work. Jobs beyond the
+limit wait in a queue. If configuration value LowerJobPriority is set, jobs also run at below
+normal priority.
+"""
+import collections
+import logging
+import sys
+import time
+import typing as tp
+
+import attr
+import psutil
+from qtpy import QtCore
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.Misc import Singleton
+from ExperimentAutomator.ScriptProcess import ScriptProcess, ScriptResult
+
+logger = logging.getLogger(__name__)
+
+
+class JobState:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    KILLED = 'killed'
+
+    FINISHED = (SUCCEEDED, FAILED, KILLED)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class Job:
+    name: str
+    cmd: str
+    state: str = JobState.QUEUED
+    queueTime: float = attr.ib(factory=time.monotonic)
+    startTime: tp.Optional[float] = None
+    endTime: tp.Optional[float] = None
+    result: tp.Optional[ScriptResult] = None
+    env: tp.Optional[tp.Dict[str, str]] = attr.ib(default=None, repr=False)
+    process: tp.Optional[ScriptProcess] = attr.ib(default=None, repr=False)
+
+    @property
+    def isFinished(self) -> bool:
+        return self.state in JobState.FINISHED
+
+    @property
+    def duration(self) -> tp.Optional[float]:
+        if self.startTime is None:
+            return None
+        return (time.monotonic() if self.endTime is None else self.endTime) - self.startTime
+
+    @property
+    def rss(self) -> tp.Optional[int]:
+        if self.process is None or self.isFinished:
+            return None
+        return self.process.monitor.rss
+
+    @property
+    def cpuPercent(self) -> tp.Optional[float]:
+        if self.process is None or self.isFinished:
+            return None
+        return self.process.monitor.cpuPercent
+
+    def __str__(self):
+        if self.result is not None:
+            return '%s %s: %s' % (self.name, self.state, self.result)
+        elif self.state == JobState.RUNNING:
+            usage = ''
+            if self.rss is not None:
+                usage = ', %.0f%% CPU, %.0f MB' % (self.cpuPercent, self.rss / 2**20)
+            return '%s running for %.1f s%s' % (self.name, self.duration, usage)
+        else:
+            return '%s %s' % (self.name, self.state)
+
+
+class _JobSignals(QtCore.QObject):
+    sigJobChanged = QtCore.Signal(object)  # emits Job, when added, started, or finished
+
+
+@attr.s(auto_attribs=True, eq=False)
+class JobManager(metaclass=Singleton):
+    signals: _JobSignals = attr.ib(init=False, factory=_JobSignals)
+    _jobs: tp.OrderedDict[str, Job] = attr.ib(init=False, factory=collections.OrderedDict)  # in order submitted
+    _queue: tp.Deque[Job] = attr.ib(init=False, factory=collections.deque)
+    wasSessionRestored: bool = attr.ib(init=False, default=False)  # set once resumed from a journal, whose jobs are unknown here
+
+    @property
+    def jobs(self) -> tp.List[Job]:
+        return list(self._jobs.values())
+
+    @property
+    def maxConcurrent(self) -> int:
+        return globalConfiguration.MaxConcurrentJobs
+
+    def getJob(self, name: str) -> Job:
+        try:
+            return self._jobs[name]
+        except KeyError:
+            raise KeyError('No job named %s' % (name,))
+
+    def submit(self, name: str, cmd: str, env: tp.Optional[tp.Dict[str, str]] = None) -> Job:
+        """
+        Queue a job, which is started as soon as fewer than maxConcurrent jobs are running. A
+        finished job's name can be reused, replacing it. env is added to the job's environment.
+        """
+        if name in self._jobs and not self._jobs[name].isFinished:
+            raise ValueError('Job %s is already %s' % (name, self._jobs[name].state))
+        self._jobs.pop(name, None)
+        job = Job(name=name, cmd=cmd, env=env)
+        self._jobs[name] = job
+        self._queue.append(job)
+        self.signals.sigJobChanged.emit(job)
+        self._startQueued()
+        if job.state == JobState.QUEUED:
+            logger.info('Job %s queued (%d jobs running)' % (name, self._numRunning()))
+        return job
+
+    def kill(self, name: str):
+        job = self.getJob(name)
+        if job.state == JobState.QUEUED:
+            self._queue.remove(job)
+            job.state = JobState.KILLED
+            logger.info('Job %s removed from queue' % (name,))
+            self.signals.sigJobChanged.emit(job)
+        elif job.state == JobState.RUNNING:
+            job.process.kill()  # finishing is handled by _onJobFinished
+
+    def shutdown(self):
+        """
+        Drop queued jobs and kill running ones.
+        """
+        self._queue.clear()
+        for job in self._jobs.values():
+            if job.state == JobState.RUNNING:
+                job.process.kill()
+                job.process.waitForFinished(timeout=1.)
+
+    def _numRunning(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.state == JobState.RUNNING)
+
+    def _startQueued(self):
+        while len(self._queue) > 0 and self._numRunning() < self.maxConcurrent:
+            job = self._queue.popleft()
+            job.process = ScriptProcess(job.cmd, name='Job %s' % (job.name,), memorySampleInterval=1., env=job.env)
+            job.process.sigStarted.connect(self._onJobStarted)
+            job.process.sigFinished.connect(lambda result, job=job: self._onJobFinished(job, result))
+            job.state = JobState.RUNNING
+            job.startTime = time.monotonic()
+            job.process.start()
+            logger.info('Job %s started after %.1f s in queue: %s' % (job.name, job.startTime - job.queueTime, job.cmd))
+            self.signals.sigJobChanged.emit(job)
+
+    def _onJobStarted(self, pid: int):
+        if not globalConfiguration.LowerJobPriority:
+            return
+        try:
+            # children started later inherit this priority
+            psutil.Process(pid).nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if sys.platform == 'win32' else 10)
+        except psutil.Error as e:
+            logger.warning('Unable to lower priority of job process %d: %s' % (pid, e))
+
+    def _onJobFinished(self, job: Job, result: ScriptResult):
+        job.result = result
+        job.endTime = time.monotonic()
+        if result.wasKilled:
+            job.state = JobState.KILLED
+        elif result.returnCode == 0:
+            job.state = JobState.SUCCEEDED
+        else:
+            job.state = JobState.FAILED
+        job.process.deleteLater()
+        job.process = None
+        logger.log(logging.INFO if job.state == JobState.SUCCEEDED else logging.WARNING, 'Job %s' % (job,))
+        self.signals.sigJobChanged.emit(job)
+        self._startQueued()
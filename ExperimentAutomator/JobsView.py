@@ -0,0 +1,146 @@
+import logging
+import os
+import typing as tp
+
+from qtpy import QtCore, QtGui, QtWidgets
+
+from ExperimentAutomator.JobManager import JobManager, Job, JobState
+
+logger = logging.getLogger(__name__)
+
+
+def _formatDuration(duration: tp.Optional[float]) -> str:
+    if duration is None:
+        return ''
+    minutes, seconds = divmod(duration, 60)
+    return '%d:%04.1f' % (minutes, seconds)
+
+
+class JobsTableModel(QtCore.QAbstractTableModel):
+    _columnLabels: tp.ClassVar[tp.Tuple[str, ...]] = ('Name', 'State', 'Duration', 'CPU', 'Memory', 'Command')
+
+    def __init__(self, manager: JobManager, parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QAbstractTableModel.__init__(self, parent=parent)
+        self._manager = manager
+        self._jobs: tp.List[Job] = manager.jobs
+        self._manager.signals.sigJobChanged.connect(self.refresh)
+
+    def jobAt(self, row: int) -> tp.Optional[Job]:
+        try:
+            return self._jobs[row]
+        except IndexError:
+            return None
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._jobs)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._columnLabels)
+
+    def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int = QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            try:
+                return self._columnLabels[section]
+            except IndexError:
+                return None
+        return None
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.DisplayRole):
+        job = self.jobAt(index.row()) if index.isValid() else None
+        if job is None:
+            return None
+        col = index.column()
+
+        if role == QtCore.Qt.DisplayRole:
+            if col == 0:
+                return job.name
+            elif col == 1:
+                if job.result is not None and job.state == JobState.FAILED:
+                    return '%s (%s)' % (job.state, job.result.returnCode)
+                return job.state
+            elif col == 2:
+                return _formatDuration(job.duration)
+            elif col == 3:
+                return '' if job.cpuPercent is None else '%.0f%%' % (job.cpuPercent,)
+            elif col == 4:
+                if job.rss is not None:
+                    return '%.0f MB' % (job.rss / 2**20,)
+                elif job.result is not None and job.result.peakRSS is not None:
+                    return '%.0f MB peak' % (job.result.peakRSS / 2**20,)
+                return ''
+            elif col == 5:
+                return job.cmd
+        elif role == QtCore.Qt.ToolTipRole:
+            return str(job)
+        elif role == QtCore.Qt.ForegroundRole and col == 1:
+            if job.state == JobState.FAILED:
+                return QtGui.QBrush(QtGui.QColor(255, 80, 80))
+        elif role == QtCore.Qt.TextAlignmentRole and col in (2, 3, 4):
+            return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        return None
+
+    def refresh(self, *args):
+        jobs = self._manager.jobs
+        if [id(job) for job in jobs] != [id(job) for job in self._jobs]:
+            self.beginResetModel()
+            self._jobs = jobs
+            self.endResetModel()
+        elif len(jobs) > 0:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(jobs) - 1, len(self._columnLabels) - 1))
+
+
+class JobsDockWidget(QtWidgets.QDockWidget):
+    _refreshIntervalMs: int = 1000
+
+    def __init__(self, parent: tp.Optional[QtWidgets.QWidget] = None):
+        QtWidgets.QDockWidget.__init__(self, 'Jobs', parent=parent)
+        self.setObjectName('JobsDock')  # required for saveState/restoreState persistence
+
+        self._model = JobsTableModel(manager=JobManager(), parent=self)
+        self._view = QtWidgets.QTableView(parent=self)
+        self._view.setModel(self._model)
+        self._view.verticalHeader().setVisible(False)
+        self._view.horizontalHeader().setStretchLastSection(True)
+        self._view.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        self._view.setWordWrap(False)
+        self._view.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self._view.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        self._view.customContextMenuRequested.connect(self._onContextMenuRequested)
+        self.setWidget(self._view)
+
+        # durations and resource use change without any job changing state
+        self._refreshTimer = QtCore.QTimer(self)
+        self._refreshTimer.setInterval(self._refreshIntervalMs)
+        self._refreshTimer.timeout.connect(self._model.refresh)
+
+        self.visibilityChanged.connect(self._onVisibilityChanged)
+
+    def _onVisibilityChanged(self, visible: bool):
+        if visible:
+            self._model.refresh()
+            self._refreshTimer.start()
+        else:
+            self._refreshTimer.stop()
+
+    def _onContextMenuRequested(self, pos: QtCore.QPoint):
+        job = self._model.jobAt(self._view.indexAt(pos).row())
+        if job is None:
+            return
+        contextMenu = QtWidgets.QMenu()
+
+        killAction = QtWidgets.QAction('&Kill')
+        killAction.setEnabled(not job.isFinished)
+        killAction.triggered.connect(lambda *args, name=job.name: JobManager().kill(name))
+        contextMenu.addAction(killAction)
+
+        logPath = job.result.logPath if job.result is not None else (job.process.logPath if job.process is not None else None)
+        openLogAction = QtWidgets.QAction('&Open log')
+        openLogAction.setEnabled(logPath is not None and os.path.exists(logPath))
+        openLogAction.triggered.connect(lambda *args, path=logPath: QtGui.QDesktopServices.openUrl(QtCore.QUrl.fromLocalFile(path)))
+        contextMenu.addAction(openLogAction)
+
+        contextMenu.exec_(self._view.mapToGlobal(pos))
@@ -0,0 +1,57 @@
+import typing as tp
+import attr
+import logging
+
+import pylsl
+
+from ExperimentAutomator.ExperimentActions import NoninterruptibleAction
+from .LSLMarkerOutlet import LSLMarkerOutlet
+from .LabRecorderAutomator import LabRecorderAutomator
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True)
+class LSLMarkerAction(NoninterruptibleAction):
+    """
+    Push markers to the experiment's LSL marker stream (see LSLMarkerOutlet), e.g.:
+        <marker>
+        chunk <list of (marker, timestamp) pairs>
+        requireInLabRecorder
+    A single marker is timestamped when the action starts, before the marker is evaluated. Markers
+    in a chunk need their own (pylsl.local_clock()) timestamps, e.g. from when the events they mark
+    happened, since giving all of them the same time would lose their order and spacing.
+    requireInLabRecorder adds the stream to LabRecorder's required streams (taking effect at launch).
+    """
+    key: tp.ClassVar[str] = 'lslMarker'
+    cmd: str = ''
+
+    def _start(self):
+        timestamp = pylsl.local_clock()
+        outlet = LSLMarkerOutlet()
+        if self.cmd == 'requireInLabRecorder':
+            LabRecorderAutomator().addRequiredStream(outlet.labRecorderName)
+            logger.info('Added required stream (%s). Will not take effect until launch.' % (outlet.labRecorderName,))
+        elif self.cmd.startswith('chunk '):
+            # evaluated with locals as globals so that comprehensions can refer to them, and
+            # without falling back to the literal string, which would be pushed character by character
+            markers = list(eval(self.cmd[len('chunk '):], dict(self.locals)))
+            if not all(isinstance(marker, tuple) and len(marker) == 2 for marker in markers):
+                raise ValueError('chunk requires (marker, timestamp) pairs, e.g. [(marker, t0 + i * interval) for i, marker in enumerate(markers)]')
+            outlet.pushChunk([marker for marker, _ in markers], [markerTime for _, markerTime in markers])
+            logger.info('Pushed %d LSL markers' % (len(markers),))
+        else:
+            marker = self._evalStr(self.cmd)
+            outlet.push(marker, timestamp)
+            logger.info('Pushed LSL marker %s at %.4f' % (marker, timestamp))
+        self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(cmd=s.strip(), **kwargs)
+
+    @classmethod
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        if len(argStrs) > 0:
+            # so that recorders have discovered the stream by the time the first marker is pushed
+            LSLMarkerOutlet().open()
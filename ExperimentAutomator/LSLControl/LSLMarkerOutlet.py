@@ -0,0 +1,95 @@
+import logging
+import typing as tp
+
+import attr
+import pylsl
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.Misc import Singleton
+
+logger = logging.getLogger(__name__)
+
+_channelFormats = dict(string=pylsl.cf_string, int32=pylsl.cf_int32)
+
+
+@attr.s(auto_attribs=True)
+class LSLMarkerOutlet(metaclass=Singleton):
+    """
+    Long-lived LSL marker stream, named by configuration value LSLMarkerStreamName, with markers
+    either strings or integers (configuration value LSLMarkerFormat 'string' or 'int32').
+
+    Markers are timestamped with pylsl.local_clock(), so that they are aligned with other LSL
+    streams (e.g. EEG) when recorded by LabRecorder.
+    """
+    _outlet: tp.Optional[pylsl.StreamOutlet] = attr.ib(init=False, default=None)
+    _numPushed: int = attr.ib(init=False, default=0)
+
+    @property
+    def streamName(self) -> str:
+        return globalConfiguration.LSLMarkerStreamName
+
+    @property
+    def isInt(self) -> bool:
+        return globalConfiguration.LSLMarkerFormat == 'int32'
+
+    @property
+    def labRecorderName(self) -> str:
+        """
+        Stream name as LabRecorder lists it, e.g. for RequiredStreams.
+        """
+        return '%s (%s)' % (self.streamName, self._getOutlet().get_info().hostname())
+
+    def open(self):
+        """
+        Create the outlet, if not already. Recorders only see the stream some time after it is
+        created, so should be called well before the first marker is needed.
+        """
+        self._getOutlet()
+
+    def push(self, marker: tp.Any, timestamp: tp.Optional[float] = None) -> float:
+        """
+        Push a single marker, with the given timestamp (in pylsl.local_clock() time) or otherwise
+        the current time. Returns the timestamp used.
+        """
+        if timestamp is None:
+            timestamp = pylsl.local_clock()
+        self._getOutlet().push_sample([self._convert(marker)], timestamp)
+        self._numPushed += 1
+        return timestamp
+
+    def pushChunk(self, markers: tp.Sequence[tp.Any], timestamps: tp.Sequence[float]):
+        """
+        Push many markers at once, e.g. for sync pulses at a high rate, each with its own
+        (pylsl.local_clock()) timestamp.
+        """
+        if len(markers) == 0:
+            return
+        if len(timestamps) != len(markers):
+            raise ValueError('Got %d timestamps for %d markers' % (len(timestamps), len(markers)))
+        self._getOutlet().push_chunk([[self._convert(marker)] for marker in markers], list(timestamps))
+        self._numPushed += len(markers)
+
+    def close(self):
+        if self._outlet is not None:
+            logger.info('Closing LSL marker stream %s after %d markers' % (self.streamName, self._numPushed))
+            self._outlet = None  # outlet is destroyed when no longer referenced
+
+    def _convert(self, marker: tp.Any) -> tp.Union[str, int]:
+        return int(marker) if self.isInt else str(marker)
+
+    def _getOutlet(self) -> pylsl.StreamOutlet:
+        if self._outlet is None:
+            try:
+                channelFormat = _channelFormats[globalConfiguration.LSLMarkerFormat]
+            except KeyError:
+                raise ValueError('Unsupported LSLMarkerFormat %s, should be one of %s' % (
+                    globalConfiguration.LSLMarkerFormat, ', '.join(_channelFormats)))
+            info = pylsl.StreamInfo(name=self.streamName,
+                                    type='Markers',
+                                    channel_count=1,
+                                    nominal_srate=pylsl.IRREGULAR_RATE,
+                                    channel_format=channelFormat,
+                                    source_id='ExperimentAutomator_%s' % (self.streamName,))  # so recorders can reconnect after a restart
+            self._outlet = pylsl.StreamOutlet(info)
+            logger.info('Opened LSL marker stream %s' % (self.streamName,))
+        return self._outlet
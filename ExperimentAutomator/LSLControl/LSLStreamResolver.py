@@ -0,0 +1,122 @@
+import concurrent.futures
+import logging
+import re
+import threading
+import time
+import typing as tp
+
+import attr
+import pylsl
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.Misc import Singleton
+
+logger = logging.getLogger(__name__)
+
+_streamNameRegex = re.compile(r'^(.*?)\s*\(([^()]*)\)$')  # e.g. 'Biopac (Selene)', as LabRecorder lists streams
+
+
+def _xpathLiteral(s: str) -> str:
+    return "'%s'" % (s,) if "'" not in s else '"%s"' % (s,)
+
+
+def streamPredicate(stream: str) -> str:
+    """
+    XPath predicate for pylsl.resolve_bypred matching a stream given as 'name' or 'name (hostname)'.
+    """
+    match = _streamNameRegex.match(stream)
+    if match is None:
+        return 'name=%s' % (_xpathLiteral(stream),)
+    name, hostname = match.groups()
+    return 'name=%s and hostname=%s' % (_xpathLiteral(name), _xpathLiteral(hostname))
+
+
+@attr.s(auto_attribs=True, eq=False)
+class StreamAvailability:
+    found: tp.Dict[str, pylsl.StreamInfo] = attr.ib(factory=dict)
+    missing: tp.List[str] = attr.ib(factory=list)
+    duration: float = 0.  # in s
+
+    @property
+    def isComplete(self) -> bool:
+        return len(self.missing) == 0
+
+    def __str__(self):
+        s = 'found %d of %d stream(s) in %.2f s' % (len(self.found), len(self.found) + len(self.missing), self.duration)
+        if len(self.missing) > 0:
+            s += ', missing %s' % (', '.join(self.missing),)
+        return s
+
+
+@attr.s(auto_attribs=True, eq=False)
+class LSLStreamResolver(metaclass=Singleton):
+    """
+    Looks up LSL streams (given as 'name' or 'name (hostname)') concurrently, caching what was
+    found for configuration value LSLStreamCacheTTL seconds.
+    """
+    _cache: tp.Dict[str, tp.Tuple[pylsl.StreamInfo, float]] = attr.ib(init=False, factory=dict)  # stream -> (info, time found)
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+    _executor: concurrent.futures.ThreadPoolExecutor = attr.ib(
+        init=False, factory=lambda: concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='LSLResolve'))
+    _backgroundExecutor: concurrent.futures.ThreadPoolExecutor = attr.ib(  # separate, since it waits on _executor
+        init=False, factory=lambda: concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='LSLResolveBackground'))
+
+    def resolve(self, streams: tp.Sequence[str], timeout: tp.Optional[float] = None) -> StreamAvailability:
+        """
+        Look up all streams not found recently, in parallel, waiting at most timeout (by default
+        configuration value LSLResolveTimeout) for each.
+        """
+        if timeout is None:
+            timeout = globalConfiguration.LSLResolveTimeout
+        startTime = time.perf_counter()
+        availability = StreamAvailability()
+        futures = dict()
+        for stream in dict.fromkeys(streams):  # without duplicates, in order
+            info = self._getCached(stream)
+            if info is not None:
+                availability.found[stream] = info
+            else:
+                futures[stream] = self._executor.submit(pylsl.resolve_bypred, streamPredicate(stream), 1, timeout)
+        for stream, future in futures.items():
+            try:
+                results = future.result()
+            except Exception as e:
+                logger.warning('Error looking up LSL stream %s: %s' % (stream, e))
+                results = []
+            if len(results) == 0:
+                availability.missing.append(stream)
+                continue
+            if len(results) > 1:
+                logger.warning('Found %d LSL streams matching %s, using first' % (len(results), stream))
+            availability.found[stream] = results[0]
+            with self._lock:
+                self._cache[stream] = (results[0], time.monotonic())
+        availability.duration = time.perf_counter() - startTime
+        return availability
+
+    def resolveInBackground(self, streams: tp.Sequence[str], timeout: tp.Optional[float] = None) -> concurrent.futures.Future:
+        """
+        As resolve, without blocking. The returned future's result is a StreamAvailability.
+        """
+        return self._backgroundExecutor.submit(self.resolve, list(streams), timeout)
+
+    def invalidate(self, stream: tp.Optional[str] = None):
+        """
+        Forget cached info for a stream (or all streams), e.g. after its source was restarted.
+        """
+        with self._lock:
+            if stream is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(stream, None)
+
+    def _getCached(self, stream: str) -> tp.Optional[pylsl.StreamInfo]:
+        with self._lock:
+            cached = self._cache.get(stream)
+            if cached is None:
+                return None
+            info, foundTime = cached
+            if time.monotonic() - foundTime > globalConfiguration.LSLStreamCacheTTL:
+                del self._cache[stream]
+                return None
+            return info
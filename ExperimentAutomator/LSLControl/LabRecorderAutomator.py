@@ -1,43 +1,68 @@
 import os
 import argparse
+import concurrent.futures
 import logging
 import attr
 import typing as tp
-import socket
 import subprocess
 import tempfile
 import time
 
+from qtpy import QtCore
+
 from ExperimentAutomator.Configuration import globalConfiguration
-from ExperimentAutomator.Misc import Singleton
+from ExperimentAutomator.Misc import Singleton, waitUntilReady
+from ExperimentAutomator.ProcessSupervisor import ProcessSupervisor
+from .LabRecorderTransport import RCSTransport, GUIAutomationTransport, RCSError
+from .LSLStreamResolver import LSLStreamResolver, StreamAvailability
 
 logger = logging.getLogger(__name__)
 
 
+class _LabRecorderSignals(QtCore.QObject):
+    _sigStreamsChecked = QtCore.Signal(object)  # emits Future of StreamAvailability, from resolver thread
+
+
 @attr.s(auto_attribs=True)
 class LabRecorderAutomator(metaclass=Singleton):
     """
-    Uses LabRecorder's RCS interface, and GUI automation for a few things the current RCS protocol can't do.
+    Uses GUI automation by default. If configuration value LabRecorderUseRCS is set, uses
+    LabRecorder's RCS interface instead, falling back to GUI automation if RCS is unavailable or
+    fails. RCS is opt-in since its 'start' also selects all available streams, and some LabRecorder
+    versions convert filenames sent through it to lower case.
 
-    Note that this does not do any verification of commands being received or streams being available, and
-    user-initiated changes in the GUI are not tracked here, due to limitations of the RCS interface.
+    Note that user-initiated changes in the GUI are not tracked here, due to limitations of the RCS
+    interface.
     """
 
     _needsLaunch: bool = False
     _requiredStreams: tp.List[str] = attr.ib(factory=list)
     _rcsPort: int = 22345
 
-    _cachedWin: tp.Any = None
-    _cachedWinObj: tp.Any = None
-    _cachedApp: tp.Any = None
+    _doLaunch: bool = True  # set False to connect to an already running instance (e.g. LabRecorderRCSEmulator)
+    _useRCS: tp.Optional[bool] = None  # if None, uses configuration value LabRecorderUseRCS; if RCS fails, GUI automation is used instead
+    _launchTimeout: float = 30.  # in s
+    _streamCheckWait: float = 0.5  # in s, that launch waits for a required stream check still in progress
 
     _proc: tp.Optional[subprocess.Popen] = attr.ib(init=False, default=None)
-    _sock: tp.Optional[socket.socket] = attr.ib(init=False, default=None)
+    _rcs: tp.Optional[RCSTransport] = attr.ib(init=False, default=None)
+    _gui: GUIAutomationTransport = attr.ib(init=False, factory=GUIAutomationTransport)
+    _signals: _LabRecorderSignals = attr.ib(init=False, factory=_LabRecorderSignals)
+    _didUseGUI: bool = attr.ib(init=False, default=False)  # within current setState call
+    _streamCheck: tp.Optional[concurrent.futures.Future] = attr.ib(init=False, default=None)  # most recent
+    _streamCheckStartTime: tp.Optional[float] = attr.ib(init=False, default=None)
+    _reportedStreamCheck: tp.Optional[concurrent.futures.Future] = attr.ib(init=False, default=None)
+
+    _idempotentOperations: tp.ClassVar[tp.Tuple[str, ...]] = ('setStoragePath', 'stopRecording')  # safe to repeat through GUI
+    _doAltTabRefocus: bool = attr.ib(init=False, default=True)
 
     _studyRoot: tp.Optional[str] = None
     _filename: tp.Optional[str] = None
     _isRecording: bool = False  # RCS protocol doesn't allow us to get recording state, so track what we think state is here
 
+    def __attrs_post_init__(self):
+        self._signals._sigStreamsChecked.connect(self._onStreamsChecked)  # queued, since emitted from resolver thread
+
     def _createConfig(self) -> str:
         """Returns path to config file"""
 
@@ -69,28 +94,99 @@ class LabRecorderAutomator(metaclass=Singleton):
     def isRecording(self):
         return self._isRecording  # note this is just our guess of state, may be incorrect
 
+    @property
+    def usesRCS(self) -> bool:
+        return globalConfiguration.LabRecorderUseRCS if self._useRCS is None else self._useRCS
+
     def addRequiredStream(self, stream):
         self._requiredStreams.append(stream)
         self._needsLaunch = True
+        self.checkRequiredStreams()  # so the result is usually known by launch
 
     def removeRequiredStream(self, stream):
         self._requiredStreams.remove(stream)
         self._needsLaunch = True
+        self._streamCheck = None  # launch checks the remaining streams
+
+    @property
+    def requiredStreams(self) -> tp.List[str]:
+        return list(self._requiredStreams)
+
+    def checkRequiredStreams(self) -> concurrent.futures.Future:
+        """
+        Look up required streams in the background, logging any that are missing (which LabRecorder
+        would otherwise only show as a stalled recording) once done. The returned future's result is
+        a StreamAvailability.
+        """
+        future = LSLStreamResolver().resolveInBackground(self._requiredStreams)
+        self._streamCheck = future
+        self._streamCheckStartTime = time.monotonic()
+        future.add_done_callback(self._signals._sigStreamsChecked.emit)
+        return future
+
+    def _checkStreamsBeforeLaunch(self):
+        """
+        Report the result of the required stream check started when streams were added (or of a new
+        one, if that is outdated), waiting up to _streamCheckWait for it rather than the full
+        LSLResolveTimeout.
+        """
+        future = self._streamCheck
+        if future is None or time.monotonic() - self._streamCheckStartTime > globalConfiguration.LSLStreamCacheTTL:
+            future = self.checkRequiredStreams()
+        done, _ = concurrent.futures.wait([future], timeout=self._streamCheckWait)
+        if len(done) > 0:
+            self._onStreamsChecked(future)
+        else:
+            logger.info('Still checking required LSL streams; launching LabRecorder without waiting for result')
+
+    def _onStreamsChecked(self, future: concurrent.futures.Future):
+        if future is not self._streamCheck or future is self._reportedStreamCheck:
+            return  # superseded by a later check, or already reported by launch
+        self._reportedStreamCheck = future
+        try:
+            availability: StreamAvailability = future.result()
+        except Exception as e:
+            logger.warning('Unable to check required LSL streams: %s' % (e,))
+            return
+        if availability.isComplete:
+            logger.info('Required LSL streams: %s' % (availability,))
+        else:
+            logger.warning('Required LSL streams not available: %s' % (availability,))
 
     def launch(self):
-        labRecorderPath = globalConfiguration.LabRecorderPath
-        assert labRecorderPath is not None
-        args = [labRecorderPath]
+        if len(self._requiredStreams) > 0:
+            self._checkStreamsBeforeLaunch()
+
+        if self._doLaunch:
+            labRecorderPath = globalConfiguration.LabRecorderPath
+            assert labRecorderPath is not None
+            args = [labRecorderPath]
+
+            withConfigPath = self._createConfig()
+            args.extend(['-c', withConfigPath])
 
-        withConfigPath = self._createConfig()
-        args.extend(['-c', withConfigPath])
+            logger.info('Tmp config path: %s' % withConfigPath)
 
-        logger.info('Tmp config path: %s' % withConfigPath)
+            self._proc = subprocess.Popen(args, **ProcessSupervisor.popenKwargs())
+            ProcessSupervisor().register(self._proc, description='LabRecorder')
 
-        self._proc = subprocess.Popen(args)
+        if self.usesRCS:
+            # connect to remote control interface
+            self._rcs = RCSTransport(port=self._rcsPort)
 
-        # connect to remote control interface
-        self._sock = socket.create_connection(('localhost', self._rcsPort))
+            def tryConnect() -> bool:
+                if self._proc is not None and self._proc.poll() is not None:
+                    raise RuntimeError('LabRecorder exited with code %s' % (self._proc.returncode,))
+                self._rcs.connect()
+                return True
+
+            try:
+                # LabRecorder only opens its RCS port some time after starting
+                waitUntilReady(tryConnect, description='LabRecorder RCS', timeout=self._launchTimeout,
+                               retryOn=(ConnectionRefusedError,))
+            except (OSError, RuntimeError) as e:
+                logger.warning('Unable to connect to LabRecorder RCS, will use GUI automation instead: %s' % (e,))
+                self._rcs = None
 
         self._needsLaunch = False
 
@@ -99,16 +195,39 @@ class LabRecorderAutomator(metaclass=Singleton):
             self._needsLaunch = False
             self.setState(doStopPrevious=self._isRecording)
             time.sleep(0.5)
-            self._sock.close()
-            self._sock = None
-            self._proc.terminate()
+            if self._rcs is not None:
+                self._rcs.close()
+                self._rcs = None
+            report = ProcessSupervisor().terminate([self._proc], gracePeriod=globalConfiguration.ProcessTerminateGracePeriod)
+            logger.info('Stopped LabRecorder before relaunching: %s' % (report,))
             self._proc = None
-            self._cachedApp = None
-            self._cachedWin = None
-            self._cachedWinObj = None
+            self._gui.reset()
 
         self.launch()
 
+    def _run(self, operation: str, *args):
+        """
+        Run operation (a LabRecorderTransport method) through RCS if possible, else through GUI automation.
+        """
+        if self._rcs is not None:
+            try:
+                getattr(self._rcs, operation)(*args)
+                return
+            except (OSError, RCSError) as e:
+                self._rcs.close()
+                self._rcs = None
+                if getattr(e, 'wasSent', False) and operation not in self._idempotentOperations:
+                    # repeating through the GUI could e.g. start a second recording
+                    raise RuntimeError('LabRecorder RCS %s was sent but not acknowledged, so may or may not have taken effect; '
+                                       'check LabRecorder. Will use GUI automation for later operations.' % (operation,)) from e
+                logger.warning('LabRecorder RCS %s failed, falling back to GUI automation: %s' % (operation, e))
+
+        if not self._didUseGUI:
+            self._didUseGUI = True
+            if not self._doAltTabRefocus:
+                self._gui.rememberFocus()
+        getattr(self._gui, operation)(*args)
+
     def setState(self,
                  doStopPrevious: bool = False,
                  filename: tp.Optional[str] = None,
@@ -116,88 +235,21 @@ class LabRecorderAutomator(metaclass=Singleton):
                  doStartRecording: bool = False,
                  doAltTabRefocus: bool = True
                  ):
-        # import here rather than at module level so that pywinauto's COM and DPI
-        # initialization happens after Qt's, avoiding startup conflicts; declare STA
-        # threading to match Qt's, since pywinauto's own COM mode probe can't detect
-        # it (pywin32 swallows the error that the probe relies on)
-        import sys
-        import warnings
-        sys.coinit_flags = 2  # type: ignore  # COINIT_APARTMENTTHREADED
-        with warnings.catch_warnings():
-            warnings.filterwarnings('ignore', message='Apply externally defined coinit_flags.*')
-            import pywinauto
-            import pywinauto.keyboard
-            from pywinauto.application import Application
-
-        if not doAltTabRefocus:
-            logger.debug('Looking for current top window')
-            prevWin = Application(backend="uia").connect(active_only=True).top_window().wrapper_object()
-            logger.debug('found top window')
 
         if self._needsLaunch:
             logger.warning('Recorder was not launched after changing a launch-only setting. Relaunching now.')
             self.relaunch()
 
-        assert self._proc is not None and self._proc.poll() is None
-
-        if self._cachedApp is None:
-            logger.debug('Looking for lab recorder app')
-            app = Application(backend="uia").connect(title='Lab Recorder', timeout=1)
-            self._cachedApp = app
-        else:
-            app = self._cachedApp
-
-        if self._cachedWin is None:
-            logger.debug('Looking for lab recorder window')
-            win = app.window(title='Lab Recorder')
-            if True:
-                winObj = win.wrapper_object()
-            else:
-                winObj = None
-            self._cachedWin = win
-            self._cachedWinObj = winObj
-        else:
-            logger.info('Using cached window object')
-            win = self._cachedWin
-            winObj = self._cachedWinObj
-
-        logger.debug('Looking for start and stop buttons')
-        if winObj is not None:
-            # optimization to speed up automation
-
-            startBtn = pywinauto.Desktop('uia').window(parent=winObj, title='Start', control_type='Button',
-                                                       top_level_only=False).wrapper_object()
-
-            studyRootEdit = pywinauto.Desktop('uia').window(
-                parent=winObj,
-                auto_id='MainWindow.centralwidget.scrollArea.qt_scrollarea_viewport.scrollAreaWidgetContents.rootEdit',
-                control_type='Edit',
-                top_level_only=False).wrapper_object()
-            fileTemplateEdit = pywinauto.Desktop('uia').window(
-                parent=winObj,
-                auto_id='MainWindow.centralwidget.scrollArea.qt_scrollarea_viewport.scrollAreaWidgetContents.lineEdit_template',
-                control_type='Edit',
-                top_level_only=False).wrapper_object()
-
-            stopBtn = pywinauto.Desktop('uia').window(parent=winObj, title='Stop', control_type='Button', top_level_only=False).wrapper_object()
+        assert self._proc is None or self._proc.poll() is None
+        assert self._proc is not None or not self._doLaunch
 
-        else:
-            startBtn = win.StartButton
-            studyRootEdit = win.StudyRootEdit.wrapper_object()
-            fileTemplateEdit = win.TemplateEdit.wrapper_object()
-            stopBtn = win.StopButton
+        self._didUseGUI = False
+        self._doAltTabRefocus = doAltTabRefocus
 
         if doStopPrevious:
             logger.info("Stopping previous recording")
-            if False:
-                self._sock.sendall(b'stop\n')
-            else:
-                logger.info("Stopping previous recording")
-                try:
-                    stopBtn.click()
-                except AttributeError as e:
-                    logger.info('Unable to stop previous recording (already stopped?)')
-            self._isRecording = False  # note that this isn't verified
+            self._run('stopRecording')
+            self._isRecording = False
 
         assert(filename is None or filepath is None)
 
@@ -205,6 +257,8 @@ class LabRecorderAutomator(metaclass=Singleton):
 
             if filename is not None:
                 self._filename = filename
+                if self._studyRoot is None:
+                    self._studyRoot = globalConfiguration.DataBasePath  # e.g. if not launched by us
             else:
                 self._studyRoot, self._filename = os.path.split(filepath)
 
@@ -212,30 +266,16 @@ class LabRecorderAutomator(metaclass=Singleton):
                 self._filename += '.xdf'  # make sure we specify extension
 
             logger.info("Setting storage path to %s" % os.path.join(self._studyRoot, self._filename))
-            if False:
-                # current version of RCS protocol forces a toLower conversion on filename, which we may not want
-                #  so use GUI automation instead for now
-                self._sock.sendall(('filename {root:%s} {template:%s}\n' % (self._studyRoot, self._filename,)).encode('utf-8'))
-            else:
-                studyRootEdit.set_text(self._studyRoot)
-                fileTemplateEdit.set_text(self._filename)
+            self._run('setStoragePath', self._studyRoot, self._filename)
 
         if doStartRecording:
             logger.info("Starting new recording")
-            if False:
-                # note: in current version, the RCS-specific start also runs selectAllStreams, which we may not want
-                #  so use GUI automation instead for now
-                self._sock.sendall(b'start\n')
-            else:
-                startBtn.click()
-            self._isRecording = True  # note that this isn't verified
+            self._run('startRecording')
+            self._isRecording = True
 
-        if doAltTabRefocus:
-            pywinauto.keyboard.send_keys('%{TAB}')
-        else:
-            logger.debug('Restoring focus to previous window')
-            prevWin.set_focus()
-            logger.debug('Done')
+        if self._didUseGUI:
+            # GUI automation may have brought LabRecorder to the front
+            self._gui.restoreFocus(doAltTabRefocus=doAltTabRefocus)
 
 
 if __name__ == '__main__':
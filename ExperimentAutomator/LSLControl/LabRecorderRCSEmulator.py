@@ -0,0 +1,121 @@
+"""
+Local stand-in for LabRecorder's remote control socket (RCS), for exercising LabRecorderAutomator
+and RCSTransport without LabRecorder (e.g. on a development machine or in automated checks).
+
+Accepts the same commands as LabRecorder's RCS and tracks the resulting recording state and storage
+path, but does not record anything.
+"""
+import logging
+import re
+import socketserver
+import threading
+import time
+import typing as tp
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+_filenameFieldRegex = re.compile(r'\{(\w+):([^}]*)\}')
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+@attr.s(auto_attribs=True, eq=False)
+class LabRecorderRCSEmulator:
+    port: int = 0  # 0 to pick a free port; actual port available as .port after start()
+    sendAcks: bool = True  # whether to reply 'OK' to each command, as recent LabRecorder versions do
+    replyDelay: float = 0.  # in s, to simulate a slow recorder
+
+    isRecording: bool = attr.ib(init=False, default=False)
+    studyRoot: tp.Optional[str] = attr.ib(init=False, default=None)
+    template: tp.Optional[str] = attr.ib(init=False, default=None)
+    areAllStreamsSelected: bool = attr.ib(init=False, default=False)
+    commandLog: tp.List[str] = attr.ib(init=False, factory=list)
+
+    _server: tp.Optional[socketserver.ThreadingTCPServer] = attr.ib(init=False, default=None)
+    _thread: tp.Optional[threading.Thread] = attr.ib(init=False, default=None)
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    def start(self):
+        emulator = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                emulator._handleConnection(self.rfile, self.wfile)
+
+        self._server = _ThreadingTCPServer(('localhost', self.port), _Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True,
+                                        name='LabRecorderRCSEmulator')
+        self._thread.start()
+        logger.debug('LabRecorder RCS emulator listening on port %d' % (self.port,))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _handleConnection(self, rfile, wfile):
+        while True:
+            line = rfile.readline()
+            if len(line) == 0:
+                return
+            cmdLine = line.decode('utf-8').strip()
+            if len(cmdLine) == 0:
+                continue
+            if self.replyDelay > 0:
+                time.sleep(self.replyDelay)
+            with self._lock:
+                self.commandLog.append(cmdLine)
+                isKnown = self._handleCommand(cmdLine)
+            if not isKnown:
+                logger.warning('LabRecorder RCS emulator received unknown command %r' % (cmdLine,))
+            if self.sendAcks and isKnown:
+                wfile.write(b'OK\n')
+                wfile.flush()
+
+    def _handleCommand(self, cmdLine: str) -> bool:
+        """
+        Returns whether the command was recognized.
+        """
+        if cmdLine == 'start':
+            # like LabRecorder, starting through RCS also selects all streams
+            self.areAllStreamsSelected = True
+            self.isRecording = True
+        elif cmdLine == 'stop':
+            self.isRecording = False
+        elif cmdLine == 'update':
+            pass
+        elif cmdLine == 'select all':
+            self.areAllStreamsSelected = True
+        elif cmdLine == 'select none':
+            self.areAllStreamsSelected = False
+        elif cmdLine.startswith('filename '):
+            fields = dict(_filenameFieldRegex.findall(cmdLine))
+            if 'root' in fields:
+                self.studyRoot = fields['root']
+            if 'template' in fields:
+                self.template = fields['template']
+        else:
+            return False
+        return True
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s.%(msecs)03d %(filename)20s %(lineno)4d %(levelname)5s: %(message)s',
+                        datefmt='%H:%M:%S')
+
+    emulator = LabRecorderRCSEmulator(port=22345)
+    emulator.start()
+    print('LabRecorder RCS emulator listening on port %d' % (emulator.port,))
+    try:
+        while True:
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -0,0 +1,264 @@
+import logging
+import select
+import socket
+import sys
+import time
+import typing as tp
+import warnings
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+class RCSError(RuntimeError):
+    def __init__(self, message: str, wasSent: bool = False):
+        super().__init__(message)
+        self.wasSent = wasSent  # whether the command may have reached LabRecorder, so may have taken effect
+
+
+@attr.s(auto_attribs=True, eq=False)
+class LabRecorderTransport:
+    """
+    Means of operating a running LabRecorder instance.
+    """
+
+    def startRecording(self):
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def stopRecording(self):
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def setStoragePath(self, studyRoot: str, filename: str):
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def close(self):
+        pass
+
+
+@attr.s(auto_attribs=True, eq=False)
+class RCSTransport(LabRecorderTransport):
+    """
+    Operates LabRecorder through its remote control socket (RCS).
+
+    Recent LabRecorder versions reply 'OK' to each command. If no reply arrives within
+    ackTimeout after the first command, replies are assumed to be unsupported (as in older versions)
+    and later commands are sent without waiting.
+
+    Note that LabRecorder's RCS 'start' also selects all available streams, and that some older
+    versions convert filenames sent through RCS to lower case.
+    """
+    host: str = 'localhost'
+    port: int = 22345
+    ackTimeout: float = 1.  # in s
+    connectTimeout: float = 5.  # in s
+
+    _sock: tp.Optional[socket.socket] = attr.ib(init=False, default=None)
+    _pending: bytearray = attr.ib(init=False, factory=bytearray)
+    _receivesAcks: tp.Optional[bool] = attr.ib(init=False, default=None)  # None until known
+
+    _isRecording: tp.Optional[bool] = attr.ib(init=False, default=None)  # None until a start or stop was sent
+    _studyRoot: tp.Optional[str] = attr.ib(init=False, default=None)
+    _filename: tp.Optional[str] = attr.ib(init=False, default=None)
+
+    @property
+    def isConnected(self) -> bool:
+        return self._sock is not None
+
+    @property
+    def isRecording(self) -> tp.Optional[bool]:
+        """
+        Recording state according to commands sent through this transport. Changes made in the GUI are not tracked.
+        """
+        return self._isRecording
+
+    def connect(self):
+        assert self._sock is None
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.connectTimeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._pending.clear()
+        logger.debug('Connected to LabRecorder RCS on port %d' % (self.port,))
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def startRecording(self):
+        self._sendCommand('start')
+        self._isRecording = True
+
+    def stopRecording(self):
+        self._sendCommand('stop')
+        self._isRecording = False
+
+    def setStoragePath(self, studyRoot: str, filename: str):
+        self._sendCommand('filename {root:%s} {template:%s}' % (studyRoot, filename))
+        self._studyRoot, self._filename = studyRoot, filename
+
+    def _sendCommand(self, cmd: str):
+        if self._sock is None:
+            raise RCSError('Not connected to LabRecorder RCS')
+
+        startTime = time.perf_counter()
+        self._discardReceived()  # e.g. late replies to earlier commands
+        try:
+            self._sock.sendall(cmd.encode('utf-8') + b'\n')
+        except OSError:
+            self.close()
+            raise
+
+        if self._receivesAcks is not False:
+            try:
+                reply = self._readLine(timeout=self.ackTimeout)
+            except OSError as e:
+                raise RCSError('Lost LabRecorder RCS connection waiting for acknowledgement of %r: %s' % (cmd, e),
+                               wasSent=True) from e
+            if reply is None:
+                if self._receivesAcks is None:
+                    logger.info('No reply from LabRecorder RCS, assuming this version does not acknowledge commands')
+                    self._receivesAcks = False
+                else:
+                    raise RCSError('Timed out waiting for LabRecorder to acknowledge %r' % (cmd,), wasSent=True)
+            elif reply == 'OK':
+                self._receivesAcks = True
+            else:
+                raise RCSError('Unexpected reply from LabRecorder to %r: %r' % (cmd, reply), wasSent=True)
+
+        logger.debug('RCS %r took %.1f ms' % (cmd, (time.perf_counter() - startTime) * 1e3))
+
+    def _readLine(self, timeout: float) -> tp.Optional[str]:
+        """
+        Returns next line received (without line ending), or None if none arrived within timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            iNewline = self._pending.find(b'\n')
+            if iNewline >= 0:
+                line = bytes(self._pending[:iNewline])
+                del self._pending[:iNewline + 1]
+                return line.decode('utf-8', errors='replace').strip()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._sock.settimeout(remaining)
+            try:
+                data = self._sock.recv(4096)
+            except socket.timeout:
+                return None
+            if len(data) == 0:
+                self.close()
+                raise ConnectionError('LabRecorder closed RCS connection')
+            self._pending += data
+
+    def _discardReceived(self):
+        while len(select.select([self._sock], [], [], 0)[0]) > 0:
+            data = self._sock.recv(4096)
+            if len(data) == 0:
+                self.close()
+                raise ConnectionError('LabRecorder closed RCS connection')
+        self._pending.clear()
+
+
+@attr.s(auto_attribs=True, eq=False)
+class GUIAutomationTransport(LabRecorderTransport):
+    """
+    Operates LabRecorder by automating its GUI with pywinauto (Windows only).
+
+    Slower than RCS, but doesn't share its side effects (see RCSTransport). Element lookups are cached until reset()
+    (e.g. after relaunching LabRecorder) or until a cached element turns out to be stale.
+    """
+    windowTitle: str = 'Lab Recorder'
+
+    _app: tp.Any = attr.ib(init=False, default=None)
+    _winObj: tp.Any = attr.ib(init=False, default=None)
+    _elements: tp.Dict[str, tp.Any] = attr.ib(init=False, factory=dict)
+    _prevWin: tp.Any = attr.ib(init=False, default=None)
+
+    _elementAutoIds: tp.ClassVar[tp.Dict[str, str]] = dict(
+        studyRootEdit='MainWindow.centralwidget.scrollArea.qt_scrollarea_viewport.scrollAreaWidgetContents.rootEdit',
+        fileTemplateEdit='MainWindow.centralwidget.scrollArea.qt_scrollarea_viewport.scrollAreaWidgetContents.lineEdit_template',
+    )
+    _elementTitles: tp.ClassVar[tp.Dict[str, str]] = dict(
+        startBtn='Start',
+        stopBtn='Stop',
+    )
+
+    @staticmethod
+    def _importPywinauto():
+        # import here rather than at module level so that pywinauto's COM and DPI
+        # initialization happens after Qt's, avoiding startup conflicts; declare STA
+        # threading to match Qt's, since pywinauto's own COM mode probe can't detect
+        # it (pywin32 swallows the error that the probe relies on)
+        sys.coinit_flags = 2  # type: ignore  # COINIT_APARTMENTTHREADED
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='Apply externally defined coinit_flags.*')
+            import pywinauto
+            import pywinauto.keyboard
+            import pywinauto.application
+        return pywinauto
+
+    def reset(self):
+        self._app = None
+        self._winObj = None
+        self._elements.clear()
+
+    def _getElement(self, name: str) -> tp.Any:
+        if name in self._elements:
+            return self._elements[name]
+
+        pywinauto = self._importPywinauto()
+        if self._winObj is None:
+            logger.debug('Looking for lab recorder window')
+            self._app = pywinauto.application.Application(backend='uia').connect(title=self.windowTitle, timeout=1)
+            self._winObj = self._app.window(title=self.windowTitle).wrapper_object()
+
+        logger.debug('Looking for %s' % (name,))
+        if name in self._elementAutoIds:
+            spec = dict(auto_id=self._elementAutoIds[name], control_type='Edit')
+        else:
+            spec = dict(title=self._elementTitles[name], control_type='Button')
+        element = pywinauto.Desktop('uia').window(parent=self._winObj, top_level_only=False, **spec).wrapper_object()
+        self._elements[name] = element
+        return element
+
+    def _withElement(self, name: str, fn: tp.Callable[[tp.Any], None]):
+        try:
+            fn(self._getElement(name))
+        except Exception as e:
+            if name not in self._elements:
+                raise
+            # cached element may be stale (e.g. if the window was recreated), so look it up again
+            logger.debug('Cached %s failed (%s), looking up again' % (name, e))
+            self.reset()
+            fn(self._getElement(name))
+
+    def rememberFocus(self):
+        pywinauto = self._importPywinauto()
+        logger.debug('Looking for current top window')
+        self._prevWin = pywinauto.application.Application(backend='uia').connect(
+            active_only=True).top_window().wrapper_object()
+
+    def restoreFocus(self, doAltTabRefocus: bool = True):
+        if doAltTabRefocus or self._prevWin is None:
+            self._importPywinauto().keyboard.send_keys('%{TAB}')
+        else:
+            logger.debug('Restoring focus to previous window')
+            self._prevWin.set_focus()
+            self._prevWin = None
+
+    def startRecording(self):
+        self._withElement('startBtn', lambda btn: btn.click())
+
+    def stopRecording(self):
+        try:
+            self._withElement('stopBtn', lambda btn: btn.click())
+        except AttributeError:
+            logger.info('Unable to stop previous recording (already stopped?)')
+
+    def setStoragePath(self, studyRoot: str, filename: str):
+        self._withElement('studyRootEdit', lambda edit: edit.set_text(studyRoot))
+        self._withElement('fileTemplateEdit', lambda edit: edit.set_text(filename))
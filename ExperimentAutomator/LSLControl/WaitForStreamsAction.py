@@ -0,0 +1,90 @@
+import concurrent.futures
+import typing as tp
+import attr
+import logging
+import time
+
+from qtpy import QtCore
+
+from ExperimentAutomator.ExperimentActions import ExperimentAction
+from .LabRecorderAutomator import LabRecorderAutomator
+from .LSLStreamResolver import LSLStreamResolver, StreamAvailability
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True)
+class WaitForStreamsAction(ExperimentAction):
+    """
+    Wait until LSL streams are available, e.g.:
+        Biopac (Selene), ExperimentAutomatorMarkers
+    or an expression evaluating to a list of stream names. If empty, waits for LabRecorder's
+    required streams.
+    """
+    key: tp.ClassVar[str] = 'waitForStreams'
+    streams: str = ''
+
+    _sigResolved: tp.ClassVar[QtCore.Signal] = QtCore.Signal(object)  # emits Future, from resolver thread
+
+    _pollTimeout: float = 1.  # in s, per lookup of missing streams
+    _isWaiting: bool = attr.ib(init=False, default=False)
+    _startTime: float = attr.ib(init=False, default=0.)
+    _lastMissing: tp.List[str] = attr.ib(init=False, factory=list)
+
+    def _start(self):
+        if len(self.streams.strip()) == 0:
+            streams = LabRecorderAutomator().requiredStreams
+        else:
+            value = self._evalStr(self.streams)
+            if isinstance(value, str):
+                streams = [stream.strip() for stream in value.split(',') if len(stream.strip()) > 0]
+            else:
+                streams = list(value)
+        if len(streams) == 0:
+            logger.info('No LSL streams to wait for')
+            self._onStop()
+            return
+        self._isWaiting = True
+        self._startTime = time.perf_counter()
+        self._sigResolved.connect(self._onResolved)
+        self._resolve(streams)
+
+    def _resolve(self, streams: tp.List[str]):
+        future = LSLStreamResolver().resolveInBackground(streams, timeout=self._pollTimeout)
+        future.add_done_callback(self._onFutureDone)
+
+    def _onFutureDone(self, future: concurrent.futures.Future):
+        try:
+            self._sigResolved.emit(future)
+        except RuntimeError:
+            pass  # action was already deleted, e.g. after being stopped
+
+    def _onResolved(self, future: concurrent.futures.Future):
+        if not self._isWaiting:
+            return
+        availability: StreamAvailability = future.result()
+        if availability.isComplete:
+            self._stopWaiting()
+            logger.info('LSL streams available after %.1f s' % (time.perf_counter() - self._startTime,))
+            self._onStop()
+            return
+        if availability.missing != self._lastMissing:
+            logger.info('Waiting for LSL streams: %s' % (', '.join(availability.missing),))
+            self._lastMissing = availability.missing
+        self._resolve(availability.missing)
+
+    def _stopWaiting(self):
+        if self._isWaiting:
+            self._isWaiting = False
+            self._sigResolved.disconnect(self._onResolved)
+
+    def stop(self):
+        if self._isWaiting:
+            logger.info('Stopped waiting for LSL streams %s' % (', '.join(self._lastMissing),))
+        self._stopWaiting()
+        if not self.didStop:
+            self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(streams=s, **kwargs)
@@ -1,2 +1,7 @@
+from .LabRecorderTransport import LabRecorderTransport, RCSTransport, GUIAutomationTransport
 from .LabRecorderAutomator import LabRecorderAutomator
 from .LabRecorderAction import LabRecorderAction
+from .LSLMarkerOutlet import LSLMarkerOutlet
+from .LSLMarkerAction import LSLMarkerAction
+from .LSLStreamResolver import LSLStreamResolver, StreamAvailability
+from .WaitForStreamsAction import WaitForStreamsAction
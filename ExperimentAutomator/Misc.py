@@ -1,5 +1,11 @@
+import os
 import traceback
 import sys
+import time
+import logging
+import typing as tp
+
+logger = logging.getLogger(__name__)
 
 # from https://stackoverflow.com/questions/6760685/creating-a-singleton-in-python
 class Singleton(type):
@@ -30,3 +36,53 @@ def exceptionToStr(e: Exception) -> str:
     eStr += "Stack trace : %s\n" % stack_trace
 
     return eStr
+
+
+def getUserDataDir() -> str:
+    """
+    Per-user directory for ExperimentAutomator's own files (settings, journals, logs).
+    """
+    baseDir = os.getenv('LOCALAPPDATA')
+    if baseDir is None:
+        # not on Windows
+        baseDir = os.getenv('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(baseDir, 'ExperimentAutomator')
+
+
+def waitUntilReady(probe: tp.Callable[[], tp.Any],
+                   description: str,
+                   timeout: float = 30.,
+                   initialInterval: float = 0.01,
+                   maxInterval: float = 0.2,
+                   retryOn: tp.Tuple[tp.Type[BaseException], ...] = ()) -> tp.Any:
+    """
+    Call probe repeatedly, with exponentially increasing intervals, until it returns a truthy value,
+    which is then returned. Exceptions of types in retryOn are treated as not ready yet; any other
+    exception from probe aborts waiting (e.g. if the program being waited for exited).
+
+    Raises TimeoutError if not ready within timeout (in s). Logs how long it took to become ready.
+    """
+    startTime = time.monotonic()
+    deadline = startTime + timeout
+    interval = initialInterval
+    numProbes = 0
+    while True:
+        numProbes += 1
+        try:
+            result = probe()
+        except retryOn as e:
+            result = None
+            lastError = e
+        else:
+            lastError = None
+        if result:
+            logger.info('%s ready after %.0f ms (%d probes)' % (
+                description, (time.monotonic() - startTime) * 1e3, numProbes))
+            return result
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('%s not ready after %.1f s%s' % (
+                description, timeout, '' if lastError is None else ' (last error: %s)' % (lastError,)))
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, maxInterval)
@@ -0,0 +1,261 @@
+"""
+Registry of spawned processes (VLC, LabRecorder, scripts, Python workers) that terminates whole
+process trees at once: every process in every tree is asked to terminate, then all are waited on
+together for up to a grace period, and any still running are killed.
+
+On POSIX, processes started via `popenKwargs` (or a QProcess prepared with `prepareQProcess`) lead
+their own process group, so that the group is signalled too, reaching descendants that were
+orphaned (reparented to init) and so no longer appear as children.
+
+On Windows, psutil's terminate() is the same as kill() (TerminateProcess), so processes are instead
+asked to close with taskkill (without /f), which sends WM_CLOSE to their windows; this gives e.g.
+LabRecorder and VLC a chance to finalize files before anything is killed.
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import typing as tp
+
+import attr
+import psutil
+
+from ExperimentAutomator.Misc import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class TerminationReport:
+    terminated: tp.List[str] = attr.ib(factory=list)  # descriptions of processes that exited when asked
+    killed: tp.List[str] = attr.ib(factory=list)  # ... that had to be killed
+    survived: tp.List[str] = attr.ib(factory=list)  # ... that were still running after being killed
+    duration: float = 0.  # in s
+
+    @property
+    def numProcesses(self) -> int:
+        return len(self.terminated) + len(self.killed) + len(self.survived)
+
+    def __str__(self):
+        if self.numProcesses == 0:
+            return 'no processes running'
+        parts = []
+        for label, descriptions in (('terminated', self.terminated), ('killed', self.killed), ('still running', self.survived)):
+            if len(descriptions) > 0:
+                parts.append('%s %s' % (label, ', '.join(descriptions)))
+        return '%s in %.2f s' % ('; '.join(parts), self.duration)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _Entry:
+    process: psutil.Process
+    description: str
+    isGroupLeader: bool
+
+
+@attr.s(auto_attribs=True, eq=False)
+class ProcessSupervisor(metaclass=Singleton):
+    _entries: tp.Dict[int, _Entry] = attr.ib(init=False, factory=dict)  # keyed by pid
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    @staticmethod
+    def popenKwargs() -> tp.Dict[str, tp.Any]:
+        """
+        Extra arguments for subprocess.Popen so that the new process leads its own process group.
+        """
+        if sys.platform == 'win32':
+            return dict()
+        return dict(start_new_session=True)
+
+    @staticmethod
+    def prepareQProcess(proc) -> None:
+        """
+        Equivalent of popenKwargs for a QProcess, where supported (Qt >= 6.6 on POSIX).
+        """
+        if sys.platform == 'win32' or not hasattr(proc, 'setUnixProcessParameters'):
+            return
+        proc.setUnixProcessParameters(proc.UnixProcessFlag.CreateNewSession)
+
+    def register(self, process: tp.Union[int, subprocess.Popen, psutil.Process], description: str) -> tp.Optional[psutil.Process]:
+        if isinstance(process, subprocess.Popen):
+            process = process.pid
+        if isinstance(process, int):
+            try:
+                process = psutil.Process(process)
+            except psutil.NoSuchProcess:
+                return None
+        try:
+            isGroupLeader = sys.platform != 'win32' and os.getpgid(process.pid) == process.pid
+        except OSError:
+            return None  # already exited
+        with self._lock:
+            self._pruneExited()
+            self._entries[process.pid] = _Entry(process=process, description=description, isGroupLeader=isGroupLeader)
+        return process
+
+    def unregister(self, process: tp.Union[int, subprocess.Popen, psutil.Process]):
+        with self._lock:
+            self._entries.pop(process if isinstance(process, int) else process.pid, None)
+
+    @property
+    def registered(self) -> tp.List[psutil.Process]:
+        with self._lock:
+            self._pruneExited()
+            return [entry.process for entry in self._entries.values()]
+
+    def terminate(self,
+                  roots: tp.Iterable[tp.Union[int, subprocess.Popen, psutil.Process]],
+                  gracePeriod: float = 0.5,
+                  killTimeout: float = 1.) -> TerminationReport:
+        """
+        Terminate the given processes and all their descendants, killing any still running after
+        gracePeriod. Returns once all have exited, or killTimeout after killing.
+        """
+        startTime = time.perf_counter()
+        procs: tp.Dict[int, psutil.Process] = dict()
+        descriptions: tp.Dict[int, str] = dict()
+        groups: tp.Set[int] = set()
+        for root in roots:
+            root = self._toProcess(root)
+            if root is None:
+                continue
+            with self._lock:
+                entry = self._entries.get(root.pid)
+            if entry is not None and entry.process.is_running():
+                root = entry.process  # to keep psutil's protection against pid reuse
+                if entry.isGroupLeader:
+                    groups.add(root.pid)
+            try:
+                # collect the whole tree before signalling anything, since children of exited
+                # processes are reparented and could no longer be found
+                tree = [root] + root.children(recursive=True)
+            except psutil.NoSuchProcess:
+                continue
+            for proc in tree:
+                if proc.pid in procs or proc.pid == os.getpid():
+                    continue
+                procs[proc.pid] = proc
+                descriptions[proc.pid] = self._describe(proc)
+
+        report = TerminationReport()
+        if len(procs) == 0:
+            return report
+
+        self._signal(procs.values(), groups, doKill=False)
+        gone, alive = self._wait(list(procs.values()), timeout=gracePeriod)
+        report.terminated = [descriptions[proc.pid] for proc in gone]
+        if len(alive) > 0:
+            self._signal(alive, groups, doKill=True)
+            gone, alive = self._wait(alive, timeout=killTimeout)
+            report.killed = [descriptions[proc.pid] for proc in gone]
+            report.survived = [descriptions[proc.pid] for proc in alive]
+
+        with self._lock:
+            for pid in procs:
+                self._entries.pop(pid, None)
+        report.duration = time.perf_counter() - startTime
+        return report
+
+    def terminateAll(self, gracePeriod: float = 0.5, killTimeout: float = 1.) -> TerminationReport:
+        """
+        Terminate all registered processes, and any other child processes, with their descendants.
+        """
+        roots = self.registered
+        try:
+            roots += psutil.Process().children()
+        except psutil.Error:
+            pass
+        report = self.terminate(roots, gracePeriod=gracePeriod, killTimeout=killTimeout)
+        if len(report.survived) > 0:
+            logger.warning('Unable to stop child processes: %s' % (report,))
+        elif report.numProcesses > 0:
+            logger.info('Child processes: %s' % (report,))
+        return report
+
+    def _toProcess(self, process: tp.Union[int, subprocess.Popen, psutil.Process]) -> tp.Optional[psutil.Process]:
+        if isinstance(process, psutil.Process):
+            return process
+        try:
+            return psutil.Process(process if isinstance(process, int) else process.pid)
+        except psutil.NoSuchProcess:
+            return None
+
+    def _describe(self, proc: psutil.Process) -> str:
+        with self._lock:
+            entry = self._entries.get(proc.pid)
+        if entry is not None:
+            name = entry.description
+        else:
+            try:
+                name = proc.name()
+            except psutil.Error:
+                name = 'process'
+        return '%s (%d)' % (name, proc.pid)
+
+    @staticmethod
+    def _wait(procs: tp.List[psutil.Process], timeout: float) -> tp.Tuple[tp.List[psutil.Process], tp.List[psutil.Process]]:
+        """
+        Like psutil.wait_procs, but treating zombies (exited, but not yet reaped by their parent) as gone.
+        """
+        deadline = time.perf_counter() + timeout
+        gone, alive = [], procs
+        while True:
+            newlyGone, alive = psutil.wait_procs(alive, timeout=max(min(deadline - time.perf_counter(), 0.05), 0.))
+            gone += newlyGone
+            for proc in list(alive):
+                try:
+                    isZombie = proc.status() == psutil.STATUS_ZOMBIE
+                except psutil.Error:
+                    isZombie = True
+                if isZombie:
+                    alive.remove(proc)
+                    gone.append(proc)
+            if len(alive) == 0 or time.perf_counter() >= deadline:
+                return gone, alive
+
+    def _signal(self, procs: tp.Iterable[psutil.Process], groups: tp.Set[int], doKill: bool):
+        if sys.platform == 'win32' and not doKill:
+            self._requestClose(procs)
+            return
+        for proc in procs:
+            try:
+                if doKill:
+                    proc.kill()
+                else:
+                    proc.terminate()
+            except psutil.Error:
+                pass
+        ownGroup = os.getpgrp() if sys.platform != 'win32' else None
+        for pgid in groups:
+            if pgid == ownGroup:
+                continue
+            try:
+                os.killpg(pgid, signal.SIGKILL if doKill else signal.SIGTERM)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _requestClose(procs: tp.Iterable[psutil.Process]):
+        """
+        Ask processes to close (on Windows), all with a single taskkill, without waiting for them to exit.
+        """
+        args = ['taskkill', '/t']
+        for proc in procs:
+            args += ['/pid', str(proc.pid)]
+        if len(args) == 2:
+            return
+        try:
+            # taskkill itself returns quickly; failures (e.g. console processes without a window,
+            # which can only be terminated forcefully) are left to the kill after the grace period
+            subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5.,
+                           creationflags=subprocess.CREATE_NO_WINDOW)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning('Unable to ask processes to close: %s' % (e,))
+
+    def _pruneExited(self):
+        # called with lock held
+        for pid in [pid for pid, entry in self._entries.items() if not entry.process.is_running()]:
+            del self._entries[pid]
@@ -1,35 +1,117 @@
 import typing as tp
 import attr
 import logging
-import zmq
+import concurrent.futures
+import collections
+import ast
 
+from ExperimentAutomator.Configuration import globalConfiguration
 from ExperimentAutomator.ExperimentActions import ExperimentAction, NoninterruptibleAction
 from ExperimentAutomator.Misc import Singleton
+from .ZMQPicturePresenterClient import ZMQPicturePresenterClient
 
 logger = logging.getLogger(__name__)
 
 @attr.s(auto_attribs=True)
 class ZMQPicturePresenterAutomator(metaclass=Singleton):
-    _socket: tp.Optional[zmq.Socket] = None
+    """
+    Sends image changes to the picture presenter without waiting for each to be acknowledged.
+
+    Failures (e.g. missing acknowledgements) are raised by the next call instead.
+
+    If the images a table will show are known in advance (see setExpectedImages), each image change
+    can also ask the presenter to preload the next few expected images. This is off by default,
+    since presenters that only implement showImage reply to preload with an error; set
+    configuration value ZMQPicturePresenterLookahead to enable it.
+    """
     _port: int = 9879
+    _client: tp.Optional[ZMQPicturePresenterClient] = None
+
+    _expectedImages: tp.List[int] = attr.ib(factory=list)  # in table order
+    _iExpected: int = 0  # position in _expectedImages of most recently shown image
+    _recentlyPreloaded: tp.OrderedDict[int, None] = attr.ib(factory=collections.OrderedDict)  # used as an LRU set
 
-    def changeImage(self, imageNumber: int):
-        if self._socket is None:
-            self._socket = zmq.Context().socket(zmq.REQ)
-            self._socket.linger = 0
-            self._socket.connect('tcp://localhost:%d' % (self._port,))
+    def _getClient(self) -> ZMQPicturePresenterClient:
+        if self._client is None:
+            self._client = ZMQPicturePresenterClient(
+                address='tcp://localhost:%d' % (self._port,),
+                maxInFlight=globalConfiguration.ZMQPicturePresenterMaxInFlight)
+        return self._client
 
-        self._socket.send_json(dict(
+    def _raiseIfFailed(self):
+        errors = self._getClient().popErrors()
+        if len(errors) > 0:
+            raise RuntimeError('%d earlier picture presenter request(s) failed, first error: %s' % (len(errors), errors[0]))
+
+    def changeImage(self, imageNumber: int, doWait: bool = False) -> concurrent.futures.Future:
+        self._raiseIfFailed()
+        future = self._getClient().submit(dict(
             type='showImage',
             imageNumber=imageNumber))
+        self._recentlyPreloaded.pop(imageNumber, None)  # may be evicted by the time it is shown again
+        self._preloadAhead(imageNumber)
+        if doWait:
+            future.result()
+        return future
+
+    def preload(self, imageNumbers: tp.Sequence[int]) -> concurrent.futures.Future:
+        """
+        Ask the presenter to decode and cache images ahead of showing them.
+        """
+        self._raiseIfFailed()
+        return self._getClient().submit(dict(
+            type='preload',
+            imageNumbers=list(imageNumbers)))
 
-        evt = self._socket.poll(timeout=1000)
-        if evt == 0:
-            self._socket = None
-            raise TimeoutError('No acknowledgement of message received')
-        resp = self._socket.recv_json()
-        if resp != 'ACK':
-            raise RuntimeError('Unexpected response: %s' % resp)
+    def cacheImage(self, imageNumber: int, data: tp.Union[bytes, bytearray, memoryview]) -> concurrent.futures.Future:
+        """
+        Send encoded image data (e.g. PNG file contents) generated at run time for the presenter to
+        decode and cache as imageNumber. Data is sent without copying, so must not be modified until
+        the returned future is done.
+        """
+        self._raiseIfFailed()
+        return self._getClient().submit(dict(
+            type='cacheImage',
+            imageNumber=imageNumber), frames=[data])
+
+    def setExpectedImages(self, imageNumbers: tp.Sequence[int]):
+        self._expectedImages = list(imageNumbers)
+        self._iExpected = 0
+
+    def _preloadAhead(self, imageNumber: int):
+        lookahead = globalConfiguration.ZMQPicturePresenterLookahead
+        if lookahead == 0 or len(self._expectedImages) == 0:
+            return
+        try:
+            self._iExpected = self._expectedImages.index(imageNumber, self._iExpected)
+        except ValueError:
+            try:
+                # e.g. after jumping backwards in the table
+                self._iExpected = self._expectedImages.index(imageNumber)
+            except ValueError:
+                return  # not known in advance
+        toPreload = []
+        for nextImageNumber in self._expectedImages[self._iExpected + 1:self._iExpected + 1 + lookahead]:
+            if nextImageNumber not in self._recentlyPreloaded and nextImageNumber != imageNumber:
+                toPreload.append(nextImageNumber)
+            self._recentlyPreloaded[nextImageNumber] = None
+            self._recentlyPreloaded.move_to_end(nextImageNumber)
+        while len(self._recentlyPreloaded) > 4 * lookahead:
+            self._recentlyPreloaded.popitem(last=False)
+        if len(toPreload) > 0:
+            logger.debug('Preloading images %s' % (toPreload,))
+            self.preload(toPreload)
+
+    def waitForAcks(self, timeout: tp.Optional[float] = None):
+        """
+        Block until all requests sent so far have been acknowledged.
+        """
+        self._getClient().flush(timeout=timeout)
+        self._raiseIfFailed()
+        stats = self._getClient().getRoundTripStats()
+        if stats['count'] > 0:
+            logger.info('Picture presenter round trip times: median %.1f ms, 95%% %.1f ms, max %.1f ms (%d requests)' % (
+                stats['median'] * 1e3, stats['p95'] * 1e3, stats['max'] * 1e3, stats['count']))
 
 
 @attr.s(auto_attribs=True)
@@ -39,11 +121,45 @@ class ZMQPicturePresenterAction(NoninterruptibleAction):
 
     def _start(self):
         autom = ZMQPicturePresenterAutomator()
-        imageNumber = int(self._evalStr(self.image))
-        autom.changeImage(imageNumber=imageNumber)
-        logger.info('Changed image to %d' % imageNumber)
+        cmdAndArgs = self.image.strip().split(' ', maxsplit=1)
+        if cmdAndArgs[0] == 'wait':
+            autom.waitForAcks()
+            logger.info('Picture presenter acknowledged all image changes')
+        elif cmdAndArgs[0] == 'preload':
+            # arg should be an image number or list of image numbers
+            imageNumbers = self._evalStr(cmdAndArgs[1])
+            if isinstance(imageNumbers, int):
+                imageNumbers = [imageNumbers]
+            autom.preload([int(imageNumber) for imageNumber in imageNumbers])
+            logger.info('Requested preload of %d images' % len(imageNumbers))
+        elif cmdAndArgs[0] == 'push':
+            # args should be an image number and (a variable containing) encoded image bytes, e.g. 'push 100 pngBytes'
+            imageNumberStr, dataStr = cmdAndArgs[1].split(' ', maxsplit=1)
+            imageNumber = int(self._evalStr(imageNumberStr))
+            data = self._evalStr(dataStr)
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                raise TypeError('Expected image data as bytes, got %s' % type(data).__name__)
+            autom.cacheImage(imageNumber, data)
+            logger.info('Pushed %d bytes of image data as image %d' % (len(data), imageNumber))
+        else:
+            imageNumber = int(self._evalStr(self.image))
+            autom.changeImage(imageNumber=imageNumber)
+            logger.info('Changed image to %d' % imageNumber)
         self._onStop()
 
     @classmethod
     def fromString(cls, s: str, **kwargs):
-        return cls(image=s, **kwargs)
\ No newline at end of file
+        return cls(image=s, **kwargs)
+
+    @classmethod
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        # note images the table will show, in order, so upcoming ones can be preloaded
+        imageNumbers = []
+        for argStr in argStrs:
+            try:
+                imageNumber = ast.literal_eval(argStr.strip())
+            except (ValueError, SyntaxError):
+                continue  # e.g. a command or an expression depending on variables
+            if isinstance(imageNumber, int):
+                imageNumbers.append(imageNumber)
+        ZMQPicturePresenterAutomator().setExpectedImages(imageNumbers)
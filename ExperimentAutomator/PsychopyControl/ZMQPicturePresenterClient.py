@@ -0,0 +1,243 @@
+import collections
+import concurrent.futures
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+import typing as tp
+
+import attr
+import zmq
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _Request:
+    requestId: int
+    message: tp.Dict[str, tp.Any]
+    frames: tp.Sequence[tp.Any]  # extra raw frames (e.g. bytes, memoryviews), sent without copying
+    future: concurrent.futures.Future
+    sendTimeNs: tp.Optional[int] = None
+
+
+@attr.s(auto_attribs=True, eq=False)
+class ZMQPicturePresenterClient:
+    """
+    Pipelined client for a picture presenter listening on a REP or ROUTER socket.
+
+    Requests are submitted without blocking and sent by a background thread that owns the
+    socket, with up to maxInFlight requests awaiting acknowledgement at once. Each request carries
+    a requestId; presenters that echo it back in their reply are matched by id, while plain 'ACK'
+    replies (as sent by REP-based presenters, which reply in order) are matched in order.
+    """
+    address: str = 'tcp://localhost:9879'
+    maxInFlight: int = 4
+    ackTimeout: float = 1.  # in s
+
+    _context: zmq.Context = attr.ib(init=False, factory=zmq.Context.instance)
+    _submitted: queue.SimpleQueue = attr.ib(init=False, factory=queue.SimpleQueue)
+    _wakeAddress: str = attr.ib(init=False)
+    _wakeSocket: tp.Optional[zmq.Socket] = attr.ib(init=False, default=None)  # caller side
+    _wakeLock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+    _thread: tp.Optional[threading.Thread] = attr.ib(init=False, default=None)
+    _isStopping: bool = attr.ib(init=False, default=False)
+    _requestIds: tp.Iterator[int] = attr.ib(init=False, factory=lambda: itertools.count(1))
+
+    _outstanding: tp.Set[concurrent.futures.Future] = attr.ib(init=False, factory=set)
+    _outstandingLock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    _roundTripTimes: tp.Deque[float] = attr.ib(init=False, factory=lambda: collections.deque(maxlen=10000))
+    _errors: tp.List[Exception] = attr.ib(init=False, factory=list)  # not yet reported to caller
+    _errorsLock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self):
+        self._wakeAddress = 'inproc://ZMQPicturePresenterClient-%x' % (id(self),)
+
+    def submit(self, message: tp.Dict[str, tp.Any], frames: tp.Sequence[tp.Any] = ()) -> concurrent.futures.Future:
+        """
+        Queue a message (and any extra raw frames, which must not be modified until the returned
+        future is done) to be sent, and return a future for the presenter's reply.
+        """
+        if self._thread is None:
+            self._start()
+        request = _Request(requestId=next(self._requestIds), message=message, frames=frames,
+                           future=concurrent.futures.Future())
+        with self._outstandingLock:
+            self._outstanding.add(request.future)
+        request.future.add_done_callback(self._onDone)
+        self._submitted.put(request)
+        with self._wakeLock:
+            self._wakeSocket.send(b'', zmq.NOBLOCK)
+        return request.future
+
+    def request(self, message: tp.Dict[str, tp.Any], frames: tp.Sequence[tp.Any] = (),
+                timeout: tp.Optional[float] = None) -> tp.Any:
+        return self.submit(message, frames).result(timeout=timeout)
+
+    def flush(self, timeout: tp.Optional[float] = None):
+        """
+        Wait until all requests submitted so far are acknowledged (or failed).
+        """
+        with self._outstandingLock:
+            outstanding = list(self._outstanding)
+        _, notDone = concurrent.futures.wait(outstanding, timeout=timeout)
+        if len(notDone) > 0:
+            raise TimeoutError('%d picture presenter requests still outstanding' % (len(notDone),))
+
+    def _onDone(self, future: concurrent.futures.Future):
+        with self._outstandingLock:
+            self._outstanding.discard(future)
+
+    def popErrors(self) -> tp.List[Exception]:
+        """
+        Returns (and forgets) errors of requests that failed since last called.
+        """
+        with self._errorsLock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def getRoundTripStats(self) -> tp.Dict[str, float]:
+        """
+        Returns count and median / 95th percentile / max round trip time in s.
+        """
+        times = sorted(self._roundTripTimes)
+        if len(times) == 0:
+            return dict(count=0)
+        return dict(count=len(times),
+                    median=times[len(times) // 2],
+                    p95=times[min(len(times) - 1, int(len(times) * 0.95))],
+                    max=times[-1])
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._isStopping = True
+        with self._wakeLock:
+            self._wakeSocket.send(b'')
+        self._thread.join()
+        self._thread = None
+        self._wakeSocket.close(linger=0)
+        self._wakeSocket = None
+        self._isStopping = False
+
+    def _start(self):
+        wakeReceiver = self._context.socket(zmq.PULL)
+        wakeReceiver.bind(self._wakeAddress)  # inproc must be bound before connecting
+        self._wakeSocket = self._context.socket(zmq.PUSH)
+        self._wakeSocket.connect(self._wakeAddress)
+        self._thread = threading.Thread(target=self._run, args=(wakeReceiver,), daemon=True,
+                                        name='ZMQPicturePresenterClient')
+        self._thread.start()
+
+    def _connect(self) -> zmq.Socket:
+        sock = self._context.socket(zmq.DEALER)
+        sock.linger = 0
+        sock.connect(self.address)
+        return sock
+
+    def _run(self, wakeReceiver: zmq.Socket):
+        sock = self._connect()
+        poller = zmq.Poller()
+        poller.register(wakeReceiver, zmq.POLLIN)
+        poller.register(sock, zmq.POLLIN)
+
+        waiting: tp.Deque[_Request] = collections.deque()
+        inFlight: tp.Dict[int, _Request] = collections.OrderedDict()
+        try:
+            while not self._isStopping:
+                if len(inFlight) > 0:
+                    oldest = next(iter(inFlight.values()))
+                    timeoutMs = int(max(0., self.ackTimeout - (time.perf_counter_ns() - oldest.sendTimeNs) / 1e9) * 1e3) + 1
+                else:
+                    timeoutMs = None
+                events = dict(poller.poll(timeoutMs))
+
+                if wakeReceiver in events:
+                    while True:
+                        try:
+                            wakeReceiver.recv(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                    while True:
+                        try:
+                            waiting.append(self._submitted.get_nowait())
+                        except queue.Empty:
+                            break
+
+                if sock in events:
+                    while True:
+                        try:
+                            frames = sock.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        self._onReply(frames, inFlight)
+
+                if len(inFlight) > 0:
+                    oldest = next(iter(inFlight.values()))
+                    if (time.perf_counter_ns() - oldest.sendTimeNs) / 1e9 > self.ackTimeout:
+                        # order of any remaining replies can no longer be trusted, so start over with a new socket
+                        self._failAll(inFlight, TimeoutError('No acknowledgement from picture presenter at %s within %.1f s' % (
+                            self.address, self.ackTimeout)))
+                        poller.unregister(sock)
+                        sock.close(linger=0)
+                        sock = self._connect()
+                        poller.register(sock, zmq.POLLIN)
+
+                while len(waiting) > 0 and len(inFlight) < self.maxInFlight:
+                    request = waiting.popleft()
+                    header = dict(request.message, requestId=request.requestId)
+                    request.sendTimeNs = time.perf_counter_ns()
+                    sock.send_multipart([b'', json.dumps(header).encode('utf-8'), *request.frames], copy=False)
+                    inFlight[request.requestId] = request
+        finally:
+            self._failAll(inFlight, ConnectionError('Picture presenter client closed'))
+            while len(waiting) > 0:
+                waiting.popleft().future.set_exception(ConnectionError('Picture presenter client closed'))
+            sock.close(linger=0)
+            wakeReceiver.close(linger=0)
+
+    def _onReply(self, frames: tp.List[bytes], inFlight: tp.Dict[int, _Request]):
+        # DEALER receives the REP/ROUTER envelope delimiter before the payload
+        payload = frames[-1]
+        try:
+            reply = json.loads(payload)
+        except ValueError:
+            logger.error('Unparseable reply from picture presenter: %r' % (payload,))
+            return
+
+        if isinstance(reply, dict) and 'requestId' in reply:
+            request = inFlight.pop(reply['requestId'], None)
+            if request is None:
+                logger.warning('Reply to unknown or expired request %s' % (reply['requestId'],))
+                return
+        elif len(inFlight) > 0:
+            request = inFlight.pop(next(iter(inFlight)))  # plain reply, so must be to oldest request
+        else:
+            logger.warning('Unexpected reply from picture presenter: %r' % (reply,))
+            return
+
+        roundTripTime = (time.perf_counter_ns() - request.sendTimeNs) / 1e9
+        self._roundTripTimes.append(roundTripTime)
+        if reply == 'ACK' or (isinstance(reply, dict) and reply.get('type') == 'ACK'):
+            logger.debug('Picture presenter acknowledged %s in %.1f ms' % (request.message.get('type'), roundTripTime * 1e3))
+            request.future.set_result(reply)
+        else:
+            error = RuntimeError('Unexpected response to %s: %s' % (request.message, reply))
+            self._recordError(error)
+            request.future.set_exception(error)
+
+    def _failAll(self, inFlight: tp.Dict[int, _Request], error: Exception):
+        if len(inFlight) == 0:
+            return
+        logger.error('%s (%d requests outstanding)' % (error, len(inFlight)))
+        for request in inFlight.values():
+            request.future.set_exception(error)
+        inFlight.clear()
+        self._recordError(error)
+
+    def _recordError(self, error: Exception):
+        with self._errorsLock:
+            self._errors.append(error)
@@ -0,0 +1,172 @@
+"""
+Reference implementation of the ZMQ picture presenter protocol, and local stand-in for the
+presenter for exercising ZMQPicturePresenterClient and ZMQPicturePresenterAction without it (e.g.
+on a development machine or in automated checks).
+
+Messages (JSON, optionally followed by raw frames):
+- showImage {imageNumber}: show an image.
+- preload {imageNumbers}: decode and cache images, so that showing them later doesn't involve
+  reading and decoding files.
+- cacheImage {imageNumber} + one frame of encoded image bytes (e.g. PNG): decode and cache an
+  image generated at run time under the given number, replacing any image file with that number.
+
+Image number n refers to the n-th file (in sorted order) in imageDir. Decoded images are kept in
+an LRU cache of up to cacheSize images, which should be well above the client's lookahead so that
+preloaded images aren't evicted before they are shown.
+
+Acknowledges each request with its requestId, or with a plain 'ACK' if useLegacyAcks (like
+REP-based presenters), but does not display anything.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import typing as tp
+
+import attr
+import zmq
+from qtpy import QtGui
+
+logger = logging.getLogger(__name__)
+
+_imageExtensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+
+@attr.s(auto_attribs=True, eq=False)
+class ZMQPicturePresenterServer:
+    port: int = 0  # 0 to pick a free port; actual port available as .port after start()
+    replyDelay: float = 0.  # in s, to simulate a slow presenter
+    useLegacyAcks: bool = False
+    imageDir: tp.Optional[str] = None
+    cacheSize: int = 64  # max number of decoded images to keep
+
+    shownImages: tp.List[tp.Tuple[int, float]] = attr.ib(init=False, factory=list)  # (imageNumber, time.monotonic())
+    messageLog: tp.List[tp.Dict[str, tp.Any]] = attr.ib(init=False, factory=list)
+    numDecodes: int = attr.ib(init=False, default=0)
+
+    _imagePaths: tp.List[str] = attr.ib(init=False, factory=list)
+    _cache: tp.OrderedDict[int, QtGui.QImage] = attr.ib(init=False, factory=collections.OrderedDict)
+
+    _context: zmq.Context = attr.ib(init=False, factory=zmq.Context.instance)
+    _thread: tp.Optional[threading.Thread] = attr.ib(init=False, default=None)
+    _isStopping: bool = attr.ib(init=False, default=False)
+
+    def __attrs_post_init__(self):
+        if self.imageDir is not None:
+            self._imagePaths = sorted(os.path.join(self.imageDir, filename) for filename in os.listdir(self.imageDir)
+                                      if os.path.splitext(filename)[1].lower() in _imageExtensions)
+            logger.info('Found %d images in %s' % (len(self._imagePaths), self.imageDir))
+
+    def start(self):
+        sock = self._context.socket(zmq.ROUTER)
+        sock.linger = 0
+        if self.port == 0:
+            self.port = sock.bind_to_random_port('tcp://127.0.0.1')
+        else:
+            sock.bind('tcp://127.0.0.1:%d' % (self.port,))
+        self._thread = threading.Thread(target=self._run, args=(sock,), daemon=True, name='ZMQPicturePresenterServer')
+        self._thread.start()
+        logger.debug('Picture presenter stand-in listening on port %d' % (self.port,))
+
+    def stop(self):
+        if self._thread is not None:
+            self._isStopping = True
+            self._thread.join()
+            self._thread = None
+            self._isStopping = False
+
+    def _run(self, sock: zmq.Socket):
+        try:
+            while not self._isStopping:
+                if sock.poll(timeout=100) == 0:
+                    continue
+                frames = sock.recv_multipart(copy=False)
+                # ROUTER prepends sender identity, followed by the envelope delimiter
+                iDelimiter = next(i for i, frame in enumerate(frames) if len(frame) == 0)
+                envelope = [frame.bytes for frame in frames[:iDelimiter + 1]]
+                message = json.loads(frames[iDelimiter + 1].bytes)
+                extraFrames = frames[iDelimiter + 2:]
+
+                if self.replyDelay > 0:
+                    time.sleep(self.replyDelay)
+                reply = self._handleMessage(message, extraFrames)
+                if self.useLegacyAcks and reply == dict(type='ACK'):
+                    reply = 'ACK'
+                elif isinstance(reply, dict) and 'requestId' in message:
+                    reply['requestId'] = message['requestId']
+                sock.send_multipart(envelope + [json.dumps(reply).encode('utf-8')])
+        finally:
+            sock.close(linger=0)
+
+    def _handleMessage(self, message: tp.Dict[str, tp.Any], extraFrames: tp.List[zmq.Frame]) -> tp.Any:
+        self.messageLog.append(message)
+        msgType = message.get('type')
+        try:
+            if msgType == 'showImage':
+                imageNumber = message['imageNumber']
+                wasCached = imageNumber in self._cache
+                if len(self._imagePaths) > 0 or wasCached:
+                    self._getImage(imageNumber)
+                self.shownImages.append((imageNumber, time.monotonic()))
+                return dict(type='ACK', wasCached=wasCached)
+            elif msgType == 'preload':
+                for imageNumber in message['imageNumbers']:
+                    self._getImage(imageNumber)
+                return dict(type='ACK')
+            elif msgType == 'cacheImage':
+                if len(extraFrames) != 1:
+                    raise ValueError('cacheImage requires exactly one frame of image data')
+                image = QtGui.QImage.fromData(extraFrames[0].bytes)
+                if image.isNull():
+                    raise ValueError('Unable to decode image data for image %s' % (message['imageNumber'],))
+                self.numDecodes += 1
+                self._addToCache(message['imageNumber'], image)
+                return dict(type='ACK')
+            else:
+                return dict(type='error', message='Unknown message type %s' % (msgType,))
+        except Exception as e:
+            logger.error('Error handling %s: %s' % (msgType, e))
+            return dict(type='error', message=str(e))
+
+    def _getImage(self, imageNumber: int) -> QtGui.QImage:
+        if imageNumber in self._cache:
+            self._cache.move_to_end(imageNumber)
+            return self._cache[imageNumber]
+        if not 0 <= imageNumber < len(self._imagePaths):
+            raise KeyError('No image %d' % (imageNumber,))
+        image = QtGui.QImage(self._imagePaths[imageNumber])
+        if image.isNull():
+            raise ValueError('Unable to decode %s' % (self._imagePaths[imageNumber],))
+        self.numDecodes += 1
+        self._addToCache(imageNumber, image)
+        return image
+
+    def _addToCache(self, imageNumber: int, image: QtGui.QImage):
+        self._cache[imageNumber] = image
+        self._cache.move_to_end(imageNumber)
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s.%(msecs)03d %(filename)20s %(lineno)4d %(levelname)5s: %(message)s',
+                        datefmt='%H:%M:%S')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9879)
+    parser.add_argument('--imageDir', help='Directory of images, numbered in sorted order')
+    parser.add_argument('--cacheSize', type=int, default=64)
+    args = parser.parse_args()
+
+    server = ZMQPicturePresenterServer(port=args.port, imageDir=args.imageDir, cacheSize=args.cacheSize)
+    server.start()
+    print('Picture presenter stand-in listening on port %d' % (server.port,))
+    try:
+        while True:
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        server.stop()
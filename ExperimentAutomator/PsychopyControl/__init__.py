@@ -1,2 +1,3 @@
 from .PsychopyKeypressAction import PsychopyKeypressAction
+from .ZMQPicturePresenterClient import ZMQPicturePresenterClient
 from .ZMQPicturePresenterAction import ZMQPicturePresenterAction
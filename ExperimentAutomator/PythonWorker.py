@@ -0,0 +1,149 @@
+"""
+Worker interpreter for PythonWorkerPool. Started by the pool (not imported), so only uses the
+standard library:
+
+    python PythonWorker.py <host> <port> <token> [<module to preload> ...]
+
+with the pool's authkey (in hex) as the only line of stdin, so it doesn't appear on the command line.
+
+Imports the given modules, connects back to the pool, and then runs scripts as requested, as if
+each was run with `python <script> <args>`, sending their output back as it is written.
+"""
+import importlib
+import io
+import os
+import runpy
+import sys
+import threading
+import traceback
+from multiprocessing.connection import Client, Connection
+
+
+class _RedirectedFd:
+    """
+    Redirects an OS-level file descriptor (1 or 2) to a pipe whose contents are forwarded to the
+    pool, so that output written through sys.stdout.buffer, by C extensions, or by subprocesses
+    that inherit the descriptor also reaches the script's log.
+    """
+
+    def __init__(self, conn: Connection, connLock: threading.Lock, fd: int, streamName: str):
+        self._conn = conn
+        self._connLock = connLock
+        self._fd = fd
+        self._streamName = streamName
+        self._isForwarding = True
+        self._savedFd = os.dup(fd)
+        readFd, writeFd = os.pipe()
+        os.dup2(writeFd, fd)
+        os.close(writeFd)
+        self._reader = threading.Thread(target=self._forward, args=(readFd,), daemon=True)
+        self._reader.start()
+
+    def restore(self, timeout: float = 0.5):
+        """
+        Point the descriptor back at its original target, and wait for output written so far to be
+        forwarded. Output from any descendants still holding the pipe open after timeout is dropped,
+        so that it can't be attributed to a later run.
+        """
+        os.dup2(self._savedFd, self._fd)
+        os.close(self._savedFd)
+        self._reader.join(timeout)
+        self._isForwarding = False
+
+    def _forward(self, readFd: int):
+        try:
+            while True:
+                data = os.read(readFd, 65536)
+                if len(data) == 0:
+                    break  # all write ends closed
+                if self._isForwarding:
+                    with self._connLock:
+                        self._conn.send((self._streamName, data))
+        finally:
+            os.close(readFd)
+
+
+def _openStdStream(fd: int) -> io.TextIOWrapper:
+    # as sys.stdout / sys.stderr would be for a script writing to a pipe, but line buffered, so
+    # that output appears in the log as it is written
+    return open(fd, 'w', buffering=1, encoding='utf-8', errors='backslashreplace', closefd=False)
+
+
+def _runScript(conn: Connection, connLock: threading.Lock, scriptPath: str, args, cwd: str, env) -> int:
+    prevArgv, prevPath, prevCwd, prevEnv = sys.argv, list(sys.path), os.getcwd(), dict(os.environ)
+    prevStdout, prevStderr = sys.stdout, sys.stderr
+    for stream in (prevStdout, prevStderr):
+        stream.flush()
+    redirects = [_RedirectedFd(conn, connLock, 1, 'stdout'), _RedirectedFd(conn, connLock, 2, 'stderr')]
+    sys.stdout, sys.stderr = _openStdStream(1), _openStdStream(2)
+    sys.argv = [scriptPath] + list(args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(scriptPath)))  # as when running a script directly
+    os.environ.update(env)
+    try:
+        os.chdir(cwd)
+        runpy.run_path(scriptPath, run_name='__main__')
+        returnCode = 0
+    except SystemExit as e:
+        if e.code is None:
+            returnCode = 0
+        elif isinstance(e.code, int):
+            returnCode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returnCode = 1
+    except BaseException:
+        traceback.print_exc()
+        returnCode = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass  # e.g. closed by the script
+        sys.stdout, sys.stderr = prevStdout, prevStderr
+        for redirect in redirects:
+            redirect.restore()
+        sys.argv, sys.path[:] = prevArgv, prevPath
+        os.chdir(prevCwd)
+        os.environ.clear()
+        os.environ.update(prevEnv)
+    return returnCode
+
+
+def main():
+    host, port, token = sys.argv[1:4]
+    moduleNames = sys.argv[4:]
+    del sys.argv[1:]
+    authkeyHex = sys.stdin.readline().strip()
+
+    loaded, failed = [], []
+    for moduleName in moduleNames:
+        try:
+            importlib.import_module(moduleName)
+        except Exception as e:
+            failed.append('%s (%s: %s)' % (moduleName, type(e).__name__, e))
+        else:
+            loaded.append(moduleName)
+
+    conn = Client((host, int(port)), authkey=bytes.fromhex(authkeyHex))
+    connLock = threading.Lock()
+    conn.send(('ready', token, os.getpid(), loaded, failed))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message[0] == 'exit':
+            break
+        elif message[0] == 'run':
+            _, scriptPath, args, cwd, env = message
+            returnCode = _runScript(conn, connLock, scriptPath, args, cwd, env)
+            with connLock:
+                conn.send(('finished', returnCode))
+        else:
+            raise NotImplementedError('Unknown message %r' % (message[0],))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
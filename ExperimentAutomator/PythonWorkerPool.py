@@ -0,0 +1,328 @@
+"""
+Pool of pre-started Python interpreters for running Python scripts without paying for interpreter
+startup and heavy imports each time.
+
+Workers (see PythonWorker.py) import the modules listed in configuration value
+PythonWorkerPreloadModules when started, then wait for a script to run. Up to PythonWorkerPoolSize
+idle workers are kept ready, and a worker is replaced after running PythonWorkerMaxRuns scripts (by
+default after every script, so that scripts can't affect each other; the replacement starts while
+the previous script is running, so is usually ready before it's needed).
+"""
+import itertools
+import logging
+import os
+import secrets
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import typing as tp
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener
+
+import attr
+from qtpy import QtCore
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.Misc import Singleton, exceptionToStr
+from ExperimentAutomator.ProcessSupervisor import ProcessSupervisor, TerminationReport
+from ExperimentAutomator.ScriptProcess import ScriptOutputLog, ScriptResult, ProcessTreeMonitor, getScriptLogDir
+
+logger = logging.getLogger(__name__)
+
+_workerPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PythonWorker.py')
+
+
+def splitPythonCommandLine(s: str) -> tp.Tuple[str, tp.List[str]]:
+    """
+    Split e.g. 'script.py arg1 "arg 2"' (optionally preceded by 'python') into script path and args.
+    """
+    parts = [part[1:-1] if len(part) > 1 and part[0] == part[-1] and part[0] in '"\'' else part
+             for part in shlex.split(s, posix=False)]  # not posix, to keep backslashes in Windows paths
+    if len(parts) > 0 and os.path.splitext(os.path.basename(parts[0]))[0].lower() in ('python', 'pythonw', 'python3'):
+        parts = parts[1:]
+    if len(parts) == 0:
+        raise ValueError('No script specified')
+    return parts[0], parts[1:]
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _Worker:
+    token: str
+    popen: subprocess.Popen
+    spawnTime: float
+    conn: tp.Optional[Connection] = None
+    isReady: threading.Event = attr.ib(factory=threading.Event)
+    numRuns: int = 0
+    run: tp.Optional['PythonScriptRun'] = None
+
+
+class PythonScriptRun(QtCore.QObject):
+    """
+    A script run by a pool worker. Interface matches ScriptProcess.
+    """
+
+    sigFinished = QtCore.Signal(object)  # emits ScriptResult
+
+    _sigStarted = QtCore.Signal(int)  # emits pid, from dispatch thread
+    _sigOutput = QtCore.Signal(str, object)  # emits (stream name, data), from dispatch thread
+    _sigExited = QtCore.Signal(object, object)  # emits (return code, error), from dispatch thread
+    _sigTerminated = QtCore.Signal(object)  # emits TerminationReport, from kill thread
+
+    def __init__(self,
+                 pool: 'PythonWorkerPool',
+                 scriptPath: str,
+                 args: tp.Sequence[str] = (),
+                 cwd: tp.Optional[str] = None,
+                 env: tp.Optional[tp.Dict[str, str]] = None,  # added to the worker's environment while running
+                 parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self._pool = pool
+        self.scriptPath = scriptPath
+        self.args = list(args)
+        self.cwd = os.getcwd() if cwd is None else cwd
+        self.env = dict() if env is None else dict(env)
+        self._cmd = subprocess.list2cmdline(['python', scriptPath] + self.args)
+        self._output = ScriptOutputLog(self._cmd, name='Python script', parent=self)
+        self._monitor = ProcessTreeMonitor(parent=self)
+        self._sigStarted.connect(self._monitor.start)
+        self._sigOutput.connect(self._onOutput)
+        self._sigExited.connect(self._onExited)
+        self._sigTerminated.connect(self._onTerminated)
+        self._startTime: tp.Optional[float] = None
+        self._wasKilled = False
+        self._worker: tp.Optional[_Worker] = None
+        self._isDone = threading.Event()  # set by dispatch thread once worker finished or died
+        self.result: tp.Optional[ScriptResult] = None
+
+    @property
+    def cmd(self) -> str:
+        return self._cmd
+
+    @property
+    def logPath(self) -> str:
+        return self._output.path
+
+    @property
+    def isRunning(self) -> bool:
+        return self._startTime is not None and not self._isDone.is_set()
+
+    def start(self):
+        self._output.open()
+        self._startTime = time.perf_counter()
+        self._worker = self._pool._dispatch(self)
+
+    def kill(self, gracePeriod: tp.Optional[float] = None, doWait: bool = True):
+        """
+        Terminate the worker running the script (and any children), killing any still running
+        after gracePeriod. Completion is still reported via sigFinished. If not doWait, returns
+        immediately and terminates on a background thread instead.
+        """
+        if not self.isRunning:
+            return
+        self._wasKilled = True
+        if doWait:
+            self._onTerminated(self._monitor.terminateAll(gracePeriod=gracePeriod))
+        else:
+            threading.Thread(target=lambda: self._sigTerminated.emit(self._monitor.terminateAll(gracePeriod=gracePeriod)),
+                             daemon=True, name='PythonScriptRunKill').start()
+
+    def _onTerminated(self, report: TerminationReport):
+        if report.numProcesses == 0 and self._worker is not None:
+            self._worker.popen.kill()
+        elif report.numProcesses > 0:
+            logger.info('Stopped %s: %s' % (self._cmd, report))
+
+    def waitForFinished(self, timeout: float = 5.) -> bool:
+        return self._isDone.wait(timeout)
+
+    def _onOutput(self, streamName: str, data: bytes):
+        if streamName == 'stdout':
+            self._output.writeStdout(data)
+        else:
+            self._output.writeStderr(data)
+
+    def _onExited(self, returnCode: tp.Optional[int], error: tp.Optional[str]):
+        self._monitor.stop()
+        self._output.close()
+        self.result = ScriptResult(cmd=self._cmd,
+                                   returnCode=returnCode,
+                                   duration=time.perf_counter() - self._startTime,
+                                   peakRSS=self._monitor.peakRSS,
+                                   logPath=self._output.path,
+                                   numOutputLines=self._output.numOutputLines,
+                                   numErrorLines=self._output.numErrorLines,
+                                   wasKilled=self._wasKilled,
+                                   error=None if self._wasKilled else error)
+        self.sigFinished.emit(self.result)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class PythonWorkerPool(metaclass=Singleton):
+    _listener: tp.Optional[Listener] = attr.ib(init=False, default=None)
+    _authkey: bytes = attr.ib(init=False, factory=lambda: secrets.token_bytes(32))
+    _workers: tp.List[_Worker] = attr.ib(init=False, factory=list)
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+    _tokens: tp.Iterator[int] = attr.ib(init=False, factory=itertools.count)
+    _workerLog: tp.Optional[tp.BinaryIO] = attr.ib(init=False, default=None)
+    _isShutDown: bool = attr.ib(init=False, default=False)
+
+    def warmUp(self):
+        """
+        Start idle workers, if not already running, without blocking.
+        """
+        self._isShutDown = False
+        self._topUp()
+
+    def createRun(self,
+                  scriptPath: str,
+                  args: tp.Sequence[str] = (),
+                  cwd: tp.Optional[str] = None,
+                  env: tp.Optional[tp.Dict[str, str]] = None) -> PythonScriptRun:
+        return PythonScriptRun(self, scriptPath=scriptPath, args=args, cwd=cwd, env=env)
+
+    def shutdown(self):
+        with self._lock:
+            self._isShutDown = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            if worker.run is not None:
+                worker.popen.kill()
+                continue
+            try:
+                if worker.conn is not None:
+                    worker.conn.send(('exit',))
+            except OSError:
+                pass
+        for worker in workers:
+            try:
+                worker.popen.wait(timeout=2.)
+            except subprocess.TimeoutExpired:
+                worker.popen.kill()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if self._workerLog is not None:
+            self._workerLog.close()
+            self._workerLog = None
+
+    def _ensureListening(self):
+        if self._listener is not None:
+            return
+        self._listener = Listener(('127.0.0.1', 0), authkey=self._authkey)
+        threading.Thread(target=self._acceptConnections, args=(self._listener,), daemon=True,
+                         name='PythonWorkerPoolAccept').start()
+        os.makedirs(getScriptLogDir(), exist_ok=True)
+        self._workerLog = open(os.path.join(getScriptLogDir(), 'PythonWorkers.log'), 'ab')
+
+    def _spawn(self) -> _Worker:
+        # called with lock held
+        self._ensureListening()
+        host, port = self._listener.address
+        token = str(next(self._tokens))
+        moduleNames = list(globalConfiguration.PythonWorkerPreloadModules)
+        popen = subprocess.Popen([sys.executable, _workerPath, host, str(port), token] + moduleNames,
+                                 stdin=subprocess.PIPE,
+                                 stdout=self._workerLog,  # only output not written by a script, e.g. from C extensions
+                                 stderr=self._workerLog,
+                                 **ProcessSupervisor.popenKwargs())
+        # through stdin rather than the command line, which other users' processes can read
+        # (then closed, so scripts see no input, as before)
+        try:
+            popen.stdin.write(self._authkey.hex().encode('ascii') + b'\n')
+            popen.stdin.close()
+        except BrokenPipeError:
+            pass  # worker already exited, which is handled like any other worker failing to start
+        ProcessSupervisor().register(popen, description='Python worker')
+        worker = _Worker(token=token, popen=popen, spawnTime=time.perf_counter())
+        self._workers.append(worker)
+        logger.debug('Starting Python worker %d' % (popen.pid,))
+        return worker
+
+    def _topUp(self):
+        with self._lock:
+            if self._isShutDown:
+                return
+            numIdle = sum(1 for worker in self._workers if worker.run is None)
+            for _ in range(globalConfiguration.PythonWorkerPoolSize - numIdle):
+                self._spawn()
+
+    def _acceptConnections(self, listener: Listener):
+        while True:
+            try:
+                conn = listener.accept()
+                message = conn.recv()
+            except (OSError, EOFError, AuthenticationError):
+                if self._listener is not listener:
+                    break  # closed
+                logger.warning('Rejected connection to Python worker pool')
+                continue
+            _, token, pid, loaded, failed = message
+            with self._lock:
+                worker = next((worker for worker in self._workers if worker.token == token), None)
+            if worker is None:
+                conn.close()
+                continue
+            worker.conn = conn
+            logger.info('Python worker %d ready after %.0f ms%s' % (
+                pid, (time.perf_counter() - worker.spawnTime) * 1e3,
+                ' (preloaded %s)' % ', '.join(loaded) if len(loaded) > 0 else ''))
+            if len(failed) > 0:
+                logger.warning('Python worker %d could not preload %s' % (pid, ', '.join(failed)))
+            worker.isReady.set()
+
+    def _dispatch(self, run: PythonScriptRun) -> _Worker:
+        with self._lock:
+            self._isShutDown = False
+            idle = [worker for worker in self._workers if worker.run is None]
+            ready = [worker for worker in idle if worker.isReady.is_set()]
+            if len(ready) > 0:
+                worker = ready[0]
+            elif len(idle) > 0:
+                worker = idle[0]
+                logger.info('Python worker not yet ready, waiting for it to start')
+            else:
+                logger.info('No idle Python worker, starting one')
+                worker = self._spawn()
+            worker.run = run
+        self._topUp()
+        threading.Thread(target=self._runOnWorker, args=(worker, run), daemon=True,
+                         name='PythonWorker%d' % (worker.popen.pid,)).start()
+        return worker
+
+    def _runOnWorker(self, worker: _Worker, run: PythonScriptRun):
+        returnCode, error = None, None
+        try:
+            while not worker.isReady.wait(0.1):
+                if worker.popen.poll() is not None:
+                    raise EOFError('Worker exited while starting (see %s)' % (self._workerLog.name,))
+            run._sigStarted.emit(worker.popen.pid)
+            worker.conn.send(('run', run.scriptPath, run.args, run.cwd, run.env))
+            while True:
+                message = worker.conn.recv()
+                if message[0] == 'finished':
+                    returnCode = message[1]
+                    break
+                run._sigOutput.emit(message[0], message[1])
+        except (EOFError, OSError) as e:
+            # worker died, e.g. killed or crashed
+            returnCode = worker.popen.wait()
+            error = 'Python worker exited with code %s: %s' % (returnCode, exceptionToStr(e))
+        finally:
+            worker.numRuns += 1
+            doRecycle = error is not None or worker.numRuns >= globalConfiguration.PythonWorkerMaxRuns
+            if doRecycle:
+                with self._lock:
+                    if worker in self._workers:
+                        self._workers.remove(worker)
+                try:
+                    worker.conn.send(('exit',))
+                except (AttributeError, OSError):
+                    pass
+            else:
+                worker.run = None
+            run._isDone.set()
+            run._sigExited.emit(returnCode, error)
+        if doRecycle:
+            self._topUp()
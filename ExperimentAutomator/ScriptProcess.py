@@ -0,0 +1,368 @@
+"""
+Event-driven runner for external commands, used by RunScriptAction.
+
+Completion and output are handled as soon as Qt reports them (rather than by polling). Output is
+written in bulk to a per-process log file, and only summarized in the console at most once per
+`summaryInterval` per stream, so that noisy scripts don't flood the GUI (see ScriptOutputLog, also
+used for scripts run by PythonWorkerPool).
+"""
+import datetime
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import typing as tp
+
+import attr
+import psutil
+from qtpy import QtCore
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.Misc import getUserDataDir
+from ExperimentAutomator.ProcessSupervisor import ProcessSupervisor, TerminationReport
+
+logger = logging.getLogger(__name__)
+
+
+def getScriptLogDir() -> str:
+    return os.path.join(getUserDataDir(), 'ScriptLogs')
+
+
+@attr.s(auto_attribs=True, eq=False)
+class ScriptResult:
+    cmd: str
+    returnCode: tp.Optional[int]  # None if process failed to start or crashed
+    duration: float  # in s
+    peakRSS: tp.Optional[int]  # in bytes, summed over the process and its children; None if unavailable
+    logPath: str
+    numOutputLines: int = 0
+    numErrorLines: int = 0
+    wasKilled: bool = False
+    error: tp.Optional[str] = None
+
+    def __str__(self):
+        if self.error is not None:
+            status = self.error
+        elif self.wasKilled:
+            status = 'killed'
+        else:
+            status = 'returned %s' % (self.returnCode,)
+        peakRSSStr = '' if self.peakRSS is None else ', peak RSS %.0f MB' % (self.peakRSS / 2**20,)
+        return '%s after %.2f s%s; output in %s' % (status, self.duration, peakRSSStr, self.logPath)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _StreamSummary:
+    label: str
+    logLevel: int
+    numLines: int = 0
+    numLinesSummarized: int = 0
+    lastLine: bytes = b''
+    partialLine: bytes = b''
+
+    def add(self, data: bytes):
+        lines = (self.partialLine + data).split(b'\n')
+        self.partialLine = lines.pop()
+        completeLines = [line for line in lines if len(line.strip()) > 0]
+        self.numLines += len(completeLines)
+        if len(completeLines) > 0:
+            self.lastLine = completeLines[-1]
+
+    def flush(self, name: str, isFinal: bool = False):
+        if isFinal and len(self.partialLine.strip()) > 0:
+            self.numLines += 1
+            self.lastLine, self.partialLine = self.partialLine, b''
+        numNew = self.numLines - self.numLinesSummarized
+        if numNew == 0:
+            return
+        lastLine = self.lastLine.decode('utf-8', errors='replace').rstrip('\r\n')
+        if numNew == 1:
+            logger.log(self.logLevel, '%s %s: %s' % (name, self.label, lastLine))
+        else:
+            logger.log(self.logLevel, '%s %s: %d lines, last: %s' % (name, self.label, numNew, lastLine))
+        self.numLinesSummarized = self.numLines
+
+
+class ScriptOutputLog(QtCore.QObject):
+    """
+    Writes a script's output to a log file, and periodically summarizes it in the console.
+    """
+
+    def __init__(self,
+                 cmd: str,
+                 name: tp.Optional[str] = None,
+                 logDir: tp.Optional[str] = None,
+                 summaryInterval: float = 1.,  # in s
+                 parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self._cmd = cmd
+        self._name = name if name is not None else 'Subprocess'
+        if logDir is None:
+            logDir = getScriptLogDir()
+        os.makedirs(logDir, exist_ok=True)
+        safeCmd = re.sub(r'[^\w.-]+', '_', os.path.basename(cmd.split(' ', 1)[0].strip('"\'')))[:40]
+        self.path = os.path.join(logDir, '%s_%s.log' % (
+            datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'), safeCmd))
+        self._file: tp.Optional[tp.BinaryIO] = None
+
+        self._stdout = _StreamSummary(label='output', logLevel=logging.INFO)
+        self._stderr = _StreamSummary(label='error output', logLevel=logging.ERROR)
+
+        self._summaryTimer = QtCore.QTimer(self)
+        self._summaryTimer.setInterval(round(summaryInterval * 1e3))
+        self._summaryTimer.timeout.connect(self._summarize)
+
+    @property
+    def numOutputLines(self) -> int:
+        return self._stdout.numLines
+
+    @property
+    def numErrorLines(self) -> int:
+        return self._stderr.numLines
+
+    def open(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(('$ %s\n' % (self._cmd,)).encode('utf-8'))
+        self._summaryTimer.start()
+
+    def writeStdout(self, data: bytes):
+        self._file.write(data)
+        self._stdout.add(data)
+
+    def writeStderr(self, data: bytes):
+        self._file.write(data)
+        self._stderr.add(data)
+
+    def _summarize(self, isFinal: bool = False):
+        self._stdout.flush(self._name, isFinal=isFinal)
+        self._stderr.flush(self._name, isFinal=isFinal)
+
+    def close(self):
+        self._summaryTimer.stop()
+        self._summarize(isFinal=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ProcessTreeMonitor(QtCore.QObject):
+    """
+    Tracks memory and CPU use of a process and its children, and stops them all on request.
+
+    Usage is sampled every sampleInterval. Peak memory is the peak of the samples, except on
+    Windows, where the OS tracks each process's peak so that short spikes between samples aren't
+    missed.
+    """
+
+    def __init__(self, sampleInterval: float = 0.25, parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self._psProc: tp.Optional[psutil.Process] = None
+        self._psChildren: tp.Dict[int, psutil.Process] = dict()  # kept between samples for CPU percentages
+        self.peakRSS: tp.Optional[int] = None  # in bytes
+        self.rss: tp.Optional[int] = None  # in bytes, as of last sample
+        self.cpuPercent: tp.Optional[float] = None  # since previous sample, summed over processes (so may exceed 100)
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(round(sampleInterval * 1e3))
+        self._timer.timeout.connect(self.sample)
+
+    @property
+    def process(self) -> tp.Optional[psutil.Process]:
+        return self._psProc
+
+    def start(self, pid: int):
+        try:
+            self._psProc = psutil.Process(pid)
+        except psutil.Error:
+            return
+        self._psChildren.clear()
+        self.peakRSS = None
+        self.sample()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+        self._psProc = None
+        self._psChildren.clear()
+
+    def getProcessTree(self) -> tp.List[psutil.Process]:
+        if self._psProc is None:
+            return []
+        try:
+            children = self._psProc.children(recursive=True)
+        except psutil.Error:
+            return []
+        self._psChildren = {child.pid: self._psChildren.get(child.pid, child) for child in children}
+        return [self._psProc] + list(self._psChildren.values())
+
+    def sample(self):
+        rss, peakRSS, cpuPercent = 0, 0, 0.
+        for proc in self.getProcessTree():
+            try:
+                with proc.oneshot():
+                    memInfo = proc.memory_info()
+                    cpuPercent += proc.cpu_percent(interval=None)  # 0 on first call for each process
+            except psutil.Error:
+                continue
+            rss += memInfo.rss
+            peakRSS += getattr(memInfo, 'peak_wset', memInfo.rss)
+        if rss > 0:
+            self.rss = rss
+            self.cpuPercent = cpuPercent
+            self.peakRSS = max(peakRSS, self.peakRSS or 0)
+
+    def terminateAll(self, gracePeriod: tp.Optional[float] = None) -> TerminationReport:
+        """
+        Terminate the process and its children via ProcessSupervisor, killing any still running
+        after gracePeriod (by default configuration value ProcessTerminateGracePeriod).
+        """
+        if self._psProc is None:
+            return TerminationReport()
+        if gracePeriod is None:
+            gracePeriod = globalConfiguration.ProcessTerminateGracePeriod
+        return ProcessSupervisor().terminate([self._psProc], gracePeriod=gracePeriod)
+
+
+class ScriptProcess(QtCore.QObject):
+    """
+    Runs a shell command line, like subprocess with shell=True.
+    """
+
+    sigStarted = QtCore.Signal(int)  # emits pid
+    sigFinished = QtCore.Signal(object)  # emits ScriptResult
+
+    _sigTerminated = QtCore.Signal(object)  # emits TerminationReport, from kill thread
+
+    def __init__(self,
+                 cmd: str,
+                 name: tp.Optional[str] = None,
+                 logDir: tp.Optional[str] = None,
+                 summaryInterval: float = 1.,  # in s
+                 memorySampleInterval: float = 0.25,  # in s
+                 env: tp.Optional[tp.Dict[str, str]] = None,  # added to this process's environment
+                 parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self._cmd = cmd
+        self._output = ScriptOutputLog(cmd, name=name, logDir=logDir, summaryInterval=summaryInterval, parent=self)
+        self._monitor = ProcessTreeMonitor(sampleInterval=memorySampleInterval, parent=self)
+
+        self._proc = QtCore.QProcess(self)
+        if env is not None:
+            processEnv = QtCore.QProcessEnvironment.systemEnvironment()
+            for key, value in env.items():
+                processEnv.insert(key, value)
+            self._proc.setProcessEnvironment(processEnv)
+        self._proc.readyReadStandardOutput.connect(self._onReadyReadStdout)
+        self._proc.readyReadStandardError.connect(self._onReadyReadStderr)
+        self._proc.started.connect(self._onStarted)
+        self._proc.finished.connect(self._onFinished)
+        self._proc.errorOccurred.connect(self._onErrorOccurred)
+        self._sigTerminated.connect(self._onTerminated)
+
+        self._startTime: tp.Optional[float] = None
+        self._startedPid: tp.Optional[int] = None
+        self._wasKilled = False
+        self.result: tp.Optional[ScriptResult] = None
+
+    @property
+    def cmd(self) -> str:
+        return self._cmd
+
+    @property
+    def logPath(self) -> str:
+        return self._output.path
+
+    @property
+    def pid(self) -> tp.Optional[int]:
+        pid = self._proc.processId()
+        return pid if pid > 0 else None
+
+    @property
+    def monitor(self) -> ProcessTreeMonitor:
+        return self._monitor
+
+    @property
+    def isRunning(self) -> bool:
+        return self._proc.state() != QtCore.QProcess.NotRunning
+
+    def start(self):
+        self._output.open()
+        if sys.platform == 'win32':
+            # pass command line through unmodified, since cmd has its own quoting rules
+            self._proc.setProgram('cmd.exe')
+            self._proc.setNativeArguments('/c %s' % (self._cmd,))
+        else:
+            self._proc.setProgram('/bin/sh')
+            self._proc.setArguments(['-c', self._cmd])
+        ProcessSupervisor.prepareQProcess(self._proc)  # so that orphaned descendants can still be stopped
+        self._startTime = time.perf_counter()
+        self._proc.start()
+        self._proc.closeWriteChannel()  # scripts shouldn't wait for input
+
+    def _onStarted(self):
+        self._startedPid = self._proc.processId()  # processId() is 0 again once finished
+        ProcessSupervisor().register(self._startedPid, description=self._cmd)
+        self._monitor.start(self._startedPid)
+        self.sigStarted.emit(self._startedPid)
+
+    def kill(self, gracePeriod: tp.Optional[float] = None, doWait: bool = True):
+        """
+        Terminate the process and all its children, killing any still running after gracePeriod.
+        Completion is still reported via sigFinished. If not doWait, returns immediately and
+        terminates on a background thread instead.
+        """
+        if not self.isRunning:
+            return
+        self._wasKilled = True
+        if doWait:
+            self._onTerminated(self._monitor.terminateAll(gracePeriod=gracePeriod))
+        else:
+            threading.Thread(target=lambda: self._sigTerminated.emit(self._monitor.terminateAll(gracePeriod=gracePeriod)),
+                             daemon=True, name='ScriptProcessKill').start()
+
+    def _onTerminated(self, report: TerminationReport):
+        if report.numProcesses == 0:
+            self._proc.kill()
+        else:
+            logger.info('Stopped %s: %s' % (self._cmd, report))
+
+    def waitForFinished(self, timeout: float = 5.) -> bool:
+        return self.result is not None or self._proc.waitForFinished(round(timeout * 1e3))
+
+    def _onReadyReadStdout(self):
+        self._output.writeStdout(bytes(self._proc.readAllStandardOutput()))
+
+    def _onReadyReadStderr(self):
+        self._output.writeStderr(bytes(self._proc.readAllStandardError()))
+
+    def _onErrorOccurred(self, error):
+        if error == QtCore.QProcess.FailedToStart:
+            # finished will not be emitted
+            self._finish(returnCode=None, error='Failed to start: %s' % (self._proc.errorString(),))
+
+    def _onFinished(self, exitCode: int, exitStatus):
+        self._onReadyReadStdout()
+        self._onReadyReadStderr()
+        if exitStatus == QtCore.QProcess.CrashExit and not self._wasKilled:
+            self._finish(returnCode=None, error='Crashed: %s' % (self._proc.errorString(),))
+        else:
+            self._finish(returnCode=exitCode)
+
+    def _finish(self, returnCode: tp.Optional[int], error: tp.Optional[str] = None):
+        if self.result is not None:
+            return
+        if self._startedPid is not None:
+            ProcessSupervisor().unregister(self._startedPid)
+        self._monitor.stop()
+        self._output.close()
+        self.result = ScriptResult(cmd=self._cmd,
+                                   returnCode=returnCode,
+                                   duration=time.perf_counter() - self._startTime,
+                                   peakRSS=self._monitor.peakRSS,
+                                   logPath=self._output.path,
+                                   numOutputLines=self._output.numOutputLines,
+                                   numErrorLines=self._output.numErrorLines,
+                                   wasKilled=self._wasKilled,
+                                   error=error)
+        self.sigFinished.emit(self.result)
@@ -0,0 +1,199 @@
+import typing as tp
+import attr
+import ast
+import concurrent.futures
+import logging
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.ExperimentActions import ExperimentAction, Locals
+from ExperimentAutomator.Misc import Singleton
+from .SpeechCache import SpeechCache
+from .SpeechQueue import SpeechQueue, Utterance
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True)
+class Speaker(metaclass=Singleton):
+    """
+    Singleton owning the speech cache, with voice and rate as set by configuration values
+    SpeechVoice and SpeechRate.
+    """
+    _cache: tp.Optional[SpeechCache] = attr.ib(init=False, default=None)
+    _queue: tp.Optional[SpeechQueue] = attr.ib(init=False, default=None)
+
+    def _getCache(self) -> SpeechCache:
+        if self._cache is None:
+            self._cache = SpeechCache(voice=globalConfiguration.SpeechVoice, rate=globalConfiguration.SpeechRate)
+        return self._cache
+
+    def prefetch(self, texts: tp.Iterable[str]):
+        self._getCache().prefetch(texts)
+
+    def getRendered(self, text: str) -> concurrent.futures.Future:
+        return self._getCache().get(text)
+
+    def onConfigurationChanged(self, keys: tp.Set[str]):
+        if self._cache is not None and len(keys & {'SpeechVoice', 'SpeechRate'}) > 0:
+            # utterances already queued are still spoken with the previous settings
+            logger.info('Speech settings changed, rendering new utterances with them')
+            self._cache.close(doCancelPending=False)
+            self._cache = None
+
+    @property
+    def queue(self) -> SpeechQueue:
+        if self._queue is None:
+            self._queue = SpeechQueue(renderFn=self.getRendered)
+        return self._queue
+
+    def close(self):
+        if self._queue is not None:
+            self._queue.close()
+            self._queue = None
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+
+def _literalSpeakStr(argStr: str) -> tp.Optional[str]:
+    """
+    Returns the text a table cell will speak if it can be determined without evaluating any
+    variables, else None.
+    """
+    try:
+        text = ast.literal_eval(argStr)
+    except SyntaxError:
+        return argStr  # e.g. unquoted text, which _evalStr falls back to
+    except ValueError:
+        return None  # an expression
+    if not isinstance(text, str):
+        return None
+    return text
+
+
+def _isSafeToEvalEarly(argStr: str) -> bool:
+    """
+    Whether evaluating argStr before its action starts can't have side effects, i.e. it doesn't
+    call anything.
+    """
+    try:
+        tree = ast.parse(argStr, mode='eval')
+    except SyntaxError:
+        return True  # plain text
+    return not any(isinstance(node, ast.Call) for node in ast.walk(tree))
+
+
+
+def _splitSpeakStr(speakStr: str) -> tp.Tuple[str, tp.Optional[str]]:
+    """
+    Split contents of a speak cell into mode ('', '&', 'wait', or 'stop') and text to speak, if any.
+    """
+    if speakStr in ('wait', 'stop'):
+        return speakStr, None
+    if speakStr.startswith('& '):
+        return '&', speakStr[2:].lstrip()
+    return '', speakStr
+
+
+@attr.s(auto_attribs=True)
+class SpeakAction(ExperimentAction):
+    """
+    Speak text, from the speech cache if possible, e.g.:
+        <text>  (waits until spoken)
+        & <text>  (speaks in background, continuing to next action immediately)
+        wait  (waits until all background speech is spoken)
+        stop  (cancels all background speech)
+
+    Utterances are spoken in order, so text not in the background is spoken only after any
+    background speech queued before it. To speak text that is literally 'wait' or 'stop', quote it.
+
+    Constant text is rendered when the table is loaded, and text given by an expression is
+    rendered once the action is next to run. If rendering fails, text is synthesized live instead.
+    """
+    key: tp.ClassVar[str] = 'speak'
+    speakStr: str = ''
+
+    _utterance: tp.Optional[Utterance] = attr.ib(init=False, default=None)
+    _isWaiting: bool = attr.ib(init=False, default=False)
+
+    def prepareToStart(self, locals: Locals):
+        mode, textStr = _splitSpeakStr(self.speakStr)
+        if textStr is None or not _isSafeToEvalEarly(textStr):
+            return
+        try:
+            speakStr = str(eval(textStr, dict(), dict(locals)))
+        except (NameError, SyntaxError):
+            speakStr = textStr
+        except Exception:
+            return  # may only be evaluable once earlier actions have run
+        Speaker().prefetch([speakStr])
+
+    def _start(self):
+        queue = Speaker().queue
+        mode, textStr = _splitSpeakStr(self.speakStr)
+
+        if mode in ('', '&'):
+            speakStr = str(self._evalStr(textStr))
+            if mode == '':
+                logger.info('Speaking \'%s\'' % speakStr)
+                queue.sigUtteranceFinished.connect(self._onUtteranceFinished)
+                self._utterance = queue.enqueue(speakStr)
+                if not self._utterance.isFinished:
+                    return
+                # already finished, e.g. if synthesized live
+                queue.sigUtteranceFinished.disconnect(self._onUtteranceFinished)
+            else:
+                queue.enqueue(speakStr)
+                logger.info('Speaking \'%s\' in background (%d utterances queued)' % (speakStr, queue.numQueued))
+        elif mode == 'wait':
+            if not queue.isIdle:
+                logger.info('Waiting for %d utterances to be spoken' % (queue.numQueued,))
+                self._isWaiting = True
+                queue.sigIdle.connect(self._onIdle)
+                return
+        elif mode == 'stop':
+            if not queue.isIdle:
+                logger.info('Cancelling %d utterances' % (queue.numQueued,))
+            queue.stopAll()
+        else:
+            raise NotImplementedError()
+
+        self._onStop()
+
+    def _onUtteranceFinished(self, utterance: Utterance):
+        if utterance is not self._utterance:
+            return
+        Speaker().queue.sigUtteranceFinished.disconnect(self._onUtteranceFinished)
+        self._onStop()
+
+    def _onIdle(self):
+        Speaker().queue.sigIdle.disconnect(self._onIdle)
+        self._isWaiting = False
+        self._onStop()
+
+    def stop(self):
+        logger.debug('Speech terminated early')
+        if self._utterance is not None and not self._utterance.isFinished:
+            Speaker().queue.cancel(self._utterance)  # triggers _onUtteranceFinished
+        elif self._isWaiting:
+            # stop waiting, but leave background speech running
+            self._onIdle()
+        elif not self.didStop:
+            self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(speakStr=s, **kwargs)
+
+    @classmethod
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        # render all constant text now, rather than when first spoken
+        texts = []
+        for argStr in argStrs:
+            _, textStr = _splitSpeakStr(argStr)
+            text = None if textStr is None else _literalSpeakStr(textStr)
+            if text is not None:
+                texts.append(text)
+        if len(texts) > 0:
+            Speaker().prefetch(texts)
+            logger.info('Rendering %d speech prompts in background' % (len(set(texts)),))
@@ -0,0 +1,121 @@
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+import time
+import typing as tp
+
+import attr
+
+from ExperimentAutomator.Misc import getUserDataDir
+
+logger = logging.getLogger(__name__)
+
+
+def _initPyttsx3():
+    import pyttsx3
+    return pyttsx3.init()
+
+
+@attr.s(auto_attribs=True, eq=False)
+class SpeechCache:
+    """
+    Renders utterances to audio files ahead of time, so that speaking them later only involves
+    playing a file.
+
+    Files are stored in a content-addressed directory keyed by text, voice and rate, so they are
+    reused across sessions and never need invalidating. Rendering happens on a dedicated worker
+    thread owning its own text-to-speech engine (since SAPI engines may only be used from the
+    thread that created them).
+    """
+    cacheDir: str = attr.ib(factory=lambda: os.path.join(getUserDataDir(), 'SpeechCache'))
+    voice: tp.Optional[str] = None  # voice id; None for engine default
+    rate: tp.Optional[int] = None  # in words per minute; None for engine default
+    engineFactory: tp.Callable[[], tp.Any] = _initPyttsx3
+
+    _executor: tp.Optional[concurrent.futures.ThreadPoolExecutor] = attr.ib(init=False, default=None)
+    _engine: tp.Any = attr.ib(init=False, default=None)  # only accessed on worker thread
+    _pending: tp.Dict[str, concurrent.futures.Future] = attr.ib(init=False, factory=dict)
+    _pendingLock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self):
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def prefetch(self, texts: tp.Iterable[str]):
+        """
+        Start rendering any of texts not already cached, without blocking.
+        """
+        for text in texts:
+            self.get(text)
+
+    def get(self, text: str) -> concurrent.futures.Future:
+        """
+        Returns a future for the path of the rendered utterance, which is already done if
+        rendered earlier (in this or a previous session).
+        """
+        with self._pendingLock:
+            future = self._pending.get(text, None)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, initializer=self._initWorker,
+                                                                       thread_name_prefix='SpeechCache')
+            future = self._executor.submit(self._render, text)
+            self._pending[text] = future
+            return future
+
+    def getPath(self, text: str, timeout: tp.Optional[float] = None) -> str:
+        return self.get(text).result(timeout=timeout)
+
+    def close(self, doCancelPending: bool = True):
+        """
+        If not doCancelPending, renders already requested still finish, without waiting for them here.
+        """
+        if self._executor is not None:
+            if doCancelPending:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+        with self._pendingLock:
+            self._pending.clear()
+
+    def _initWorker(self):
+        try:
+            import pythoncom
+        except ImportError:
+            pythoncom = None  # not on Windows
+        if pythoncom is not None:
+            pythoncom.CoInitialize()  # single-threaded apartment, for SAPI
+        # engine itself is created when first needed, so that a cache hit doesn't require one
+
+    def _getEngine(self):
+        if self._engine is None:
+            self._engine = self.engineFactory()
+            if self.voice is not None:
+                self._engine.setProperty('voice', self.voice)
+            if self.rate is not None:
+                self._engine.setProperty('rate', self.rate)
+        return self._engine
+
+    def _getPathFor(self, text: str) -> str:
+        # key on requested settings rather than engine defaults, so no engine is needed to find cached files
+        key = hashlib.sha1(('%s\n%s\n%s' % (self.voice, self.rate, text)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cacheDir, key + '.wav')
+
+    def _render(self, text: str) -> str:
+        path = self._getPathFor(text)
+        if os.path.exists(path):
+            return path
+
+        startTime = time.perf_counter()
+        tmpPath = path[:-len('.wav')] + '.tmp.wav'
+        engine = self._getEngine()
+        engine.save_to_file(text, tmpPath)
+        engine.runAndWait()
+        if not os.path.exists(tmpPath) or os.path.getsize(tmpPath) == 0:
+            raise RuntimeError('Text-to-speech engine did not render \'%s\'' % (text,))
+        os.replace(tmpPath, path)  # so that a partially written file is never mistaken for a cached one
+        logger.debug('Rendered \'%s\' in %.1f ms' % (text, (time.perf_counter() - startTime) * 1e3))
+        return path
@@ -0,0 +1,148 @@
+import collections
+import concurrent.futures
+import logging
+import typing as tp
+
+import attr
+from qtpy import QtCore
+
+from ExperimentAutomator.AudioControl import AudioPlayer, CueRecord
+from ExperimentAutomator.Misc import exceptionToStr
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class Utterance:
+    text: str
+    record: tp.Optional[CueRecord] = None
+    isFinished: bool = False
+    wasCancelled: bool = False
+
+
+class SpeechQueue(QtCore.QObject):
+    """
+    Speaks queued utterances one after another, without blocking the caller.
+
+    Each utterance is rendered (by renderFn, typically on a background thread, and usually well
+    before its turn) and then played through AudioPlayer's speech backend, separate from audio cues. If rendering fails, the utterance is
+    synthesized live instead, which blocks until it has been spoken.
+    """
+
+    sigUtteranceFinished = QtCore.Signal(object)  # emits Utterance, whether spoken completely or not
+    sigIdle = QtCore.Signal()  # emitted when the last queued utterance finishes
+
+    _sigRendered = QtCore.Signal(object)  # emits Utterance, from rendering thread
+
+    def __init__(self, renderFn: tp.Callable[[str], concurrent.futures.Future],
+                 parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self._renderFn = renderFn
+        self._queue: tp.Deque[Utterance] = collections.deque()
+        self._current: tp.Optional[Utterance] = None
+        self._futures: tp.Dict[Utterance, concurrent.futures.Future] = dict()
+        self._sigRendered.connect(self._onRendered, QtCore.Qt.QueuedConnection)
+        self._isConnectedToPlayer = False
+
+    @property
+    def isIdle(self) -> bool:
+        return self._current is None and len(self._queue) == 0
+
+    @property
+    def numQueued(self) -> int:
+        return len(self._queue) + (0 if self._current is None else 1)
+
+    def enqueue(self, text: str) -> Utterance:
+        utterance = Utterance(text=text)
+        self._futures[utterance] = self._renderFn(text)  # start rendering now, even if not yet its turn
+        self._queue.append(utterance)
+        if self._current is None:
+            self._playNext()
+        return utterance
+
+    def cancel(self, utterance: Utterance):
+        if utterance.isFinished:
+            return
+        if utterance is self._current:
+            if utterance.record is not None:
+                AudioPlayer().stopSpeech()  # triggers _onCueFinished
+                return
+            # still rendering
+            self._current = None
+        else:
+            self._queue.remove(utterance)
+        self._finish(utterance, wasCancelled=True)
+        if self._current is None:
+            self._playNext()
+
+    def stopAll(self):
+        while len(self._queue) > 0:
+            self._finish(self._queue.popleft(), wasCancelled=True)
+        if self._current is not None:
+            self.cancel(self._current)
+
+    def _playNext(self):
+        if len(self._queue) == 0:
+            self.sigIdle.emit()
+            return
+        utterance = self._current = self._queue.popleft()
+        future = self._futures[utterance]
+        if future.done():
+            self._onRendered(utterance)
+        else:
+            logger.debug('Waiting for \'%s\' to be rendered' % (utterance.text,))
+            future.add_done_callback(lambda future, utterance=utterance: self._sigRendered.emit(utterance))
+
+    def _onRendered(self, utterance: Utterance):
+        if utterance is not self._current:
+            return  # cancelled while rendering
+        try:
+            path = self._futures[utterance].result()
+        except Exception as e:
+            logger.warning('Unable to render speech, synthesizing live instead: %s' % (exceptionToStr(e),))
+            self._speakLiveInstead(utterance)
+            return
+
+        player = AudioPlayer()
+        try:
+            if not self._isConnectedToPlayer:
+                player.speechBackend.sigCueFinished.connect(self._onCueFinished)
+                self._isConnectedToPlayer = True
+            logger.debug('Speaking \'%s\'' % (utterance.text,))
+            utterance.record = player.playSpeech(path)
+        except Exception as e:
+            logger.warning('Unable to play rendered speech, synthesizing live instead: %s' % (exceptionToStr(e),))
+            self._speakLiveInstead(utterance)
+
+    def _speakLiveInstead(self, utterance: Utterance):
+        self._speakLive(utterance.text)
+        self._current = None
+        self._finish(utterance, wasCancelled=False)
+        self._playNext()
+
+    def _onCueFinished(self, record: CueRecord):
+        if self._current is None or record is not self._current.record:
+            return
+        utterance, self._current = self._current, None
+        self._finish(utterance, wasCancelled=record.wasInterrupted)
+        self._playNext()
+
+    def _finish(self, utterance: Utterance, wasCancelled: bool):
+        utterance.isFinished = True
+        utterance.wasCancelled = wasCancelled
+        self._futures.pop(utterance, None)
+        logger.debug('%s speaking \'%s\'' % ('Cancelled' if wasCancelled else 'Finished', utterance.text))
+        self.sigUtteranceFinished.emit(utterance)
+
+    @staticmethod
+    def _speakLive(text: str):
+        import pyttsx3
+        engine = pyttsx3.init()
+        engine.say(text)
+        engine.runAndWait()
+
+    def close(self):
+        self.stopAll()
+        if self._isConnectedToPlayer:
+            AudioPlayer().speechBackend.sigCueFinished.disconnect(self._onCueFinished)
+            self._isConnectedToPlayer = False
@@ -0,0 +1,3 @@
+from .SpeechCache import SpeechCache
+from .SpeechQueue import SpeechQueue, Utterance
+from .SpeakAction import Speaker, SpeakAction
@@ -0,0 +1,127 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import time
+import typing as tp
+
+from qtpy import QtCore, QtGui
+
+logger = logging.getLogger(__name__)
+
+
+class PixmapCache(QtCore.QObject):
+    """
+    LRU cache of decoded images, ready to be painted.
+
+    Images are decoded (the slow part) into QImages on a worker thread, and converted to QPixmaps
+    (which must happen on the GUI thread) once decoded. Cache size is bounded by total pixmap size.
+    """
+
+    _sigDecoded = QtCore.Signal(str, object)  # emits (path, QImage or None) from worker thread
+
+    def __init__(self, maxBytes: int, numWorkers: int = 2, parent: tp.Optional[QtCore.QObject] = None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self._maxBytes = maxBytes
+        self._numBytes = 0
+        self._pixmaps: tp.OrderedDict[str, QtGui.QPixmap] = collections.OrderedDict()
+        self._pending: tp.Dict[str, concurrent.futures.Future] = dict()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=numWorkers,
+                                                               thread_name_prefix='PixmapCacheDecode')
+        self._sigDecoded.connect(self._onDecoded, QtCore.Qt.QueuedConnection)
+
+    @staticmethod
+    def _normPath(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def __contains__(self, path: str) -> bool:
+        return self._normPath(path) in self._pixmaps
+
+    @property
+    def numBytes(self) -> int:
+        return self._numBytes
+
+    def setMaxBytes(self, maxBytes: int):
+        self._maxBytes = maxBytes
+        self._evict()
+
+    def preload(self, paths: tp.Iterable[str]):
+        """
+        Start decoding images in the background, without blocking.
+        """
+        for path in paths:
+            key = self._normPath(path)
+            if key in self._pixmaps:
+                self._pixmaps.move_to_end(key)
+            elif key not in self._pending:
+                self._pending[key] = self._executor.submit(self._decode, key)
+
+    def get(self, path: str) -> QtGui.QPixmap:
+        """
+        Returns pixmap for path, waiting for (or doing) decoding if not already cached.
+        """
+        key = self._normPath(path)
+        if key in self._pixmaps:
+            self._pixmaps.move_to_end(key)
+            return self._pixmaps[key]
+
+        startTime = time.perf_counter()
+        if key in self._pending:
+            image = self._pending[key].result()
+        else:
+            image = self._decode(key, doNotify=False)
+        if image is None:
+            raise ValueError('Unable to decode image %s' % (path,))
+        pixmap = self._insert(key, image)
+        logger.info('Image %s was not preloaded, took %.1f ms to decode' % (
+            os.path.basename(path), (time.perf_counter() - startTime) * 1e3))
+        return pixmap
+
+    def clear(self):
+        for future in self._pending.values():
+            future.cancel()  # decodes already running are dropped by _onDecoded
+        self._pending.clear()
+        self._pixmaps.clear()
+        self._numBytes = 0
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _decode(self, key: str, doNotify: bool = True) -> tp.Optional[QtGui.QImage]:
+        # may run on worker thread, so must not touch pixmaps (QImage is safe to use from any thread)
+        image = QtGui.QImage(key)
+        if image.isNull():
+            logger.error('Unable to decode image %s' % (key,))
+            image = None
+        else:
+            # convert now to the format pixmaps use, so the conversion on the GUI thread is cheap
+            image = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied if image.hasAlphaChannel()
+                                          else QtGui.QImage.Format_RGB32)
+        if doNotify:
+            self._sigDecoded.emit(key, image)
+        return image
+
+    def _onDecoded(self, key: str, image: tp.Optional[QtGui.QImage]):
+        if key not in self._pending:
+            return  # already inserted by get() or dropped by clear()
+        del self._pending[key]
+        if image is not None and key not in self._pixmaps:
+            self._insert(key, image)
+
+    def _insert(self, key: str, image: QtGui.QImage) -> QtGui.QPixmap:
+        self._pending.pop(key, None)
+        pixmap = QtGui.QPixmap.fromImage(image)
+        self._pixmaps[key] = pixmap
+        self._numBytes += self._pixmapBytes(pixmap)
+        self._evict()
+        return pixmap
+
+    def _evict(self):
+        # always keeps the most recently used pixmap
+        while self._numBytes > self._maxBytes and len(self._pixmaps) > 1:
+            _, evicted = self._pixmaps.popitem(last=False)
+            self._numBytes -= self._pixmapBytes(evicted)
+
+    @staticmethod
+    def _pixmapBytes(pixmap: QtGui.QPixmap) -> int:
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
@@ -0,0 +1,180 @@
+import typing as tp
+import attr
+import ast
+import logging
+import os
+import time
+
+from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.ExperimentActions import ExperimentAction, NoninterruptibleAction
+from ExperimentAutomator.Misc import Singleton
+from .PixmapCache import PixmapCache
+from .StimulusWindow import StimulusWindow, ShowRecord
+
+logger = logging.getLogger(__name__)
+
+_imageExtensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+
+@attr.s(auto_attribs=True)
+class StimulusPresenter(metaclass=Singleton):
+    """
+    Singleton owning the stimulus window and its pixmap cache.
+
+    If the images a table will show are known in advance (see setExpectedImages), upcoming images
+    are decoded in the background while earlier ones are shown.
+    """
+    _window: tp.Optional[StimulusWindow] = attr.ib(init=False, default=None)
+    _cache: tp.Optional[PixmapCache] = attr.ib(init=False, default=None)
+    _expectedPaths: tp.List[str] = attr.ib(init=False, factory=list)  # in table order
+    _iExpected: int = attr.ib(init=False, default=0)
+
+    def _getCache(self) -> PixmapCache:
+        if self._cache is None:
+            self._cache = PixmapCache(maxBytes=int(globalConfiguration.StimulusPixmapCacheMB * 2**20))
+        return self._cache
+
+    def _getWindow(self) -> StimulusWindow:
+        if self._window is None:
+            self._window = StimulusWindow()
+        if not self._window.isVisible():
+            self._window.showOnScreen(globalConfiguration.StimulusScreen)
+        return self._window
+
+    def onConfigurationChanged(self, keys: tp.Set[str]):
+        if self._cache is not None and 'StimulusPixmapCacheMB' in keys:
+            self._cache.setMaxBytes(int(globalConfiguration.StimulusPixmapCacheMB * 2**20))
+        if self._window is not None and self._window.isVisible() and 'StimulusScreen' in keys:
+            self._window.showOnScreen(globalConfiguration.StimulusScreen)
+
+    def showImage(self, path: str) -> ShowRecord:
+        requestTimeNs = time.perf_counter_ns()
+        pixmap = self._getCache().get(path)
+        record = self._getWindow().showPixmap(pixmap, description=os.path.basename(path), requestTimeNs=requestTimeNs)
+        self._preloadAhead(path)
+        return record
+
+    def showText(self, text: str) -> ShowRecord:
+        return self._getWindow().showText(text)
+
+    def clear(self) -> ShowRecord:
+        return self._getWindow().clear()
+
+    def preload(self, paths: tp.Iterable[str]):
+        self._getCache().preload(paths)
+
+    def setExpectedImages(self, paths: tp.Sequence[str]):
+        self._expectedPaths = list(paths)
+        self._iExpected = 0
+        if len(self._expectedPaths) > 0:
+            # warm up with the first images the table will show
+            self.preload(self._expectedPaths[:globalConfiguration.StimulusLookahead])
+
+    def _preloadAhead(self, path: str):
+        lookahead = globalConfiguration.StimulusLookahead
+        if lookahead == 0 or len(self._expectedPaths) == 0:
+            return
+        try:
+            self._iExpected = self._expectedPaths.index(path, self._iExpected)
+        except ValueError:
+            try:
+                # e.g. after jumping backwards in the table
+                self._iExpected = self._expectedPaths.index(path)
+            except ValueError:
+                return  # not known in advance
+        self.preload(self._expectedPaths[self._iExpected + 1:self._iExpected + 1 + lookahead])
+
+    @property
+    def showLog(self) -> tp.List[ShowRecord]:
+        return [] if self._window is None else self._window.showLog
+
+    def close(self):
+        if self._window is not None:
+            self._window.close()
+        if self._cache is not None:
+            self._cache.shutdown()
+            self._cache = None
+
+
+def _literalImagePath(argStr: str) -> tp.Optional[str]:
+    """
+    Returns the image path a table cell refers to if it can be determined without evaluating any
+    variables, else None.
+    """
+    try:
+        path = ast.literal_eval(argStr)
+    except (ValueError, SyntaxError):
+        path = argStr  # e.g. an unquoted path, which _evalStr falls back to
+    if not isinstance(path, str) or os.path.splitext(path)[1].lower() not in _imageExtensions:
+        return None
+    return path
+
+
+@attr.s(auto_attribs=True)
+class PresentAction(NoninterruptibleAction):
+    """
+    Show stimuli in a fullscreen window, e.g.:
+        image <path>
+        text <text>
+        clear
+        preload <path or list of paths>
+        close
+    """
+    key: tp.ClassVar[str] = 'present'
+    cmd: str = ''
+
+    def _start(self):
+        presenter = StimulusPresenter()
+        cmdAndArgs = self.cmd.split(' ', maxsplit=1)
+        cmd = cmdAndArgs[0]
+        args = cmdAndArgs[1:]
+
+        if cmd == 'image':
+            assert len(args) == 1
+            path = self._evalStr(args[0])
+            record = presenter.showImage(path)
+            if record.latency is not None:
+                logger.info('Presented %s (painted %.1f ms after request)' % (record.description, record.latency * 1e3))
+            else:
+                logger.info('Presented %s' % (record.description,))
+        elif cmd == 'text':
+            assert len(args) == 1
+            text = str(self._evalStr(args[0]))
+            presenter.showText(text)
+            logger.info('Presented text: %s' % (text,))
+        elif cmd == 'clear':
+            assert len(args) == 0
+            presenter.clear()
+            logger.info('Cleared stimulus window')
+        elif cmd == 'preload':
+            assert len(args) == 1
+            paths = self._evalStr(args[0])
+            if isinstance(paths, str):
+                paths = [paths]
+            presenter.preload(paths)
+            logger.info('Preloading %d images' % (len(paths),))
+        elif cmd == 'close':
+            assert len(args) == 0
+            presenter.close()
+            logger.info('Closed stimulus window')
+        else:
+            raise NotImplementedError()
+
+        self._onStop()
+
+    @classmethod
+    def fromString(cls, s: str, **kwargs):
+        return cls(cmd=s, **kwargs)
+
+    @classmethod
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        # note images the table will show, in order, so upcoming ones can be preloaded
+        paths = []
+        for argStr in argStrs:
+            cmdAndArgs = argStr.split(' ', maxsplit=1)
+            if cmdAndArgs[0] != 'image' or len(cmdAndArgs) < 2:
+                continue
+            path = _literalImagePath(cmdAndArgs[1])
+            if path is not None:
+                paths.append(path)
+        StimulusPresenter().setExpectedImages(paths)
@@ -0,0 +1,104 @@
+import logging
+import time
+import typing as tp
+
+import attr
+from qtpy import QtCore, QtGui, QtWidgets
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class ShowRecord:
+    description: str
+    requestTimeNs: int  # time.perf_counter_ns() when show was requested
+    paintTimeNs: tp.Optional[int] = None  # time.perf_counter_ns() when painting the stimulus finished
+
+    @property
+    def latency(self) -> tp.Optional[float]:
+        if self.paintTimeNs is None:
+            return None
+        return (self.paintTimeNs - self.requestTimeNs) / 1e9
+
+
+class StimulusWindow(QtWidgets.QWidget):
+    """
+    Frameless window showing one image or text at a time on a plain background.
+
+    Each show is painted immediately (rather than at the next event loop iteration), and the
+    time painting finished is recorded. Note that this does not include any delay until the
+    compositor and display actually present the frame.
+    """
+
+    sigShown = QtCore.Signal(object)  # emits ShowRecord
+
+    def __init__(self,
+                 backgroundColor: str = 'black',
+                 textColor: str = 'white',
+                 textPointSize: int = 48,
+                 parent: tp.Optional[QtWidgets.QWidget] = None):
+        QtWidgets.QWidget.__init__(self, parent=parent)
+        self.setWindowTitle('Stimulus')
+        self.setWindowFlags(self.windowFlags() | QtCore.Qt.FramelessWindowHint)
+        self.setAttribute(QtCore.Qt.WA_OpaquePaintEvent)  # painting the whole window anyway, so skip erasing it
+        self.setCursor(QtCore.Qt.BlankCursor)
+
+        self._backgroundColor = QtGui.QColor(backgroundColor)
+        self._textColor = QtGui.QColor(textColor)
+        self._font = QtGui.QFont()
+        self._font.setPointSize(textPointSize)
+
+        self._pixmap: tp.Optional[QtGui.QPixmap] = None
+        self._text: tp.Optional[str] = None
+        self._pendingRecord: tp.Optional[ShowRecord] = None
+        self.showLog: tp.List[ShowRecord] = []
+
+    def showOnScreen(self, screenIndex: int = -1):
+        screens = QtGui.QGuiApplication.screens()
+        screen = screens[screenIndex] if -len(screens) <= screenIndex < len(screens) else screens[-1]
+        self.setGeometry(screen.geometry())
+        self.showFullScreen()
+
+    def showPixmap(self, pixmap: QtGui.QPixmap, description: str, requestTimeNs: tp.Optional[int] = None) -> ShowRecord:
+        self._pixmap, self._text = pixmap, None
+        return self._repaintNow(description, requestTimeNs)
+
+    def showText(self, text: str, requestTimeNs: tp.Optional[int] = None) -> ShowRecord:
+        self._pixmap, self._text = None, text
+        return self._repaintNow('text: %s' % (text,), requestTimeNs)
+
+    def clear(self, requestTimeNs: tp.Optional[int] = None) -> ShowRecord:
+        self._pixmap, self._text = None, None
+        return self._repaintNow('clear', requestTimeNs)
+
+    def _repaintNow(self, description: str, requestTimeNs: tp.Optional[int]) -> ShowRecord:
+        record = ShowRecord(description=description,
+                            requestTimeNs=time.perf_counter_ns() if requestTimeNs is None else requestTimeNs)
+        self._pendingRecord = record
+        if self.isVisible():
+            self.repaint()  # synchronous, unlike update()
+        self.showLog.append(record)
+        if record.paintTimeNs is not None:
+            self.sigShown.emit(record)
+        return record
+
+    def paintEvent(self, event: QtGui.QPaintEvent):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), self._backgroundColor)
+        if self._pixmap is not None and not self._pixmap.isNull():
+            # scale to fit, keeping aspect ratio
+            size = self._pixmap.size().scaled(self.size(), QtCore.Qt.KeepAspectRatio)
+            if size.width() >= self._pixmap.width() and size.height() >= self._pixmap.height():
+                size = self._pixmap.size()  # don't upscale
+            targetRect = QtCore.QRect(QtCore.QPoint(0, 0), size)
+            targetRect.moveCenter(self.rect().center())
+            painter.drawPixmap(targetRect, self._pixmap)
+        elif self._text is not None:
+            painter.setPen(self._textColor)
+            painter.setFont(self._font)
+            painter.drawText(self.rect(), QtCore.Qt.AlignCenter | QtCore.Qt.TextWordWrap, self._text)
+        painter.end()
+
+        if self._pendingRecord is not None:
+            self._pendingRecord.paintTimeNs = time.perf_counter_ns()
+            self._pendingRecord = None
@@ -0,0 +1,3 @@
+from .PixmapCache import PixmapCache
+from .StimulusWindow import StimulusWindow
+from .PresentAction import StimulusPresenter, PresentAction
@@ -0,0 +1,197 @@
+"""
+Local stand-in for VLC's telnet remote control interface, for exercising VLCRemote and
+VLCTelnetClient without VLC (e.g. on a development machine or in automated checks).
+
+Implements the subset of VLC 3's telnet commands used by ExperimentAutomator, with replies in
+the same format, but does not play anything.
+"""
+import logging
+import os
+import socketserver
+import threading
+import time
+import typing as tp
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+_prompt = b'> '
+_iacWillEcho = bytes((255, 251, 1))
+_iacWontEcho = bytes((255, 252, 1))
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+@attr.s(auto_attribs=True, eq=False)
+class FakeVLCTelnetServer:
+    password: str = 'password'
+    port: int = 0  # 0 to pick a free port; actual port available as .port after start()
+    replyDelay: float = 0.  # in s, to simulate a slow player
+
+    state: str = attr.ib(init=False, default='stopped')
+    volume: int = attr.ib(init=False, default=256)
+    repeat: bool = attr.ib(init=False, default=False)
+    playlist: tp.List[tp.Tuple[int, str]] = attr.ib(init=False, factory=list)  # (item id, path)
+    currentItemId: tp.Optional[int] = attr.ib(init=False, default=None)
+    commandLog: tp.List[str] = attr.ib(init=False, factory=list)
+
+    _nextItemId: int = attr.ib(init=False, default=4)  # like VLC, ids 1-3 are used by the playlist tree itself
+    _server: tp.Optional[socketserver.ThreadingTCPServer] = attr.ib(init=False, default=None)
+    _thread: tp.Optional[threading.Thread] = attr.ib(init=False, default=None)
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    def start(self):
+        fake = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake._handleConnection(self.rfile, self.wfile)
+
+        self._server = _ThreadingTCPServer(('localhost', self.port), _Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True,
+                                        name='FakeVLCTelnetServer')
+        self._thread.start()
+        logger.debug('Fake VLC telnet server listening on port %d' % (self.port,))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _handleConnection(self, rfile, wfile):
+        wfile.write(b'VLC media player 3.0.0 Vetinari\r\nPassword: ' + _iacWillEcho)
+        wfile.flush()
+        password = rfile.readline().decode('utf-8').rstrip('\r\n')
+        if password != self.password:
+            wfile.write(_iacWontEcho + b'\r\nWrong password\r\nPassword: ')
+            wfile.flush()
+            return
+        wfile.write(_iacWontEcho + b'\r\nWelcome, Master\r\n' + _prompt)
+        wfile.flush()
+
+        while True:
+            line = rfile.readline()
+            if len(line) == 0:
+                return
+            cmdLine = line.decode('utf-8').rstrip('\r\n')
+            if self.replyDelay > 0:
+                time.sleep(self.replyDelay)
+            with self._lock:
+                self.commandLog.append(cmdLine)
+                reply, doContinue = self._handleCommand(cmdLine)
+            if not doContinue:
+                wfile.write(reply.encode('utf-8'))
+                wfile.flush()
+                return
+            wfile.write(reply.encode('utf-8') + _prompt)
+            wfile.flush()
+
+    def _handleCommand(self, cmdLine: str) -> tp.Tuple[str, bool]:
+        """
+        Returns (reply, whether to keep the connection open).
+        """
+        if ' ' in cmdLine:
+            cmd, arg = cmdLine.split(' ', maxsplit=1)
+        else:
+            cmd, arg = cmdLine, ''
+
+        if cmd == '':
+            return '', True
+        elif cmd == 'status':
+            reply = ''
+            if self.currentItemId is not None:
+                reply += '( new input: %s )\r\n' % (self._uriFor(self._currentPath()),)
+            reply += '( audio volume: %d )\r\n' % (self.volume,)
+            reply += '( state %s )\r\n' % (self.state,)
+            return reply, True
+        elif cmd == 'volume':
+            if len(arg) == 0:
+                return '%d\r\n' % (self.volume,), True
+            self.volume = int(float(arg))
+            return '', True
+        elif cmd == 'play':
+            if self.currentItemId is None and len(self.playlist) > 0:
+                self.currentItemId = self.playlist[0][0]
+            if self.currentItemId is not None:
+                self.state = 'playing'
+            return '', True
+        elif cmd == 'pause':
+            # toggles, like VLC
+            if self.state == 'playing':
+                self.state = 'paused'
+            elif self.state == 'paused':
+                self.state = 'playing'
+            return '', True
+        elif cmd == 'stop':
+            self.state = 'stopped'
+            return '', True
+        elif cmd == 'clear':
+            self.playlist.clear()
+            self.currentItemId = None
+            self.state = 'stopped'
+            return '', True
+        elif cmd in ('enqueue', 'add'):
+            itemId = self._nextItemId
+            self._nextItemId += 1
+            self.playlist.append((itemId, arg))
+            if cmd == 'add':
+                self.currentItemId = itemId
+                self.state = 'playing'
+            return '', True
+        elif cmd in ('goto', 'gotoitem'):
+            itemId = int(arg)
+            if itemId not in [item[0] for item in self.playlist]:
+                return '', True  # VLC silently ignores unknown items
+            self.currentItemId = itemId
+            self.state = 'playing'
+            return '', True
+        elif cmd == 'playlist':
+            reply = '+----[ Playlist - playlist ]\r\n'
+            reply += '| 1 - Playlist\r\n'
+            for itemId, path in self.playlist:
+                marker = '*' if itemId == self.currentItemId else ' '
+                reply += '| %s %d - %s (00:00:05) [played 0 times]\r\n' % (marker, itemId, os.path.basename(path))
+            reply += '| 2 - Media Library\r\n'
+            reply += '+----[ End of playlist ]\r\n'
+            return reply, True
+        elif cmd == 'repeat':
+            self.repeat = arg != 'off'
+            return '', True
+        elif cmd == 'logout':
+            return 'Bye-bye!\r\n', False
+        elif cmd in ('shutdown', 'quit'):
+            self.state = 'stopped'
+            return 'Shutting down.\r\n', False
+        else:
+            return 'Unknown command `%s\'. Type `help\' for help.\r\n' % (cmd,), True
+
+    def _currentPath(self) -> str:
+        for itemId, path in self.playlist:
+            if itemId == self.currentItemId:
+                return path
+        raise KeyError(self.currentItemId)
+
+    @staticmethod
+    def _uriFor(path: str) -> str:
+        return 'file:///' + path.replace('\\', '/').lstrip('/')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s.%(msecs)03d %(filename)20s %(lineno)4d %(levelname)5s: %(message)s',
+                        datefmt='%H:%M:%S')
+
+    server = FakeVLCTelnetServer(port=4212)
+    server.start()
+    print('Fake VLC telnet server listening on port %d with password %r' % (server.port, server.password))
+    try:
+        while True:
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        server.stop()
@@ -2,36 +2,28 @@ import typing as tp
 import attr
 import logging
 import time
+import ast
 
 from ExperimentAutomator.ExperimentActions import ExperimentAction, NoninterruptibleAction
-from . import VLCRemote
-from ExperimentAutomator.Misc import Singleton
+from .VLCRemote import VLCRemote
+from .VLCInstancePool import VLCInstancePool
 
 logger = logging.getLogger(__name__)
 
 
 
-@attr.s(auto_attribs=True)
-class _VLCRemoteManager(metaclass=Singleton):
-    """
-    Singleton class to manage potentially multiple VLC instances each with their own remote.
+def _literalInstanceKey(keyStr: str) -> str | int | None:
     """
-    _remotes: dict[str | None, VLCRemote] = attr.ib(init=False, factory=dict)
-
-    def __attrs_post_init__(self):
-        pass
-
-    def hasRemote(self, key: str) -> bool:
-        return key in self._remotes
+    Returns the instance key a table cell refers to if it is a quoted string or a number, else None.
 
-    def getRemote(self, key: str | None = None) -> VLCRemote:
-        if key not in self._remotes:
-            port = 4212 + len(self._remotes)
-            logger.debug(f'Instantiating VLCRemote {key} on port {port}')
-            self._remotes[key] = VLCRemote(playerTitle=key, 
-                                           telnetPort=port)
-
-        return self._remotes[key]
+    Bare names are not treated as literal keys, since they may refer to a variable assigned
+    earlier in the table (_evalStr only falls back to the string itself if no such variable exists).
+    """
+    try:
+        key = ast.literal_eval(keyStr)
+    except (ValueError, SyntaxError):
+        return None
+    return key if isinstance(key, (str, int)) and not isinstance(key, bool) else None
 
 
 @attr.s(auto_attribs=True)
@@ -39,7 +31,7 @@ class VLCControlAction(NoninterruptibleAction):
     key: tp.ClassVar[str] = 'VLC'
     cmd: str = ''
 
-    _remoteManager: _VLCRemoteManager = attr.ib(init=False, factory=_VLCRemoteManager)
+    _pool: VLCInstancePool = attr.ib(init=False, factory=VLCInstancePool)
     _vlc: VLCRemote | None = attr.ib(init=False, default=None)
 
     def __attrs_post_init__(self):
@@ -54,14 +46,14 @@ class VLCControlAction(NoninterruptibleAction):
             # first arg is an instanceKey (or variable / statement without spaces referring to an instanceKey) referencing a specific player instance
             instanceKey = self._evalStr(args[0])
             logger.info(f'Operating on VLC instance {instanceKey}')
-            vlc = self._remoteManager.getRemote(key=instanceKey)
+            vlc = self._pool.getRemote(key=instanceKey)
             cmd = args[1]  # next arg is command to apply to specified instance
             args = args[2:]  # everything else is args for the command
             
         else:
             # get default instance
             logger.info('Operating on default VLC instance')
-            vlc = self._remoteManager.getRemote()
+            vlc = self._pool.getRemote()
 
         if cmd in ('play', 'pause', 'enableRepeat'):
             assert len(args)==0
@@ -76,6 +68,16 @@ class VLCControlAction(NoninterruptibleAction):
             filepath = self._evalStr(args[0])
             vlc.load(filepath)
             logger.info('VLC loaded %s' % filepath)
+        elif cmd == 'playlist':
+            # arg should be a list of filepaths (or a variable containing such a list) to load up front
+            filepaths = self._evalStr(' '.join(args))
+            if isinstance(filepaths, str):
+                filepaths = [filepaths]
+            vlc.loadPlaylist(filepaths)
+        elif cmd == 'playItem':
+            # arg should be an index into (or a filepath in) the loaded playlist, or a variable containing either
+            item = self._evalStr(' '.join(args))
+            vlc.playItem(item)
         elif cmd == 'getVolume':
             assert len(args)==1
             # arg should be a variable name to which to save volume
@@ -102,6 +104,23 @@ class VLCControlAction(NoninterruptibleAction):
     def fromString(cls, s: str, **kwargs):
         return cls(cmd=s, **kwargs)
 
+    @classmethod
+    def prepareForTable(cls, argStrs: tp.List[str]):
+        # note instances referred to by the table so they can all be launched together on first use
+        keys = []
+        for argStr in argStrs:
+            cmdAndArgs = argStr.split(' ')
+            if cmdAndArgs[0] == 'instance':
+                if len(cmdAndArgs) < 2:
+                    continue
+                key = _literalInstanceKey(cmdAndArgs[1])
+                if key is None:
+                    continue  # depends on variables, so will only be launched when first used
+            else:
+                key = None  # default instance
+            keys.append(key)
+        VLCInstancePool().expectInstances(keys)
+
 
 
 
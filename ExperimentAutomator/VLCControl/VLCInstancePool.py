@@ -0,0 +1,109 @@
+import concurrent.futures
+import logging
+import socket
+import typing as tp
+
+import attr
+
+from ExperimentAutomator.Misc import Singleton
+from .VLCRemote import VLCRemote
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True)
+class VLCInstancePool(metaclass=Singleton):
+    """
+    Singleton managing potentially multiple VLC instances, each with their own remote and telnet port.
+
+    Instances the experiment table is known to refer to (see `expectInstances`) are all launched
+    concurrently on first use, rather than one after another as each is first needed.
+    """
+    _firstPort: int = 4212
+    _maxPortsToTry: int = 1000
+    _remoteFactory: tp.Callable[..., VLCRemote] = VLCRemote  # called with playerTitle and telnetPort
+
+    _remotes: dict[str | None, VLCRemote] = attr.ib(init=False, factory=dict)
+    _expectedKeys: dict[str | None, None] = attr.ib(init=False, factory=dict)  # used as an ordered set
+    _failedKeys: set[str | None] = attr.ib(init=False, factory=set)  # not launched in advance again after failing
+    _reservedPorts: set[int] = attr.ib(init=False, factory=set)
+
+    def expectInstances(self, keys: tp.Iterable[str | None]):
+        for key in keys:
+            self._expectedKeys[key] = None
+
+    def hasRemote(self, key: str | None) -> bool:
+        return key in self._remotes
+
+    def getRemote(self, key: str | None = None) -> VLCRemote:
+        if key in self._remotes:
+            self._remotes[key].ensureHealthy()
+            return self._remotes[key]
+
+        keys = [key] + [otherKey for otherKey in self._expectedKeys
+                        if otherKey != key and otherKey not in self._remotes and otherKey not in self._failedKeys]
+        errors = self._launch(keys)
+        if key in errors:
+            raise errors[key]
+        return self._remotes[key]
+
+    def _launch(self, keys: tp.List[str | None]) -> tp.Dict[str | None, Exception]:
+        # allocate ports up front (not in the worker threads) so that no two instances get the same port
+        ports = {key: self._allocatePort() for key in keys}
+        logger.info('Launching %d VLC instance(s): %s' % (
+            len(keys), ', '.join('%s on port %d' % (key, port) for key, port in ports.items())))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(keys), thread_name_prefix='VLCLaunch') as executor:
+            futures = {key: executor.submit(self._remoteFactory, playerTitle=key, telnetPort=port)
+                       for key, port in ports.items()}
+
+        errors = dict()
+        for key, future in futures.items():
+            try:
+                self._remotes[key] = future.result()
+            except Exception as e:
+                logger.error('Unable to launch VLC instance %s: %s' % (key, e))
+                errors[key] = e
+                self._failedKeys.add(key)
+                self._reservedPorts.discard(ports[key])
+            else:
+                self._failedKeys.discard(key)
+        return errors
+
+    def _allocatePort(self) -> int:
+        for port in range(self._firstPort, self._firstPort + self._maxPortsToTry):
+            if port in self._reservedPorts:
+                continue
+            if not self._isPortFree(port):
+                logger.debug('Port %d already in use, skipping' % (port,))
+                continue
+            self._reservedPorts.add(port)
+            return port
+        raise RuntimeError('No free port for VLC telnet interface in range %d-%d' % (
+            self._firstPort, self._firstPort + self._maxPortsToTry - 1))
+
+    @staticmethod
+    def _isPortFree(port: int) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind(('', port))
+            except OSError:
+                return False
+        return True
+
+    def shutdown(self, timeout: float = 2.):
+        """
+        Shut down all instances concurrently.
+        """
+        if len(self._remotes) == 0:
+            return
+        logger.info('Shutting down %d VLC instance(s)' % (len(self._remotes),))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self._remotes), thread_name_prefix='VLCShutdown') as executor:
+            futures = {key: executor.submit(remote.shutdown, timeout=timeout) for key, remote in self._remotes.items()}
+        for key, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error('Error while shutting down VLC instance %s: %s' % (key, e))
+        self._remotes.clear()
+        self._reservedPorts.clear()
@@ -1,44 +1,125 @@
 import os
-import sys
+import re
 import subprocess
 import typing as tp
 import attr
 import random, string
 import logging
-if sys.version_info >= (3, 13):
-    from telnetlib3 import Telnet
-else:
-    from telnetlib import Telnet
 import time
+import urllib.parse
 
 logger = logging.getLogger(__name__)
 
 from ExperimentAutomator.Configuration import globalConfiguration
+from ExperimentAutomator.Misc import waitUntilReady
+from ExperimentAutomator.ProcessSupervisor import ProcessSupervisor
+from .VLCTelnetClient import VLCTelnetClient, VLCTelnetError
+
+_stateRegex = re.compile(r'\( state (\w+) \)')
+_inputRegex = re.compile(r'\( new input: (.*) \)')
+# e.g. '|   4 - clip.wav (00:00:05) [played 0 times]', with '*' before the id of the current item
+_playlistEntryRegex = re.compile(r'^\|([ *]+)(\d+) - (.*?)\s*$')  # first group's length indicates depth
+
+
+def _uriToPath(uri: str) -> str:
+    if uri.startswith('file://'):
+        uri = urllib.parse.unquote(urllib.parse.urlparse(uri).path)
+        if re.match(r'^/[A-Za-z]:/', uri):
+            uri = uri[1:]  # Windows drive path
+    return os.path.normpath(uri)
 
 
 @attr.s(auto_attribs=True)
 class VLCRemote:
+    # queries that are safe to resend if it's unknown whether VLC received them (plus get_*)
+    _idempotentCommands: tp.ClassVar[tp.Tuple[str, ...]] = ('status', 'playlist', 'volume', 'is_playing')
+
     _telnetPort: int = 4212
     _telnetPassword: str = ''
     _playerTitle: str | None = None
+    _doLaunch: bool = True  # set False to connect to an already running instance (e.g. FakeVLCTelnetServer)
+
+    _connectTimeout: float = 10.  # in s, to allow for VLC still starting up
+    _statusPollInterval: float = 0.005  # in s, between status queries while waiting for VLC to switch items
 
-    _telnet: Telnet = attr.ib(init=False)
+    _telnet: VLCTelnetClient = attr.ib(init=False)
     _proc: subprocess.Popen = attr.ib(init=False, default=None)
+    _playlist: tp.List[str] | None = attr.ib(init=False, default=None)  # paths loaded with loadPlaylist
+    _playlistItemIds: tp.List[int] | None = attr.ib(init=False, default=None)  # VLC's ids for the same items
 
     def __attrs_post_init__(self):
         if len(self._telnetPassword) == 0:
             self._telnetPassword = ''.join(random.choices(
                 string.ascii_letters + string.digits, k=16))
 
-        self.launchVLC()
+        if self._doLaunch:
+            self.launchVLC()
+
+        self._telnet = VLCTelnetClient(host='localhost', port=self._telnetPort)
+        self._connect()
+
+    @property
+    def telnetPort(self) -> int:
+        return self._telnetPort
+
+    @property
+    def isProcessAlive(self) -> bool:
+        # if not launched by us, can't tell, so rely on the telnet connection instead
+        return self._proc is None or self._proc.poll() is None
+
+    def _connect(self):
+        self._telnet.close()
+
+        def tryConnect() -> bool:
+            if not self.isProcessAlive:
+                raise RuntimeError('VLC exited with code %s before accepting telnet connection' % (self._proc.returncode,))
+            self._telnet.connect(password=self._telnetPassword)
+            return True
+
+        # VLC may not have opened its telnet port yet
+        waitUntilReady(tryConnect, description='VLC telnet interface on port %d' % (self._telnetPort,),
+                       timeout=self._connectTimeout, retryOn=(ConnectionRefusedError,))
+
+    def ensureHealthy(self):
+        """
+        Relaunch VLC if its process exited (e.g. crashed or was closed by the user), or reconnect
+        if only the telnet connection was lost.
+        """
+        if not self.isProcessAlive:
+            logger.warning('VLC instance %s exited with code %s, relaunching' % (
+                self._playerTitle, self._proc.returncode))
+            self._telnet.close()
+            self.launchVLC()
+            self._connect()
+        elif not self._telnet.isConnected:
+            logger.warning('Lost telnet connection to VLC instance %s, reconnecting' % (self._playerTitle,))
+            self._connect()
 
-        self._telnet = Telnet(
-            host='localhost',
-            port=self._telnetPort,
-        )
+    def shutdown(self, timeout: float = 2.):
+        """
+        Ask VLC to quit, then terminate (and if necessary kill) it if it hasn't exited after timeout.
+        """
+        if self._telnet.isConnected:
+            try:
+                self._telnet.sendWithoutReply('shutdown')
+            except OSError:
+                pass
+            self._telnet.close()
+        if self._proc is not None:
+            self._terminateProcess(timeout=timeout)
 
-        self._telnet.read_until(b'Password: ')
-        self._sendCommand(self._telnetPassword)
+    def _terminateProcess(self, timeout: float):
+        proc = self._proc
+        self._proc = None
+        if proc.poll() is not None:
+            return
+        try:
+            proc.wait(timeout=timeout)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+        report = ProcessSupervisor().terminate([proc], gracePeriod=timeout)
+        logger.warning('VLC instance %s did not exit by itself: %s' % (self._playerTitle, report))
 
     def launchVLC(self):
         args = [globalConfiguration.VLCPath,
@@ -49,18 +130,25 @@ class VLCRemote:
             args.extend(['--meta-title', self._playerTitle])  # TODO: check that this escapes spaces correctly
 
         if self._proc is not None:
-            raise NotImplementedError  # TODO: terminate previous proc before launching new one
+            self._terminateProcess(timeout=0.)
 
-        self._proc = subprocess.Popen(args)
-        logger.info('Launched VLC')
+        self._proc = subprocess.Popen(args, **ProcessSupervisor.popenKwargs())
+        ProcessSupervisor().register(self._proc, description='VLC %s' % (self._playerTitle or self._telnetPort,))
+        logger.info('Launched VLC on telnet port %d' % (self._telnetPort,))
 
-    def _sendCommand(self, cmd: str):
-        self._telnet.write(cmd.encode('ascii') + b'\n')
-
-    def _getResponseToCommand(self, cmd: str):
-        self._telnet.read_until('<dummy>'.encode('ascii'), timeout=0.1)
-        self._sendCommand(cmd)
-        return self._telnet.read_until('<dummy>'.encode('ascii'), timeout=0.1).decode('ascii')
+    def _sendCommand(self, cmd: str) -> str:
+        # always read the reply (even if empty) so the next command's reply isn't mixed up with this one's
+        try:
+            return self._telnet.command(cmd)
+        except (ConnectionError, VLCTelnetError) as e:
+            # e.g. 'pause' toggles and 'enqueue' appends, so only queries are repeated
+            if cmd not in self._idempotentCommands and not cmd.startswith('get_'):
+                logger.warning('VLC command %r failed (%s), not retrying since it may have taken effect' % (cmd, e))
+                self.ensureHealthy()  # so that later commands work
+                raise
+            logger.warning('VLC command %r failed (%s), retrying once' % (cmd, e))
+            self.ensureHealthy()
+            return self._telnet.command(cmd)
 
     def play(self):
         self._sendCommand('play')
@@ -73,23 +161,28 @@ class VLCRemote:
         else:
             pass # do nothing, already paused
 
+    def getState(self) -> str:
+        resp = self._sendCommand('status')
+        match = _stateRegex.search(resp)
+        if match is None:
+            raise NotImplementedError('Unexpected status response: %r' % (resp,))
+        return match.group(1)
+
     def isPlaying(self) -> bool:
-        resp = self._getResponseToCommand('status')
-        if 'state paused' in resp:
+        state = self.getState()
+        if state in ('paused', 'stopped'):
             return False
-        elif 'state stopped' in resp:
-            return False
-        elif 'state playing' in resp:
+        elif state == 'playing':
             return True
         else:
             raise NotImplementedError()
-        
+
     def getVolume(self) -> float:
         """
         Returns value >= 0, where 1.0 is 100% volume in VLC. Note that volume can be set to higher than 100%.
         """
-        resp = self._getResponseToCommand('volume')[:-2].strip()
-        volume = int(resp)
+        resp = self._sendCommand('volume').strip()
+        volume = int(round(float(resp)))
         volume = volume / 256.0  # 256 (not 255?) corresponds to 100% volume
         return volume
         
@@ -112,6 +205,7 @@ class VLCRemote:
     def load(self, filepath: str):
         assert os.path.exists(filepath)
         self._sendCommand('clear')  # clear previous play item(s)
+        self._playlist = None
         filepath = os.path.normpath(filepath)
         self._sendCommand('enqueue %s' % filepath)
         self.pause()
@@ -119,8 +213,85 @@ class VLCRemote:
     def loadAndPlay(self, filepath: str):
         assert os.path.exists(filepath)
         self._sendCommand('clear') # clear previous play item(s)
+        self._playlist = None
         self._sendCommand('add %s' % filepath)
 
+    def loadPlaylist(self, filepaths: tp.Sequence[str]):
+        """
+        Enqueue all files up front, so that later switching among them with playItem doesn't
+        involve clearing and re-enqueueing.
+        """
+        filepaths = [os.path.normpath(filepath) for filepath in filepaths]
+        for filepath in filepaths:
+            assert os.path.exists(filepath), 'File not found: %s' % (filepath,)
+
+        self._sendCommand('clear')
+        self._playlist = None
+        for filepath in filepaths:
+            self._sendCommand('enqueue %s' % filepath)
+
+        itemIds = self._getPlaylistItemIds()
+        if len(itemIds) != len(filepaths):
+            raise RuntimeError('Expected %d items in VLC playlist but found %d' % (len(filepaths), len(itemIds)))
+        self._playlist = filepaths
+        self._playlistItemIds = itemIds
+        logger.info('Loaded playlist of %d items' % (len(filepaths),))
+
+    def _getPlaylistItemIds(self) -> tp.List[int]:
+        """
+        Returns ids of the items in VLC's playlist node, in order.
+
+        The playlist node is identified as the first top-level node (followed by e.g. the media
+        library), rather than by its name, which is localized.
+        """
+        itemIds = []
+        playlistIndent = None
+        for line in self._sendCommand('playlist').splitlines():
+            match = _playlistEntryRegex.match(line)
+            if match is None:
+                continue
+            indent = len(match.group(1))
+            itemId = int(match.group(2))
+            if playlistIndent is None:
+                playlistIndent = indent
+            elif indent > playlistIndent:
+                itemIds.append(itemId)
+            else:
+                break  # e.g. reached 'Media Library' node
+        return itemIds
+
+    def playItem(self, item: int | str, timeout: float = 2.) -> float:
+        """
+        Switch to and play an item loaded with loadPlaylist, specified by index or path.
+
+        Returns latency in s from sending the command until VLC reports playing the new item.
+        """
+        if self._playlist is None:
+            raise RuntimeError('No playlist loaded')
+        if isinstance(item, str):
+            index = self._playlist.index(os.path.normpath(item))
+        else:
+            index = item
+        filepath = self._playlist[index]
+
+        startTime = time.perf_counter()
+        self._sendCommand('goto %d' % (self._playlistItemIds[index],))
+        while True:
+            # status includes both current input and state, so check both from one reply
+            resp = self._sendCommand('status')
+            stateMatch = _stateRegex.search(resp)
+            inputMatch = _inputRegex.search(resp)
+            if stateMatch is not None and stateMatch.group(1) == 'playing' \
+                    and inputMatch is not None and _uriToPath(inputMatch.group(1)) == filepath:
+                break
+            if time.perf_counter() - startTime > timeout:
+                raise TimeoutError('VLC did not start playing %s within %.1f s' % (filepath, timeout))
+            time.sleep(self._statusPollInterval)
+        latency = time.perf_counter() - startTime
+
+        logger.info('VLC switched to playlist item %d (%s) in %.1f ms' % (index, os.path.basename(filepath), latency * 1e3))
+        return latency
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+import logging
+import re
+import select
+import socket
+import time
+import typing as tp
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+# telnet protocol bytes (RFC 854)
+_IAC = 255
+_SB = 250
+_SE = 240
+_WILL, _WONT, _DO, _DONT = 251, 252, 253, 254
+
+_recvChunkSize = 4096
+
+# VLC's telnet interface writes a '> ' prompt at the start of a line once it has finished
+# replying to a command (and after a successful login)
+_promptRegex = re.compile(rb'(?:^|\n)> ')
+_loginResultRegex = re.compile(rb'(?:^|\n)> |Wrong password')
+
+
+class VLCTelnetError(RuntimeError):
+    pass
+
+
+@attr.s(auto_attribs=True, eq=False)
+class VLCTelnetClient:
+    """
+    Client for VLC's telnet remote control interface.
+
+    Replies are delimited by VLC's '> ' prompt, so each command returns as soon as its reply is
+    complete rather than after a fixed timeout. `timeout` only bounds how long to wait for a
+    reply that never completes (e.g. if VLC hangs).
+    """
+    host: str = 'localhost'
+    port: int = 4212
+    timeout: float = 5.  # in s
+
+    _sock: tp.Optional[socket.socket] = attr.ib(init=False, default=None)
+    _recvBuf: bytearray = attr.ib(init=False, factory=lambda: bytearray(_recvChunkSize))  # reused for every read
+    _raw: bytearray = attr.ib(init=False, factory=bytearray)  # received bytes not yet stripped of telnet negotiation
+    _pending: bytearray = attr.ib(init=False, factory=bytearray)  # received text not yet consumed by a reply
+    _isDesynced: bool = attr.ib(init=False, default=False)  # whether a previous reply was abandoned partway
+
+    @property
+    def isConnected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self, password: str):
+        assert self._sock is None
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._raw.clear()
+        self._pending.clear()
+        self._isDesynced = False
+
+        self._readUntil(re.compile(rb'Password: ?'))
+        self._send(password)
+        _, result = self._readUntil(_loginResultRegex)
+        if result == b'Wrong password':
+            self.close()
+            raise PermissionError('VLC rejected telnet password')
+        logger.debug('Connected to VLC telnet interface on port %d' % (self.port,))
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def command(self, cmd: str, timeout: tp.Optional[float] = None) -> str:
+        """
+        Send a command and return VLC's reply, without the trailing prompt.
+        """
+        if self._sock is None:
+            raise VLCTelnetError('Not connected to VLC')
+        if self._isDesynced:
+            self._discardReceived()
+        self._send(cmd)
+        try:
+            return self._readReply(timeout=timeout)
+        except (TimeoutError, socket.timeout):
+            # any late remainder of this reply must not be mistaken for the next one
+            self._isDesynced = True
+            raise
+
+    def sendWithoutReply(self, cmd: str):
+        """
+        Send a command after which VLC won't write a prompt (e.g. 'shutdown', 'logout').
+        """
+        if self._sock is None:
+            raise VLCTelnetError('Not connected to VLC')
+        self._send(cmd)
+
+    def _send(self, s: str):
+        self._sock.sendall(s.encode('utf-8') + b'\n')
+
+    def _readReply(self, timeout: tp.Optional[float] = None) -> str:
+        reply, _ = self._readUntil(_promptRegex, timeout=timeout)
+        return reply.decode('utf-8', errors='replace').rstrip('\r\n')
+
+    def _readUntil(self, delimiterRegex: tp.Pattern, timeout: tp.Optional[float] = None) -> tp.Tuple[bytes, bytes]:
+        """
+        Consume everything received up to and including the first match of delimiterRegex.
+
+        Returns (everything before the match, the match).
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        searchStart = 0
+        while True:
+            match = delimiterRegex.search(self._pending, searchStart)
+            if match is not None:
+                # keep a preceding newline (matched as part of the prompt) with the reply
+                end = match.start() + (1 if self._pending[match.start():match.start()+1] == b'\n' else 0)
+                out = bytes(self._pending[:end])
+                matched = bytes(match.group(0))  # copy before match's underlying buffer is modified below
+                del self._pending[:match.end()]
+                return out, matched
+            # delimiters are short, so only need to re-search the tail of what was already searched
+            searchStart = max(0, len(self._pending) - 8)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('Timed out waiting for reply from VLC (received so far: %r)' % (bytes(self._pending),))
+            self._sock.settimeout(remaining)
+            self._receive()
+
+    def _receive(self):
+        numBytes = self._sock.recv_into(self._recvBuf)
+        if numBytes == 0:
+            self.close()
+            raise ConnectionError('VLC closed telnet connection')
+        self._raw += memoryview(self._recvBuf)[:numBytes]
+        self._stripNegotiation()
+
+    def _stripNegotiation(self):
+        """
+        Move text from _raw to _pending, dropping telnet negotiation sequences (e.g. VLC turns
+        echo off and on around the password prompt). Incomplete sequences are left in _raw.
+        """
+        raw = self._raw
+        iStart = 0
+        while True:
+            iIAC = raw.find(_IAC, iStart)
+            if iIAC < 0:
+                self._pending += raw[iStart:]
+                raw.clear()
+                return
+            self._pending += raw[iStart:iIAC]
+            if iIAC + 1 >= len(raw):
+                break  # incomplete
+            cmd = raw[iIAC + 1]
+            if cmd == _IAC:
+                self._pending.append(_IAC)  # escaped literal 255
+                iStart = iIAC + 2
+            elif cmd in (_WILL, _WONT, _DO, _DONT):
+                if iIAC + 2 >= len(raw):
+                    break  # incomplete
+                iStart = iIAC + 3
+            elif cmd == _SB:
+                iSE = raw.find(bytes((_IAC, _SE)), iIAC + 2)
+                if iSE < 0:
+                    break  # incomplete
+                iStart = iSE + 2
+            else:
+                iStart = iIAC + 2
+        del raw[:iIAC]
+
+    def _discardReceived(self):
+        """
+        Drop anything already received or in flight, to resynchronize after an abandoned reply.
+        """
+        self._sock.settimeout(0.)
+        try:
+            while len(select.select([self._sock], [], [], 0.05)[0]) > 0:
+                self._receive()
+        except (BlockingIOError, socket.timeout):
+            pass
+        self._raw.clear()
+        self._pending.clear()
+        self._isDesynced = False
@@ -1,2 +1,4 @@
+from .VLCTelnetClient import VLCTelnetClient
 from .VLCRemote import VLCRemote
+from .VLCInstancePool import VLCInstancePool
 from .VLCControlAction import VLCControlAction
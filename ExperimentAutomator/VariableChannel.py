@@ -0,0 +1,197 @@
+"""
+Channel through which scripts started by the experiment can read and assign its locals (see
+VariableChannelClient for the script side).
+
+The server listens on a local ZMQ socket, and scripts find it (and the token that authenticates
+requests) through environment variables set when they are started. Requests are JSON, followed by
+pickled values; numpy arrays of at least VariableChannelClient.sharedMemoryMinBytes are passed in
+shared memory instead:
+- get {names}: reply with the values of the given locals, as encoded on the GUI thread.
+- set {values}: assign locals, on the GUI thread. Replies once they have been assigned.
+Requests the GUI thread does not handle within a timeout are dropped and answered with an error.
+- release {blocks}: the client has attached to shared memory sent by get, so it can be unlinked.
+- list: reply with the names of all locals.
+"""
+import json
+import logging
+import secrets
+import threading
+import typing as tp
+from multiprocessing import shared_memory
+
+import attr
+import zmq
+from qtpy import QtCore
+
+from ExperimentAutomator.Misc import Singleton
+from ExperimentAutomator.VariableChannelClient import addressEnvVar, tokenEnvVar, encodeValue, decodeValue
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _GuiRequest:
+    """
+    Work for the GUI thread on behalf of the server thread, which is dropped rather than run late
+    if the server thread stopped waiting for it.
+    """
+    fn: tp.Callable[[], tp.Any]
+    result: tp.Any = attr.ib(init=False, default=None)
+    error: tp.Optional[Exception] = attr.ib(init=False, default=None)
+    _isDone: threading.Event = attr.ib(init=False, factory=threading.Event)
+    _isAbandoned: bool = attr.ib(init=False, default=False)
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    def run(self):
+        with self._lock:
+            if self._isAbandoned:
+                return
+            try:
+                self.result = self.fn()
+            except Exception as e:
+                self.error = e
+            self._isDone.set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Returns whether the request was handled. If not, it is abandoned so it will not be handled later.
+        """
+        if self._isDone.wait(timeout):
+            return True
+        with self._lock:
+            if self._isDone.is_set():
+                return True  # finished while timing out
+            self._isAbandoned = True
+            return False
+
+
+class _ChannelSignals(QtCore.QObject):
+    sigVariablesSet = QtCore.Signal(object)  # emits list of names, after assigning them
+
+    _sigGuiRequested = QtCore.Signal(object)  # emits _GuiRequest, from server thread
+
+
+@attr.s(auto_attribs=True, eq=False)
+class VariableChannelServer(metaclass=Singleton):
+    _guiTimeout: float = 5.  # in s, for the GUI thread to read or assign values (e.g. if it is blocked)
+
+    signals: _ChannelSignals = attr.ib(init=False, factory=_ChannelSignals)
+    _locals: tp.Optional[tp.Dict[str, tp.Any]] = attr.ib(init=False, default=None)
+    _token: str = attr.ib(init=False, factory=lambda: secrets.token_hex(16))
+    _address: tp.Optional[str] = attr.ib(init=False, default=None)
+    _context: zmq.Context = attr.ib(init=False, factory=zmq.Context.instance)
+    _thread: tp.Optional[threading.Thread] = attr.ib(init=False, default=None)
+    _isStopping: bool = attr.ib(init=False, default=False)
+    _pendingBlocks: tp.Dict[str, shared_memory.SharedMemory] = attr.ib(init=False, factory=dict)  # sent by get, not yet released
+
+    def __attrs_post_init__(self):
+        self.signals._sigGuiRequested.connect(self._onGuiRequested)  # queued, since emitted from server thread
+
+    def serve(self, locals: tp.Dict[str, tp.Any]) -> tp.Dict[str, str]:
+        """
+        Start serving the given locals (which should be the experiment's locals, not a copy), if not
+        already. Returns environment variables through which a script can connect.
+        """
+        self._locals = locals
+        if self._thread is None:
+            sock = self._context.socket(zmq.ROUTER)
+            sock.linger = 0
+            port = sock.bind_to_random_port('tcp://127.0.0.1')
+            self._address = 'tcp://127.0.0.1:%d' % (port,)
+            self._thread = threading.Thread(target=self._run, args=(sock,), daemon=True, name='VariableChannelServer')
+            self._thread.start()
+            logger.debug('Variable channel listening on %s' % (self._address,))
+        return {addressEnvVar: self._address, tokenEnvVar: self._token}
+
+    def close(self):
+        if self._thread is not None:
+            self._isStopping = True
+            self._thread.join()
+            self._thread = None
+            self._isStopping = False
+        for shm in self._pendingBlocks.values():
+            self._unlink(shm)
+        self._pendingBlocks.clear()
+
+    def _run(self, sock: zmq.Socket):
+        try:
+            while not self._isStopping:
+                if sock.poll(timeout=100) == 0:
+                    continue
+                frames = sock.recv_multipart()
+                # ROUTER prepends sender identity, followed by the envelope delimiter (from REQ)
+                iDelimiter = next(i for i, frame in enumerate(frames) if len(frame) == 0)
+                envelope = frames[:iDelimiter + 1]
+                try:
+                    message = json.loads(frames[iDelimiter + 1])
+                    if not secrets.compare_digest(message.get('token', ''), self._token):
+                        raise PermissionError('Invalid token')
+                    reply, replyFrames = self._handleMessage(message, frames[iDelimiter + 2:])
+                except Exception as e:
+                    logger.error('Error handling variable channel request: %s' % (e,))
+                    reply, replyFrames = dict(type='error', message='%s: %s' % (type(e).__name__, e)), []
+                sock.send_multipart(envelope + [json.dumps(reply).encode('utf-8')] + replyFrames)
+        finally:
+            sock.close(linger=0)
+
+    def _handleMessage(self, message: tp.Dict[str, tp.Any], frames: tp.List[bytes]) -> tp.Tuple[tp.Dict[str, tp.Any], tp.List[bytes]]:
+        msgType = message.get('type')
+        if msgType == 'get':
+            descriptors, replyFrames, blocks = self._callOnGuiThread(lambda: self._encodeLocals(message['names']))
+            for shm in blocks:
+                self._pendingBlocks[shm.name] = shm
+            return dict(type='values', values=descriptors), replyFrames
+        elif msgType == 'release':
+            for name in message['blocks']:
+                shm = self._pendingBlocks.pop(name, None)
+                if shm is not None:
+                    self._unlink(shm)
+            return dict(type='ack'), []
+        elif msgType == 'set':
+            # copy out of shared memory, which the client unlinks after the reply
+            values = {name: decodeValue(descriptor, frames, doCopy=True) for name, descriptor in message['values'].items()}
+            self._callOnGuiThread(lambda: self._assignLocals(values))
+            return dict(type='ack'), []
+        elif msgType == 'list':
+            return dict(type='names', names=sorted(name for name in list(self._locals) if not name.startswith('__'))), []
+        else:
+            raise NotImplementedError('Unknown message type %s' % (msgType,))
+
+    def _callOnGuiThread(self, fn: tp.Callable[[], tp.Any]) -> tp.Any:
+        request = _GuiRequest(fn=fn)
+        self.signals._sigGuiRequested.emit(request)
+        if not request.wait(self._guiTimeout):
+            raise TimeoutError('Request not handled by GUI thread within %.3g s, so dropped' % (self._guiTimeout,))
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _onGuiRequested(self, request: _GuiRequest):
+        request.run()
+
+    def _encodeLocals(self, names: tp.List[str]) -> tp.Tuple[tp.Dict[str, tp.Any], tp.List[bytes], tp.List[shared_memory.SharedMemory]]:
+        # on GUI thread, so values are not modified while being pickled or copied to shared memory
+        missing = [name for name in names if name not in self._locals]
+        if len(missing) > 0:
+            raise KeyError('No variable(s) named %s' % (', '.join(missing),))
+        replyFrames, blocks = [], []
+        try:
+            descriptors = {name: encodeValue(self._locals[name], replyFrames, blocks) for name in names}
+        except Exception:
+            for shm in blocks:
+                self._unlink(shm)
+            raise
+        return descriptors, replyFrames, blocks
+
+    def _assignLocals(self, values: tp.Dict[str, tp.Any]):
+        self._locals.update(values)
+        logger.info('Variables set by script: %s' % (', '.join(values),))
+        self.signals.sigVariablesSet.emit(list(values))
+
+    @staticmethod
+    def _unlink(shm: shared_memory.SharedMemory):
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,165 @@
+"""
+Client for the variable channel (see VariableChannel), for use in scripts started by runScript,
+runPython, or runScriptInBackground jobs, e.g.:
+
+    from ExperimentAutomator.VariableChannelClient import getVariables, setVariables
+    stimuli, subjectID = getVariables('stimuli', 'subjectID')
+    ...
+    setVariables(meanRT=meanRT, epochs=epochs)
+
+Only depends on pyzmq (and numpy, if transferring arrays), so can also be copied next to scripts
+run in a different environment.
+
+Large numpy arrays are transferred via shared memory rather than through the socket: arrays
+received are views of shared memory, which stays mapped until the script exits.
+"""
+import json
+import os
+import pickle
+import sys
+import typing as tp
+from multiprocessing import shared_memory
+
+import zmq
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+addressEnvVar = 'EXPERIMENT_AUTOMATOR_CHANNEL'
+tokenEnvVar = 'EXPERIMENT_AUTOMATOR_CHANNEL_TOKEN'
+
+sharedMemoryMinBytes = 65536  # smaller arrays are pickled instead
+
+_attachedBlocks: tp.List[shared_memory.SharedMemory] = []  # kept open while arrays viewing them may exist
+
+
+def attachSharedMemory(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing block, without the resource tracker unlinking it when this process exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def encodeValue(value: tp.Any, frames: tp.List[bytes], blocks: tp.List[shared_memory.SharedMemory]) -> tp.Dict[str, tp.Any]:
+    """
+    Returns a JSON-serializable descriptor of value, appending any data to frames, and any shared
+    memory created to blocks (which the caller is responsible for releasing).
+    """
+    if np is not None and isinstance(value, np.ndarray) and value.nbytes >= sharedMemoryMinBytes and not value.dtype.hasobject:
+        shm = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        blocks.append(shm)
+        np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+        return dict(kind='array', block=shm.name, dtype=value.dtype.str, shape=list(value.shape))
+    frames.append(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    return dict(kind='pickle', frame=len(frames) - 1)
+
+
+def decodeValue(descriptor: tp.Dict[str, tp.Any], frames: tp.Sequence[bytes], doCopy: bool) -> tp.Any:
+    """
+    Inverse of encodeValue. If not doCopy, arrays are views of shared memory that is kept attached.
+    """
+    if descriptor['kind'] == 'pickle':
+        return pickle.loads(frames[descriptor['frame']])
+    elif descriptor['kind'] == 'array':
+        shm = attachSharedMemory(descriptor['block'])
+        view = np.ndarray(tuple(descriptor['shape']), dtype=np.dtype(descriptor['dtype']), buffer=shm.buf)
+        if doCopy:
+            value = view.copy()
+            del view
+            shm.close()
+            return value
+        _attachedBlocks.append(shm)
+        return view
+    else:
+        raise NotImplementedError('Unknown value kind %s' % (descriptor['kind'],))
+
+
+class VariableChannelClient:
+    def __init__(self, address: tp.Optional[str] = None, token: tp.Optional[str] = None, timeout: float = 10.):
+        if address is None:
+            address = os.environ.get(addressEnvVar)
+            if address is None:
+                raise RuntimeError('%s not set; was this script started by ExperimentAutomator?' % (addressEnvVar,))
+        if token is None:
+            token = os.environ.get(tokenEnvVar, '')
+        self._token = token
+        self._context = zmq.Context.instance()
+        self._sock = self._context.socket(zmq.REQ)
+        self._sock.linger = 0
+        self._sock.rcvtimeo = round(timeout * 1e3)
+        self._sock.setsockopt(zmq.REQ_RELAXED, 1)  # so that a request can be sent again after a timeout
+        self._sock.setsockopt(zmq.REQ_CORRELATE, 1)
+        self._sock.connect(address)
+
+    def get(self, *names: str) -> tp.Dict[str, tp.Any]:
+        reply, frames = self._request(dict(type='get', names=list(names)))
+        values = {name: decodeValue(descriptor, frames, doCopy=False) for name, descriptor in reply['values'].items()}
+        blockNames = [descriptor['block'] for descriptor in reply['values'].values() if descriptor['kind'] == 'array']
+        if len(blockNames) > 0:
+            self._request(dict(type='release', blocks=blockNames))  # attached now, so no longer needed by the server
+        return values
+
+    def set(self, **values: tp.Any):
+        frames, blocks = [], []
+        try:
+            descriptors = {name: encodeValue(value, frames, blocks) for name, value in values.items()}
+            self._request(dict(type='set', values=descriptors), frames)
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def listVariables(self) -> tp.List[str]:
+        reply, _ = self._request(dict(type='list'))
+        return reply['names']
+
+    def close(self):
+        self._sock.close(linger=0)
+
+    def _request(self, message: tp.Dict[str, tp.Any], frames: tp.Sequence[bytes] = ()) -> tp.Tuple[tp.Dict[str, tp.Any], tp.List[bytes]]:
+        message['token'] = self._token
+        self._sock.send_multipart([json.dumps(message).encode('utf-8')] + list(frames))
+        try:
+            replyFrames = self._sock.recv_multipart()
+        except zmq.Again:
+            raise TimeoutError('No reply from ExperimentAutomator to %s request' % (message['type'],))
+        reply = json.loads(replyFrames[0])
+        if reply['type'] == 'error':
+            raise RuntimeError(reply['message'])
+        return reply, replyFrames[1:]
+
+
+_defaultClient: tp.Optional[VariableChannelClient] = None
+
+
+def _getDefaultClient() -> VariableChannelClient:
+    global _defaultClient
+    if _defaultClient is None:
+        _defaultClient = VariableChannelClient()
+    return _defaultClient
+
+
+def getVariables(*names: str) -> tp.Any:
+    """
+    Get the experiment's current values of the given variables: one value if one name given, else a
+    tuple of values.
+    """
+    values = _getDefaultClient().get(*names)
+    if len(names) == 1:
+        return values[names[0]]
+    return tuple(values[name] for name in names)
+
+
+def setVariables(**values: tp.Any):
+    """
+    Assign variables in the experiment's locals. Returns once they have been assigned.
+    """
+    _getDefaultClient().set(**values)
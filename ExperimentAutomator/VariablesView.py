@@ -1,9 +1,16 @@
 import ast
+import collections
+import concurrent.futures
 import logging
+import sys
+import types
 import typing as tp
 
+import numpy as np
+import pandas as pd
 from qtpy import QtCore, QtGui, QtWidgets
 
+from ExperimentAutomator.Configuration import globalConfiguration
 from ExperimentAutomator.Experiment import Experiment
 
 logger = logging.getLogger(__name__)
@@ -16,6 +23,15 @@ _EDITABLE_TYPES = (bool, int, float, str, type(None))
 _valueDisplayLimit = 100
 _valueTooltipLimit = 2000
 
+# upper bound on the number of objects visited when estimating the size of one variable, so
+# that e.g. a huge list of small objects can't tie up the estimator thread indefinitely
+_sizeEstimateMaxObjects = 1_000_000
+
+# objects whose referents are shared with the rest of the program rather than owned by a
+# variable; these are counted by their own size only and never recursed into
+_SIZE_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+                      types.MethodType, types.CodeType, types.FrameType, QtCore.QObject)
+
 
 class _RowSnapshot(tp.NamedTuple):
     key: tp.Any  # raw dict key, kept for lookups back into locals
@@ -24,6 +40,7 @@ class _RowSnapshot(tp.NamedTuple):
     displayText: str
     tooltipText: str
     editable: bool
+    version: tp.Tuple[int, int]  # changes whenever the held object or its repr changes
 
 
 def _safeRepr(value: tp.Any) -> str:
@@ -54,9 +71,79 @@ def _buildRowSnapshot(key: tp.Any, value: tp.Any) -> _RowSnapshot:
         displayText=_truncate(fullRepr, _valueDisplayLimit),
         tooltipText=_truncate(fullRepr, _valueTooltipLimit),
         editable=type(value) in _EDITABLE_TYPES,
+        version=(id(value), hash(fullRepr)),
     )
 
 
+def _estimateDeepSize(value: tp.Any) -> tp.Tuple[int, bool]:
+    """
+    Estimate the memory held by a variable, following references into containers and object
+    attributes. Objects reachable more than once (including via cycles) are only counted once.
+
+    Returns (numBytes, isComplete); isComplete is False if the traversal was cut short.
+    """
+    seen: tp.Set[int] = set()
+    stack = [value]
+    total = 0
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if len(seen) > _sizeEstimateMaxObjects:
+            return total, False
+
+        if isinstance(obj, np.ndarray):
+            # getsizeof includes the data buffer only for arrays that own their data; a view
+            # counts its header here and the shared buffer once, via its base
+            total += sys.getsizeof(obj)
+            if obj.base is not None:
+                stack.append(obj.base)
+            if obj.dtype.hasobject:
+                stack.extend(obj.ravel().tolist())
+            continue
+
+        if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+            usage = obj.memory_usage(deep=True)
+            total += int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+            continue
+
+        try:
+            total += sys.getsizeof(obj)
+        except TypeError:
+            pass  # some extension types don't support getsizeof
+
+        if isinstance(obj, _SIZE_OPAQUE_TYPES):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, bytearray, int, float, complex, bool)):
+            pass
+        else:
+            d = getattr(obj, '__dict__', None)
+            if isinstance(d, dict):
+                stack.append(d)
+            for slot in getattr(type(obj), '__slots__', ()):
+                if isinstance(slot, str) and hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+
+    return total, True
+
+
+def _formatNumBytes(numBytes: int) -> str:
+    size = float(numBytes)
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024
+    if unit == 'B':
+        return '%d B' % numBytes
+    return '%.1f %s' % (size, unit)
+
+
 def _parseEditText(text: str, targetType: type) -> tp.Any:
     """
     Parse editor text as a Python literal, preserving the target type.
@@ -93,12 +180,26 @@ def _parseEditText(text: str, targetType: type) -> tp.Any:
 
 
 class LocalsTableModel(QtCore.QAbstractTableModel):
-    _columnLabels: tp.ClassVar[tp.Tuple[str, ...]] = ('Name', 'Type', 'Value')
+    _columnLabels: tp.ClassVar[tp.Tuple[str, ...]] = ('Name', 'Type', 'Size', 'Value')
+    _sizeColumn: tp.ClassVar[int] = 2
+    _valueColumn: tp.ClassVar[int] = 3
+
+    sigTotalSizeChanged = QtCore.Signal(object, bool)  # emits (total bytes, whether all variables are estimated)
+    _sigSizeEstimated = QtCore.Signal(object, object, object)  # emits (key, version, (numBytes, isComplete)), possibly from estimator thread
 
     def __init__(self, experiment: Experiment, parent: tp.Optional[QtCore.QObject] = None):
         QtCore.QAbstractTableModel.__init__(self, parent=parent)
         self._exp = experiment
         self._rows: tp.List[_RowSnapshot] = []
+
+        # deep size estimates can take a while for large containers, so are computed on a
+        # single background thread and cached per key until the variable's version changes
+        self._sizeCache: tp.Dict[tp.Any, tp.Tuple[tp.Tuple[int, int], int, bool]] = dict()  # key -> (version, numBytes, isComplete)
+        self._pendingSizeVersions: tp.Dict[tp.Any, tp.Tuple[int, int]] = dict()
+        self._sizeExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                   thread_name_prefix='VariableSizeEstimator')
+        self._sigSizeEstimated.connect(self._onSizeEstimated)
+
         self.refreshFromLocals()
 
     def rowCount(self, parent=QtCore.QModelIndex()):
@@ -129,12 +230,21 @@ class LocalsTableModel(QtCore.QAbstractTableModel):
         col = index.column()
 
         if role == QtCore.Qt.DisplayRole:
-            return (row.nameText, row.typeName, row.displayText)[col]
+            if col == self._sizeColumn:
+                return self._sizeText(row)
+            return (row.nameText, row.typeName, None, row.displayText)[col]
         elif role == QtCore.Qt.ToolTipRole:
-            if col == 2:
+            if col == self._valueColumn:
                 return row.tooltipText
+            elif col == self._sizeColumn:
+                cached = self._sizeCache.get(row.key, None)
+                if cached is not None and not cached[2]:
+                    return 'Estimate incomplete: too many objects to visit'
+        elif role == QtCore.Qt.TextAlignmentRole:
+            if col == self._sizeColumn:
+                return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         elif role == QtCore.Qt.EditRole:
-            if col != 2:
+            if col != self._valueColumn:
                 return None
             # look up the live value rather than the snapshot so the editor pre-fills the
             # current value; repr() form round-trips through _parseEditText unchanged
@@ -154,12 +264,12 @@ class LocalsTableModel(QtCore.QAbstractTableModel):
         flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
         # editability comes from the snapshot, not a live lookup: flags() is called
         # constantly during painting; setData re-validates against the live value anyway
-        if index.column() == 2 and self._rows[index.row()].editable:
+        if index.column() == self._valueColumn and self._rows[index.row()].editable:
             flags |= QtCore.Qt.ItemIsEditable
         return flags
 
     def setData(self, index: QtCore.QModelIndex, value: tp.Any, role: int = QtCore.Qt.EditRole) -> bool:
-        if role != QtCore.Qt.EditRole or not index.isValid() or index.column() != 2:
+        if role != QtCore.Qt.EditRole or not index.isValid() or index.column() != self._valueColumn:
             return False
 
         key = self._rows[index.row()].key
@@ -192,7 +302,8 @@ class LocalsTableModel(QtCore.QAbstractTableModel):
         logger.info('Variable %s changed from %s to %s via Variables panel' % (
             key, _safeRepr(oldVal), _safeRepr(newVal)))
         self._rows[index.row()] = _buildRowSnapshot(key, newVal)
-        self.dataChanged.emit(self.index(index.row(), 1), self.index(index.row(), 2))
+        self.dataChanged.emit(self.index(index.row(), 1), self.index(index.row(), self._valueColumn))
+        self._requestSizeEstimates()
         return True
 
     def refreshFromLocals(self):
@@ -202,11 +313,85 @@ class LocalsTableModel(QtCore.QAbstractTableModel):
             for iRow, (oldRow, newRow) in enumerate(zip(self._rows, newRows)):
                 if oldRow != newRow:
                     self._rows[iRow] = newRow
-                    self.dataChanged.emit(self.index(iRow, 1), self.index(iRow, 2))
+                    self.dataChanged.emit(self.index(iRow, 1), self.index(iRow, self._valueColumn))
         else:
             self.beginResetModel()
             self._rows = newRows
             self.endResetModel()
+        self._requestSizeEstimates()
+
+    def _sizeText(self, row: _RowSnapshot) -> str:
+        cached = self._sizeCache.get(row.key, None)
+        if cached is None:
+            return ''  # not estimated yet
+        # while a changed variable is being re-estimated, keep showing its previous size
+        # rather than blanking the cell every refresh
+        _, numBytes, isComplete = cached
+        return ('' if isComplete else '>') + _formatNumBytes(numBytes)
+
+    def _requestSizeEstimates(self):
+        currentKeys = set()
+        for row in self._rows:
+            currentKeys.add(row.key)
+            cached = self._sizeCache.get(row.key, None)
+            if cached is not None and cached[0] == row.version:
+                continue
+            if self._pendingSizeVersions.get(row.key, None) == row.version:
+                continue
+            if row.key not in self._exp.locals:
+                continue
+            self._pendingSizeVersions[row.key] = row.version
+            future = self._sizeExecutor.submit(_estimateDeepSize, self._exp.locals[row.key])
+            future.add_done_callback(
+                lambda future, key=row.key, version=row.version: self._onSizeEstimateDone(key, version, future))
+
+        for key in list(self._sizeCache.keys()):
+            if key not in currentKeys:
+                del self._sizeCache[key]
+
+        self._emitTotalSize()
+
+    def _onSizeEstimateDone(self, key: tp.Any, version: tp.Tuple[int, int], future: concurrent.futures.Future):
+        # called from the estimator thread; hand the result back to the GUI thread via a queued signal
+        try:
+            result = future.result()
+        except Exception as e:
+            # e.g. a container mutated by the running experiment while it was being traversed;
+            # the next refresh will retry
+            logger.debug('Unable to estimate size of variable %s: %s' % (key, e))
+            result = None
+        try:
+            self._sigSizeEstimated.emit(key, version, result)
+        except RuntimeError:
+            pass  # model already deleted (e.g. during shutdown)
+
+    def _onSizeEstimated(self, key: tp.Any, version: tp.Tuple[int, int], result: tp.Optional[tp.Tuple[int, bool]]):
+        if self._pendingSizeVersions.get(key, None) == version:
+            del self._pendingSizeVersions[key]
+        if result is None:
+            return
+        for iRow, row in enumerate(self._rows):
+            if row.key == key:
+                if row.version != version:
+                    return  # outdated estimate; a newer one has been or will be requested
+                self._sizeCache[key] = (version, result[0], result[1])
+                self.dataChanged.emit(self.index(iRow, self._sizeColumn), self.index(iRow, self._sizeColumn))
+                break
+        self._emitTotalSize()
+
+    def _emitTotalSize(self):
+        # note: objects shared between variables are counted once per variable
+        total = 0
+        isComplete = True
+        for row in self._rows:
+            cached = self._sizeCache.get(row.key, None)
+            if cached is None:
+                isComplete = False
+                continue
+            total += cached[1]
+            if cached[0] != row.version or not cached[2]:
+                isComplete = False
+        self.sigTotalSizeChanged.emit(total, isComplete)
 
 
 class VariablesTableView(QtWidgets.QTableView):
@@ -236,7 +421,20 @@ class VariablesDockWidget(QtWidgets.QDockWidget):
         self._view.setModel(self._model)
         self._view.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
         self._view.horizontalHeader().setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
-        self.setWidget(self._view)
+        self._view.horizontalHeader().setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents)
+
+        self._totalSizeLabel = QtWidgets.QLabel('')
+        self._totalSizeLabel.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self._isOverSizeThreshold = False
+        self._model.sigTotalSizeChanged.connect(self._onTotalSizeChanged)
+
+        container = QtWidgets.QWidget(self)
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self._view)
+        layout.addWidget(self._totalSizeLabel)
+        container.setLayout(layout)
+        self.setWidget(container)
 
         # a periodic refresh (only while visible) is the only way to catch in-place mutation
         # of held objects (e.g. conf.addConfiguration(...)), which changes no keys and emits
@@ -256,6 +454,28 @@ class VariablesDockWidget(QtWidgets.QDockWidget):
         else:
             self._refreshTimer.stop()
 
+    def _onTotalSizeChanged(self, totalNumBytes: int, isComplete: bool):
+        try:
+            thresholdMB = globalConfiguration.VariablesMemoryWarningThresholdMB
+        except KeyError:
+            thresholdMB = None
+
+        text = 'Total: %s%s' % (_formatNumBytes(totalNumBytes), '' if isComplete else ' (estimating...)')
+        isOverThreshold = thresholdMB is not None and totalNumBytes > float(thresholdMB) * 2**20
+        if isOverThreshold:
+            text += ' (over warning threshold of %s MB)' % (thresholdMB,)
+            isDark = self.palette().color(QtGui.QPalette.Base).lightness() < 128
+            clr = QtGui.QColor(255, 80, 80) if isDark else QtGui.QColor(255, 0, 0)
+            self._totalSizeLabel.setStyleSheet('QLabel { color: %s; font-weight: bold; }' % (clr.name(),))
+        else:
+            self._totalSizeLabel.setStyleSheet('')
+        self._totalSizeLabel.setText(text)
+
+        if isOverThreshold and not self._isOverSizeThreshold:
+            logger.warning('Variables are using an estimated %s, over the warning threshold of %s MB' % (
+                _formatNumBytes(totalNumBytes), thresholdMB))
+        self._isOverSizeThreshold = isOverThreshold
+
     def refresh(self):
         if not self.isVisible():
             return
@@ -1,5 +1,10 @@
+import os
 import time
 
 print('Start of external script')
 time.sleep(10)
+if 'EXPERIMENT_AUTOMATOR_CHANNEL' in os.environ:
+    # started by ExperimentAutomator, so can pass results back to the experiment
+    from ExperimentAutomator.VariableChannelClient import setVariables
+    setVariables(externalScriptEndTime=time.time())
 print('End of external script')